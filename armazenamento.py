@@ -0,0 +1,334 @@
+import os
+import json
+import threading
+from contextlib import ExitStack
+
+from snapshot_binario import RegistrosMapeados, SnapshotBinario, codificar_snapshot
+
+
+def dados_padrao():
+    return {"alunos": {}, "professores": {}, "disciplinas": {}, "turmas": {}}
+
+
+def normalizar_turma(turma):
+    # Versões anteriores guardavam uma cópia de cada aluno dentro da turma;
+    # o registro canônico é o de dados["alunos"].
+    turma.pop("alunos", None)
+    return turma
+
+
+def normalizar_dados(dados):
+    for turma in dados["turmas"].values():
+        normalizar_turma(turma)
+    return dados
+
+
+def operacao_legada(operacao):
+    caminho = operacao["caminho"]
+    return len(caminho) >= 3 and caminho[0] == "turmas" and caminho[2] == "alunos"
+
+
+def aplicar_operacao(dados, operacao):
+    *caminho, chave = operacao["caminho"]
+    alvo = dados
+    for parte in caminho:
+        alvo = alvo[parte]
+
+    if operacao["op"] == "definir":
+        alvo[chave] = operacao["valor"]
+    elif operacao["op"] == "restaurar":
+        # Gravada quando uma transação é desfeita (ver `BancoDados`).
+        if operacao["existia"]:
+            alvo[chave] = operacao["valor"]
+        elif chave in alvo:
+            del alvo[chave]
+    else:
+        raise ValueError(f"Operação desconhecida: {operacao['op']}")
+
+
+def ler_caminho(dados, caminho):
+    """Devolve (existe, valor) do que está em `caminho` agora."""
+    *caminho, chave = caminho
+    alvo = dados
+    for parte in caminho:
+        alvo = alvo[parte]
+    return (True, alvo[chave]) if chave in alvo else (False, None)
+
+
+def restaurar_caminho(dados, caminho, existia, valor):
+    *caminho, chave = caminho
+    alvo = dados
+    for parte in caminho:
+        alvo = alvo[parte]
+    if existia:
+        alvo[chave] = valor
+    elif chave in alvo:
+        del alvo[chave]
+
+
+def ler_json(caminho_arquivo):
+    if os.path.exists(caminho_arquivo) and os.path.getsize(caminho_arquivo) > 0:
+        try:
+            with open(caminho_arquivo, "r", encoding="utf-8") as arquivo:
+                data = json.load(arquivo)
+                return normalizar_dados(data) if data else dados_padrao()
+        except json.JSONDecodeError:
+            print("AVISO NO SERVIDOR: Arquivo JSON corrompido. Inicializando com padrão.")
+        except Exception as e:
+            print(f"ERRO NO SERVIDOR ao carregar dados: {e}")
+
+    return dados_padrao()
+
+
+def escrever_temporario(caminho_arquivo, conteudo):
+    temporario = caminho_arquivo + ".tmp"
+    if isinstance(conteudo, bytes):
+        arquivo = open(temporario, "wb")
+    else:
+        arquivo = open(temporario, "w", encoding="utf-8")
+    with arquivo:
+        arquivo.write(conteudo)
+        arquivo.flush()
+        os.fsync(arquivo.fileno())
+    return temporario
+
+
+def escrever_atomico(caminho_arquivo, conteudo):
+    os.replace(escrever_temporario(caminho_arquivo, conteudo), caminho_arquivo)
+    sincronizar_diretorio(caminho_arquivo)
+
+
+def sincronizar_diretorio(caminho_arquivo):
+    if os.name != 'nt':
+        # Garante que a renomeação em si sobreviva a uma queda de energia.
+        diretorio = os.open(os.path.dirname(os.path.abspath(caminho_arquivo)), os.O_RDONLY)
+        try:
+            os.fsync(diretorio)
+        finally:
+            os.close(diretorio)
+
+
+class Armazenamento:
+    """Interface comum dos mecanismos de persistência usados pelo BancoDados.
+
+    `carregar()` devolve o dicionário completo da escola. A gravação é feita
+    em duas etapas: `preparar()` roda com o lock do banco e recebe o estado em
+    memória e as operações aplicadas desde a última gravação, devolvendo o que
+    precisa ser escrito; `persistir()` roda fora do lock e faz o I/O durável.
+    """
+
+    def carregar(self):
+        raise NotImplementedError
+
+    def iniciar(self, banco):
+        pass
+
+    def preparar(self, dados, operacoes):
+        raise NotImplementedError
+
+    def persistir(self, preparado):
+        raise NotImplementedError
+
+    def gravar(self, dados, operacoes):
+        self.persistir(self.preparar(dados, operacoes))
+
+    def fechar(self):
+        pass
+
+
+class ArmazenamentoJSON(Armazenamento):
+    def __init__(self, arquivo):
+        self.arquivo = arquivo
+
+    def carregar(self):
+        return ler_json(self.arquivo)
+
+    def preparar(self, dados, operacoes):
+        return json.dumps(dados, indent=4, ensure_ascii=False)
+
+    def persistir(self, preparado):
+        escrever_atomico(self.arquivo, preparado)
+
+
+class ArmazenamentoJournal(Armazenamento):
+    """Modo journal: cada alteração vira uma linha no log (`<arquivo>.log`).
+
+    Uma thread em segundo plano grava periodicamente um snapshot compacto em
+    `<arquivo>` e descarta o log já incorporado. Na inicialização o snapshot
+    é carregado e o log reaplicado. As operações são atribuições de caminho,
+    então reaplicar um trecho já contido no snapshot não altera o resultado.
+
+    Com `formato="binario"` o snapshot usa o layout de `snapshot_binario`:
+    o arquivo é mapeado em memória e cada turma/aluno só é decodificado no
+    primeiro acesso. Se o snapshot binário ainda não existir, os dados vêm de
+    `arquivo_origem` (o dados.json atual) e o primeiro snapshot é gravado
+    logo na inicialização.
+    """
+
+    def __init__(self, arquivo, intervalo_snapshot=30.0, max_registros=5000, formato="json", arquivo_origem=None):
+        self.arquivo = arquivo
+        self.formato = formato
+        self.arquivo_origem = arquivo_origem
+        self.arquivo_log = arquivo + ".log"
+        self.arquivo_log_antigo = arquivo + ".log.1"
+        self.intervalo_snapshot = intervalo_snapshot
+        self.max_registros = max_registros
+
+        self._log = None
+        self._registros = 0
+        self._snapshot = None
+        self._snapshot_pendente = False
+        self._banco = None
+        self._thread = None
+        self._parar = threading.Event()
+        self._pedido_snapshot = threading.Event()
+        self._lock_snapshot = threading.Lock()
+        self._lock_log = threading.Lock()
+
+    def carregar(self):
+        dados = self._ler_snapshot()
+        for caminho_log in (self.arquivo_log_antigo, self.arquivo_log):
+            self._registros += self._reaplicar(dados, caminho_log)
+
+        self._log = open(self.arquivo_log, "a", encoding="utf-8")
+        return dados
+
+    def _ler_snapshot(self):
+        if self.formato == "json":
+            return ler_json(self.arquivo)
+
+        if os.path.exists(self.arquivo):
+            self._snapshot = SnapshotBinario(self.arquivo)
+            return self._snapshot.montar_dados(ao_ler_turma=normalizar_turma)
+
+        self._snapshot_pendente = True
+        return ler_json(self.arquivo_origem) if self.arquivo_origem else dados_padrao()
+
+    def _reaplicar(self, dados, caminho_log):
+        if not os.path.exists(caminho_log):
+            return 0
+
+        aplicados = 0
+        with open(caminho_log, "r", encoding="utf-8") as arquivo:
+            for numero, linha in enumerate(arquivo, 1):
+                linha = linha.strip()
+                if not linha:
+                    continue
+                try:
+                    operacao = json.loads(linha)
+                    if operacao_legada(operacao):
+                        continue
+                    aplicar_operacao(dados, operacao)
+                    aplicados += 1
+                except json.JSONDecodeError:
+                    # Última linha truncada por uma queda durante a escrita.
+                    print(f"AVISO NO SERVIDOR: Registro {numero} de '{caminho_log}' incompleto. Ignorando.")
+                except (KeyError, TypeError, ValueError) as e:
+                    print(f"AVISO NO SERVIDOR: Registro {numero} de '{caminho_log}' não pôde ser aplicado: {e}")
+
+        if aplicados:
+            print(f"[JOURNAL] {aplicados} alterações reaplicadas a partir de '{caminho_log}'.")
+        return aplicados
+
+    def iniciar(self, banco):
+        self._banco = banco
+        self._thread = threading.Thread(target=self._laco_snapshot, daemon=True)
+        self._thread.start()
+        if self._registros or self._snapshot_pendente:
+            self._pedido_snapshot.set()
+
+    def preparar(self, dados, operacoes):
+        return "".join(json.dumps(op, ensure_ascii=False, separators=(",", ":")) + "\n" for op in operacoes)
+
+    def persistir(self, preparado):
+        if not preparado:
+            return
+
+        with self._lock_log:
+            self._log.write(preparado)
+            self._log.flush()
+            os.fsync(self._log.fileno())
+
+            self._registros += preparado.count("\n")
+            if self._registros >= self.max_registros:
+                self._pedido_snapshot.set()
+
+    def _laco_snapshot(self):
+        while not self._parar.is_set():
+            self._pedido_snapshot.wait(self.intervalo_snapshot)
+            self._pedido_snapshot.clear()
+            if self._parar.is_set():
+                break
+            if self._registros or self._snapshot_pendente:
+                try:
+                    self.gravar_snapshot()
+                except Exception as e:
+                    print(f"[ERRO JOURNAL] Falha ao gravar snapshot: {e}")
+
+    def gravar_snapshot(self):
+        with self._lock_snapshot:
+            with self._banco.lock, self._lock_log:
+                if self.formato == "binario":
+                    conteudo = codificar_snapshot(self._banco.dados)
+                else:
+                    conteudo = json.dumps(self._banco.dados, ensure_ascii=False, separators=(",", ":"))
+                self._rotacionar_log()
+
+            if self.formato == "binario":
+                self._trocar_snapshot_binario(conteudo)
+            else:
+                escrever_atomico(self.arquivo, conteudo)
+            os.remove(self.arquivo_log_antigo)
+            self._snapshot_pendente = False
+
+    def _trocar_snapshot_binario(self, conteudo):
+        temporario = escrever_temporario(self.arquivo, conteudo)
+
+        # O mapeamento antigo precisa ser fechado antes da troca (no Windows um
+        # arquivo mapeado não pode ser substituído); os registros ainda não
+        # decodificados passam a apontar para o snapshot novo. Os leitores
+        # não seguram o lock do banco, só a trava de cada mapa: com elas, quem
+        # está decodificando termina antes do fechamento e quem chega depois
+        # já lê do snapshot novo.
+        with self._banco.lock, ExitStack() as travas:
+            mapas = {secao: self._banco.dados[secao] for secao in ("turmas", "alunos")
+                     if isinstance(self._banco.dados[secao], RegistrosMapeados)}
+            for mapa in mapas.values():
+                travas.enter_context(mapa.trava)
+            if self._snapshot is not None:
+                self._snapshot.fechar()
+            os.replace(temporario, self.arquivo)
+            self._snapshot = SnapshotBinario(self.arquivo)
+            for secao, mapa in mapas.items():
+                mapa.reanexar(self._snapshot, self._snapshot.indice[secao])
+
+        sincronizar_diretorio(self.arquivo)
+
+    def _rotacionar_log(self):
+        # Chamado com o lock do banco: o snapshot em memória contém todas as
+        # alterações do log que está sendo rotacionado. Lotes já preparados e
+        # ainda não persistidos caem no log novo, e reaplicá-los sobre o
+        # snapshot não muda nada.
+        self._log.close()
+        if os.path.exists(self.arquivo_log_antigo):
+            # Snapshot anterior falhou; preserva o log antigo juntando os dois.
+            with open(self.arquivo_log, "r", encoding="utf-8") as atual, \
+                    open(self.arquivo_log_antigo, "a", encoding="utf-8") as antigo:
+                antigo.write(atual.read())
+            os.remove(self.arquivo_log)
+        else:
+            os.replace(self.arquivo_log, self.arquivo_log_antigo)
+
+        self._log = open(self.arquivo_log, "a", encoding="utf-8")
+        self._registros = 0
+
+    def fechar(self):
+        self._parar.set()
+        self._pedido_snapshot.set()
+        if self._thread is not None:
+            self._thread.join()
+        if (self._registros or self._snapshot_pendente) and self._banco is not None:
+            self.gravar_snapshot()
+        self._log.close()
+        if self._snapshot is not None:
+            self._snapshot.fechar()
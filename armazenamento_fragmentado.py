@@ -0,0 +1,246 @@
+import os
+import re
+import json
+import hashlib
+import threading
+from collections.abc import MutableMapping
+from concurrent.futures import ThreadPoolExecutor
+
+from armazenamento import Armazenamento, dados_padrao, escrever_atomico, ler_json, normalizar_turma, sincronizar_diretorio
+
+
+def nome_arquivo_turma(turma):
+    legivel = re.sub(r"[^A-Za-z0-9_-]", "_", turma)
+    resumo = hashlib.sha1(turma.encode("utf-8")).hexdigest()[:8]
+    return f"{legivel}-{resumo}.json"
+
+
+class Fragmentos:
+    """Arquivos por turma, carregados sob demanda.
+
+    Cada fragmento guarda o dicionário da turma e os registros completos dos
+    alunos matriculados nela: {"turma": {...}, "alunos": {ra: {...}}}.
+    """
+
+    def __init__(self, diretorio, arquivos):
+        self.diretorio = diretorio
+        self.arquivos = dict(arquivos)
+        self.carregados = {}
+        self._lock = threading.Lock()
+
+    def caminho(self, turma):
+        return os.path.join(self.diretorio, self.arquivos[turma])
+
+    def obter(self, turma):
+        fragmento = self.carregados.get(turma)
+        if fragmento is not None:
+            return fragmento
+
+        with self._lock:
+            if turma not in self.carregados:
+                with open(self.caminho(turma), "r", encoding="utf-8") as arquivo:
+                    fragmento = json.load(arquivo)
+                normalizar_turma(fragmento["turma"])
+                self.carregados[turma] = fragmento
+            return self.carregados[turma]
+
+    def criar(self, turma, dados_turma):
+        with self._lock:
+            self.arquivos.setdefault(turma, nome_arquivo_turma(turma))
+            self.carregados[turma] = {"turma": dados_turma, "alunos": {}}
+
+    def descartar(self, turma):
+        # Só para desfazer a criação de uma turma ainda não gravada.
+        with self._lock:
+            self.arquivos.pop(turma, None)
+            self.carregados.pop(turma, None)
+
+
+class TurmasFragmentadas(MutableMapping):
+    def __init__(self, fragmentos):
+        self.fragmentos = fragmentos
+
+    def __getitem__(self, turma):
+        if turma not in self.fragmentos.arquivos:
+            raise KeyError(turma)
+        return self.fragmentos.obter(turma)["turma"]
+
+    def __setitem__(self, turma, valor):
+        if turma in self.fragmentos.arquivos:
+            self.fragmentos.obter(turma)["turma"] = valor
+        else:
+            self.fragmentos.criar(turma, valor)
+
+    def __delitem__(self, turma):
+        if turma not in self.fragmentos.arquivos:
+            raise KeyError(turma)
+        self.fragmentos.descartar(turma)
+
+    def __contains__(self, turma):
+        return turma in self.fragmentos.arquivos
+
+    def __iter__(self):
+        return iter(list(self.fragmentos.arquivos))
+
+    def __len__(self):
+        return len(self.fragmentos.arquivos)
+
+
+class AlunosFragmentados(MutableMapping):
+    def __init__(self, fragmentos, turma_por_ra):
+        self.fragmentos = fragmentos
+        self.turma_por_ra = turma_por_ra
+
+    def __getitem__(self, ra):
+        turma = self.turma_por_ra[ra]
+        return self.fragmentos.obter(turma)["alunos"][ra]
+
+    def __setitem__(self, ra, valor):
+        turma = valor["turma"]
+        self.fragmentos.obter(turma)["alunos"][ra] = valor
+        self.turma_por_ra[ra] = turma
+
+    def __delitem__(self, ra):
+        turma = self.turma_por_ra.pop(ra)
+        self.fragmentos.obter(turma)["alunos"].pop(ra, None)
+
+    def __contains__(self, ra):
+        return ra in self.turma_por_ra
+
+    def turma_de(self, ra):
+        return self.turma_por_ra[ra]
+
+    def __iter__(self):
+        return iter(list(self.turma_por_ra))
+
+    def __len__(self):
+        return len(self.turma_por_ra)
+
+
+class ArmazenamentoFragmentado(Armazenamento):
+    """Um arquivo por turma mais um índice global pequeno.
+
+    O índice (`indice.json`) guarda professores, disciplinas, o mapa RA → turma
+    e o nome do arquivo de cada turma. Uma alteração em uma turma regrava só o
+    arquivo dela; os fragmentos de um mesmo lote são gravados em paralelo e o
+    índice por último.
+
+    Um lote que regrava mais de um arquivo (um aluno que muda de turma, uma
+    turma nova e o índice) é antes gravado inteiro em `lote.json`, apagado
+    quando todos os arquivos estão no lugar. Se o servidor cair no meio, a
+    próxima carga regrava o lote a partir dele, e índice e fragmentos nunca
+    ficam de lotes diferentes.
+    """
+
+    def __init__(self, diretorio, arquivo_json=None, max_paralelo=4):
+        self.diretorio = diretorio
+        self.arquivo_indice = os.path.join(diretorio, "indice.json")
+        self.arquivo_lote = os.path.join(diretorio, "lote.json")
+        self.arquivo_json = arquivo_json
+        self.fragmentos = None
+        self.turma_por_ra = None
+        self._executor = ThreadPoolExecutor(max_workers=max_paralelo)
+
+    def carregar(self):
+        os.makedirs(os.path.join(self.diretorio, "turmas"), exist_ok=True)
+
+        if not os.path.exists(self.arquivo_indice):
+            origem = ler_json(self.arquivo_json) if self.arquivo_json else dados_padrao()
+            self._importar(origem)
+            print(f"[FRAGMENTOS] Dados de '{self.arquivo_json}' divididos por turma em '{self.diretorio}'.")
+
+        if os.path.exists(self.arquivo_lote):
+            with open(self.arquivo_lote, "r", encoding="utf-8") as arquivo:
+                lote = json.load(arquivo)
+            self._gravar({os.path.join(self.diretorio, nome): conteudo for nome, conteudo in lote.items()})
+            self._apagar_lote()
+            print(f"[FRAGMENTOS] Lote interrompido regravado a partir de '{self.arquivo_lote}'.")
+
+        with open(self.arquivo_indice, "r", encoding="utf-8") as arquivo:
+            indice = json.load(arquivo)
+
+        self.fragmentos = Fragmentos(os.path.join(self.diretorio, "turmas"), indice["turmas"])
+        self.turma_por_ra = indice["alunos"]
+        return {
+            "alunos": AlunosFragmentados(self.fragmentos, self.turma_por_ra),
+            "professores": indice["professores"],
+            "disciplinas": indice["disciplinas"],
+            "turmas": TurmasFragmentadas(self.fragmentos),
+        }
+
+    def _importar(self, dados):
+        arquivos = {turma: nome_arquivo_turma(turma) for turma in dados["turmas"]}
+        fragmentos = {turma: {"turma": info, "alunos": {}} for turma, info in dados["turmas"].items()}
+        for ra, aluno in dados["alunos"].items():
+            fragmentos[aluno["turma"]]["alunos"][ra] = aluno
+
+        for turma, fragmento in fragmentos.items():
+            escrever_atomico(os.path.join(self.diretorio, "turmas", arquivos[turma]),
+                             json.dumps(fragmento, ensure_ascii=False))
+
+        escrever_atomico(self.arquivo_indice, json.dumps({
+            "professores": dados["professores"],
+            "disciplinas": dados["disciplinas"],
+            "alunos": {ra: aluno["turma"] for ra, aluno in dados["alunos"].items()},
+            "turmas": arquivos,
+        }, ensure_ascii=False))
+
+    def preparar(self, dados, operacoes):
+        turmas_alteradas = {}
+        indice_alterado = False
+
+        for operacao in operacoes:
+            raiz, chave = operacao["caminho"][0], operacao["caminho"][1]
+            if raiz == "turmas":
+                turma = chave
+                indice_alterado = indice_alterado or len(operacao["caminho"]) == 2
+            elif raiz == "alunos":
+                # None: aluno criado por uma transação desfeita, que já saiu
+                # do índice.
+                turma = self.turma_por_ra.get(chave)
+                indice_alterado = indice_alterado or len(operacao["caminho"]) == 2
+            else:
+                turma = None
+                indice_alterado = True
+
+            if turma is not None:
+                turmas_alteradas[turma] = None
+
+        arquivos = {}
+        for turma in turmas_alteradas:
+            arquivos[self.fragmentos.caminho(turma)] = json.dumps(self.fragmentos.obter(turma), ensure_ascii=False)
+        if indice_alterado:
+            arquivos[self.arquivo_indice] = json.dumps({
+                "professores": dados["professores"],
+                "disciplinas": dados["disciplinas"],
+                "alunos": dict(self.turma_por_ra),
+                "turmas": dict(self.fragmentos.arquivos),
+            }, ensure_ascii=False)
+        return arquivos
+
+    def persistir(self, preparado):
+        if len(preparado) > 1:
+            escrever_atomico(self.arquivo_lote, json.dumps(
+                {os.path.relpath(caminho, self.diretorio): conteudo for caminho, conteudo in preparado.items()},
+                ensure_ascii=False))
+        self._gravar(preparado)
+        if len(preparado) > 1:
+            self._apagar_lote()
+
+    def _gravar(self, arquivos):
+        fragmentos = {caminho: conteudo for caminho, conteudo in arquivos.items() if caminho != self.arquivo_indice}
+        tarefas = [self._executor.submit(escrever_atomico, caminho, conteudo)
+                   for caminho, conteudo in fragmentos.items()]
+        for tarefa in tarefas:
+            tarefa.result()
+        if self.arquivo_indice in arquivos:
+            escrever_atomico(self.arquivo_indice, arquivos[self.arquivo_indice])
+
+    def _apagar_lote(self):
+        # Apagado de forma durável: um lote antigo reaplicado desfaria os
+        # seguintes.
+        os.remove(self.arquivo_lote)
+        sincronizar_diretorio(self.arquivo_lote)
+
+    def fechar(self):
+        self._executor.shutdown(wait=True)
@@ -0,0 +1,386 @@
+import os
+import json
+import sqlite3
+
+from armazenamento import Armazenamento, dados_padrao, ler_json
+
+ESQUEMA = """
+CREATE TABLE IF NOT EXISTS professores (
+    cpf TEXT PRIMARY KEY,
+    nome TEXT NOT NULL,
+    senha TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS turmas (
+    nome TEXT PRIMARY KEY
+);
+CREATE TABLE IF NOT EXISTS alunos (
+    ra TEXT PRIMARY KEY,
+    nome TEXT NOT NULL,
+    senha TEXT NOT NULL,
+    turma TEXT NOT NULL,
+    faltas INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS disciplinas (
+    turma TEXT NOT NULL,
+    nome TEXT NOT NULL,
+    chave TEXT NOT NULL,
+    professor_cpf TEXT,
+    professor_nome TEXT,
+    politica TEXT,
+    PRIMARY KEY (turma, nome)
+);
+CREATE TABLE IF NOT EXISTS atividades (
+    turma TEXT NOT NULL,
+    disciplina TEXT NOT NULL,
+    nome TEXT NOT NULL,
+    link TEXT,
+    PRIMARY KEY (turma, disciplina, nome)
+);
+CREATE TABLE IF NOT EXISTS entregas (
+    turma TEXT NOT NULL,
+    disciplina TEXT NOT NULL,
+    atividade TEXT NOT NULL,
+    ra TEXT NOT NULL,
+    resposta TEXT,
+    nota REAL,
+    PRIMARY KEY (turma, disciplina, atividade, ra)
+);
+CREATE TABLE IF NOT EXISTS notas (
+    ra TEXT NOT NULL,
+    disciplina TEXT NOT NULL,
+    tipo TEXT NOT NULL,
+    valor REAL,
+    PRIMARY KEY (ra, disciplina, tipo)
+);
+CREATE TABLE IF NOT EXISTS atividades_enviadas (
+    ra TEXT NOT NULL,
+    atividade TEXT NOT NULL,
+    disciplina TEXT,
+    resposta TEXT,
+    PRIMARY KEY (ra, atividade)
+);
+CREATE TABLE IF NOT EXISTS aulas (
+    turma TEXT NOT NULL,
+    disciplina TEXT NOT NULL,
+    data TEXT NOT NULL,
+    descricao TEXT,
+    PRIMARY KEY (turma, disciplina, data)
+);
+CREATE INDEX IF NOT EXISTS idx_alunos_turma ON alunos (turma);
+CREATE INDEX IF NOT EXISTS idx_disciplinas_professor ON disciplinas (professor_cpf);
+CREATE INDEX IF NOT EXISTS idx_notas_disciplina ON notas (disciplina);
+CREATE INDEX IF NOT EXISTS idx_entregas_ra ON entregas (ra);
+CREATE INDEX IF NOT EXISTS idx_atividades_enviadas_disciplina ON atividades_enviadas (disciplina);
+"""
+
+
+def entidade_afetada(caminho):
+    """Traduz o caminho de uma operação na menor entidade relacional que a contém."""
+    raiz = caminho[0]
+
+    if raiz == "professores":
+        return ("professor", caminho[1])
+
+    if raiz == "disciplinas":
+        return ("disciplina_global", caminho[1])
+
+    if raiz == "alunos":
+        ra = caminho[1]
+        if len(caminho) >= 4 and caminho[2] == "notas":
+            return ("notas", ra, caminho[3])
+        if len(caminho) >= 4 and caminho[2] == "atividades_enviadas":
+            return ("envio", ra, caminho[3])
+        if len(caminho) == 3 and caminho[2] not in ("notas", "atividades_enviadas"):
+            return ("aluno_campos", ra)
+        return ("aluno", ra)
+
+    if raiz == "turmas":
+        turma = caminho[1]
+        if len(caminho) >= 3 and caminho[2] == "alunos":
+            # Cópia legada dos alunos dentro da turma; não é mais gravada.
+            return None
+        if len(caminho) >= 4 and caminho[2] == "disciplinas":
+            disciplina = caminho[3]
+            if len(caminho) >= 8 and caminho[4] == "atividades" and caminho[6] in ("notas", "respostas"):
+                return ("entrega", turma, disciplina, caminho[5], caminho[7])
+            if len(caminho) >= 6 and caminho[4] == "atividades":
+                return ("atividade", turma, disciplina, caminho[5])
+            if len(caminho) >= 6 and caminho[4] == "aulas":
+                return ("aula", turma, disciplina, caminho[5])
+            return ("disciplina", turma, disciplina)
+        return ("turma", turma)
+
+    return None
+
+
+class ArmazenamentoSQLite(Armazenamento):
+    """Persistência em SQLite com uma tabela por entidade.
+
+    `preparar()` traduz as operações nos comandos que reescrevem apenas as
+    linhas das entidades tocadas, e `persistir()` os executa numa única
+    transação. Na primeira execução, se o banco estiver vazio, os dados são
+    importados de `arquivo_json`.
+    """
+
+    def __init__(self, arquivo, arquivo_json=None):
+        self.arquivo = arquivo
+        self.arquivo_json = arquivo_json
+        self._comandos = []
+        self.conexao = sqlite3.connect(arquivo, check_same_thread=False)
+        self.conexao.execute("PRAGMA journal_mode=WAL")
+        self.conexao.execute("PRAGMA synchronous=FULL")
+        self.conexao.executescript(ESQUEMA)
+        self._migrar()
+
+    def _migrar(self):
+        # Bancos criados antes da política de notas por disciplina (JSON).
+        colunas = {linha[1] for linha in self.conexao.execute("PRAGMA table_info(disciplinas)")}
+        if "politica" not in colunas:
+            with self.conexao:
+                self.conexao.execute("ALTER TABLE disciplinas ADD COLUMN politica TEXT")
+
+    def _vazio(self):
+        for tabela in ("turmas", "professores", "alunos"):
+            if self.conexao.execute(f"SELECT 1 FROM {tabela} LIMIT 1").fetchone():
+                return False
+        return True
+
+    def carregar(self):
+        if self._vazio() and self.arquivo_json and os.path.exists(self.arquivo_json):
+            dados = ler_json(self.arquivo_json)
+            self._comandos = []
+            self._gravar_tudo(dados)
+            self.persistir(self._comandos)
+            print(f"[SQLITE] Dados importados de '{self.arquivo_json}' para '{self.arquivo}'.")
+
+        return self._montar_dados()
+
+    def _montar_dados(self):
+        dados = dados_padrao()
+
+        for cpf, nome, senha in self.conexao.execute("SELECT cpf, nome, senha FROM professores"):
+            dados["professores"][cpf] = {"nome": nome, "senha": senha}
+
+        for (nome,) in self.conexao.execute("SELECT nome FROM turmas"):
+            dados["turmas"][nome] = {"disciplinas": {}, "presenca": {}}
+
+        for turma, nome, chave, cpf, nome_prof, politica in self.conexao.execute(
+                "SELECT turma, nome, chave, professor_cpf, professor_nome, politica FROM disciplinas"):
+            professor = {"cpf": cpf, "nome": nome_prof}
+            dados["disciplinas"][chave] = {
+                "professor": dict(professor),
+                "turma": turma,
+                "nome_original": nome,
+                "atividades": {},
+            }
+            if politica is not None:
+                dados["disciplinas"][chave]["politica"] = json.loads(politica)
+            if turma in dados["turmas"]:
+                dados["turmas"][turma]["disciplinas"][nome] = {
+                    "professor": dict(professor),
+                    "atividades": {},
+                    "aulas": {},
+                }
+
+        for turma, disciplina, nome, link in self.conexao.execute(
+                "SELECT turma, disciplina, nome, link FROM atividades"):
+            disc = dados["turmas"].get(turma, {}).get("disciplinas", {}).get(disciplina)
+            if disc is not None:
+                disc["atividades"][nome] = {"link": link, "respostas": {}, "notas": {}}
+
+        for turma, disciplina, atividade, ra, resposta, nota in self.conexao.execute(
+                "SELECT turma, disciplina, atividade, ra, resposta, nota FROM entregas"):
+            disc = dados["turmas"].get(turma, {}).get("disciplinas", {}).get(disciplina)
+            if disc is None or atividade not in disc["atividades"]:
+                continue
+            if resposta is not None:
+                disc["atividades"][atividade]["respostas"][ra] = resposta
+            if nota is not None:
+                disc["atividades"][atividade]["notas"][ra] = nota
+
+        for turma, disciplina, data, descricao in self.conexao.execute(
+                "SELECT turma, disciplina, data, descricao FROM aulas"):
+            disc = dados["turmas"].get(turma, {}).get("disciplinas", {}).get(disciplina)
+            if disc is not None:
+                disc["aulas"][data] = {"descricao": descricao}
+
+        for ra, nome, senha, turma, faltas in self.conexao.execute(
+                "SELECT ra, nome, senha, turma, faltas FROM alunos"):
+            dados["alunos"][ra] = {
+                "nome": nome,
+                "senha": senha,
+                "turma": turma,
+                "faltas": faltas,
+                "notas": {},
+                "atividades_enviadas": {},
+            }
+
+        for ra, disciplina, tipo, valor in self.conexao.execute(
+                "SELECT ra, disciplina, tipo, valor FROM notas"):
+            if ra in dados["alunos"]:
+                dados["alunos"][ra]["notas"].setdefault(disciplina, {})[tipo] = valor
+
+        for ra, atividade, disciplina, resposta in self.conexao.execute(
+                "SELECT ra, atividade, disciplina, resposta FROM atividades_enviadas"):
+            if ra in dados["alunos"]:
+                dados["alunos"][ra]["atividades_enviadas"][atividade] = {"disciplina": disciplina, "resposta": resposta}
+
+        return dados
+
+    def preparar(self, dados, operacoes):
+        # dict: sem repetição, na ordem em que apareceram.
+        entidades = dict.fromkeys(entidade_afetada(operacao["caminho"]) for operacao in operacoes)
+        entidades.pop(None, None)
+
+        self._comandos = []
+        for entidade in entidades:
+            self._gravar_entidade(dados, entidade)
+        return self._comandos
+
+    def persistir(self, preparado):
+        if not preparado:
+            return
+
+        with self.conexao:
+            for sql, parametros in preparado:
+                self.conexao.execute(sql, parametros)
+
+    def _comando(self, sql, parametros):
+        self._comandos.append((sql, parametros))
+
+    def _gravar_tudo(self, dados):
+        for cpf in dados["professores"]:
+            self._gravar_entidade(dados, ("professor", cpf))
+        for turma in dados["turmas"]:
+            self._gravar_entidade(dados, ("turma", turma))
+        for chave in dados["disciplinas"]:
+            self._gravar_entidade(dados, ("disciplina_global", chave))
+        for ra in dados["alunos"]:
+            self._gravar_entidade(dados, ("aluno", ra))
+
+    def _gravar_entidade(self, dados, entidade):
+        tipo, *chave = entidade
+        getattr(self, f"_gravar_{tipo}")(dados, *chave)
+
+    def _gravar_professor(self, dados, cpf):
+        info = dados["professores"].get(cpf)
+        if info is None:
+            self._comando("DELETE FROM professores WHERE cpf = ?", (cpf,))
+            return
+        self._comando(
+            "INSERT OR REPLACE INTO professores (cpf, nome, senha) VALUES (?, ?, ?)",
+            (cpf, info["nome"], info["senha"]))
+
+    def _gravar_turma(self, dados, turma):
+        if turma not in dados["turmas"]:
+            self._comando("DELETE FROM turmas WHERE nome = ?", (turma,))
+            return
+        self._comando("INSERT OR IGNORE INTO turmas (nome) VALUES (?)", (turma,))
+        for disciplina in dados["turmas"][turma].get("disciplinas", {}):
+            self._gravar_disciplina(dados, turma, disciplina)
+
+    def _gravar_disciplina_global(self, dados, chave):
+        info = dados["disciplinas"].get(chave)
+        if info is not None:
+            self._gravar_linha_disciplina(dados, info["turma"], info.get("nome_original", chave.split('-')[0]))
+
+    def _gravar_linha_disciplina(self, dados, turma, disciplina):
+        chave = f"{disciplina}-{turma}"
+        info_turma = dados["turmas"].get(turma, {}).get("disciplinas", {}).get(disciplina)
+        info_global = dados["disciplinas"].get(chave)
+        info = info_turma or info_global
+
+        if info is None:
+            self._comando("DELETE FROM disciplinas WHERE turma = ? AND nome = ?", (turma, disciplina))
+            return
+
+        professor = info.get("professor", {})
+        # A política só existe no registro global (`dados["disciplinas"]`).
+        politica = (info_global or {}).get("politica")
+        self._comando(
+            "INSERT OR REPLACE INTO disciplinas (turma, nome, chave, professor_cpf, professor_nome, politica) VALUES (?, ?, ?, ?, ?, ?)",
+            (turma, disciplina, chave, professor.get("cpf"), professor.get("nome"),
+             None if politica is None else json.dumps(politica, ensure_ascii=False)))
+
+    def _gravar_disciplina(self, dados, turma, disciplina):
+        self._gravar_linha_disciplina(dados, turma, disciplina)
+
+        info = dados["turmas"].get(turma, {}).get("disciplinas", {}).get(disciplina, {})
+        self._comando("DELETE FROM atividades WHERE turma = ? AND disciplina = ?", (turma, disciplina))
+        self._comando("DELETE FROM entregas WHERE turma = ? AND disciplina = ?", (turma, disciplina))
+        self._comando("DELETE FROM aulas WHERE turma = ? AND disciplina = ?", (turma, disciplina))
+
+        for nome_atividade in info.get("atividades", {}):
+            self._gravar_atividade(dados, turma, disciplina, nome_atividade)
+        for data in info.get("aulas", {}):
+            self._gravar_aula(dados, turma, disciplina, data)
+
+    def _gravar_atividade(self, dados, turma, disciplina, nome_atividade):
+        atividade = dados["turmas"][turma]["disciplinas"][disciplina].get("atividades", {}).get(nome_atividade)
+        self._comando("DELETE FROM entregas WHERE turma = ? AND disciplina = ? AND atividade = ?",
+                    (turma, disciplina, nome_atividade))
+        if atividade is None:
+            self._comando("DELETE FROM atividades WHERE turma = ? AND disciplina = ? AND nome = ?",
+                        (turma, disciplina, nome_atividade))
+            return
+
+        self._comando("INSERT OR REPLACE INTO atividades (turma, disciplina, nome, link) VALUES (?, ?, ?, ?)",
+                    (turma, disciplina, nome_atividade, atividade.get("link")))
+        ras = list(atividade.get("respostas", {})) + [ra for ra in atividade.get("notas", {}) if ra not in atividade.get("respostas", {})]
+        for ra in ras:
+            self._gravar_entrega(dados, turma, disciplina, nome_atividade, ra)
+
+    def _gravar_entrega(self, dados, turma, disciplina, nome_atividade, ra):
+        atividade = dados["turmas"][turma]["disciplinas"][disciplina]["atividades"][nome_atividade]
+        self._comando(
+            "INSERT OR REPLACE INTO entregas (turma, disciplina, atividade, ra, resposta, nota) VALUES (?, ?, ?, ?, ?, ?)",
+            (turma, disciplina, nome_atividade, ra,
+             atividade.get("respostas", {}).get(ra), atividade.get("notas", {}).get(ra)))
+
+    def _gravar_aula(self, dados, turma, disciplina, data):
+        aula = dados["turmas"][turma]["disciplinas"][disciplina].get("aulas", {}).get(data)
+        if aula is None:
+            self._comando("DELETE FROM aulas WHERE turma = ? AND disciplina = ? AND data = ?",
+                                 (turma, disciplina, data))
+            return
+        self._comando("INSERT OR REPLACE INTO aulas (turma, disciplina, data, descricao) VALUES (?, ?, ?, ?)",
+                             (turma, disciplina, data, aula.get("descricao")))
+
+    def _gravar_aluno_campos(self, dados, ra):
+        aluno = dados["alunos"][ra]
+        self._comando(
+            "INSERT OR REPLACE INTO alunos (ra, nome, senha, turma, faltas) VALUES (?, ?, ?, ?, ?)",
+            (ra, aluno["nome"], aluno["senha"], aluno["turma"], aluno.get("faltas", 0)))
+
+    def _gravar_aluno(self, dados, ra):
+        self._comando("DELETE FROM notas WHERE ra = ?", (ra,))
+        self._comando("DELETE FROM atividades_enviadas WHERE ra = ?", (ra,))
+        if ra not in dados["alunos"]:
+            self._comando("DELETE FROM alunos WHERE ra = ?", (ra,))
+            return
+
+        self._gravar_aluno_campos(dados, ra)
+        aluno = dados["alunos"][ra]
+        for disciplina in aluno.get("notas", {}):
+            self._gravar_notas(dados, ra, disciplina)
+        for nome_atividade in aluno.get("atividades_enviadas", {}):
+            self._gravar_envio(dados, ra, nome_atividade)
+
+    def _gravar_notas(self, dados, ra, disciplina):
+        self._comando("DELETE FROM notas WHERE ra = ? AND disciplina = ?", (ra, disciplina))
+        notas = dados["alunos"][ra]["notas"].get(disciplina, {})
+        for tipo, valor in notas.items():
+            self._comando("INSERT INTO notas (ra, disciplina, tipo, valor) VALUES (?, ?, ?, ?)",
+                          (ra, disciplina, tipo, valor))
+
+    def _gravar_envio(self, dados, ra, nome_atividade):
+        envio = dados["alunos"][ra]["atividades_enviadas"].get(nome_atividade)
+        if envio is None:
+            self._comando("DELETE FROM atividades_enviadas WHERE ra = ? AND atividade = ?", (ra, nome_atividade))
+            return
+        self._comando(
+            "INSERT OR REPLACE INTO atividades_enviadas (ra, atividade, disciplina, resposta) VALUES (?, ?, ?, ?)",
+            (ra, nome_atividade, envio.get("disciplina"), envio.get("resposta")))
+
+    def fechar(self):
+        self.conexao.close()
@@ -0,0 +1,248 @@
+import time
+import threading
+from contextlib import contextmanager
+
+from armazenamento import aplicar_operacao, ler_caminho, restaurar_caminho
+from cache_relatorios import CacheRelatorios
+from indices import IndicesSecundarios
+from versoes import Versoes
+
+
+class BancoDados:
+    """Dados da escola residentes em memória.
+
+    Carregados uma única vez na inicialização do servidor. Os handlers leem
+    `self.dados` diretamente e registram cada alteração com `definir()`, que
+    aplica a mudança em memória e a guarda até o próximo `salvar()`.
+
+    `salvar()` não escreve nada: apenas pede um commit. Uma thread de commit
+    junta os pedidos que chegam dentro de `janela_commit` segundos e os
+    persiste num único lote; quem pediu espera com `aguardar_persistencia()`
+    (fora do lock) até o seu lote estar durável.
+
+    Cada aluno existe uma única vez, em `dados["alunos"]`; a lista de alunos de
+    uma turma e as demais consultas indexadas ficam em `self.indices`
+    (ver `IndicesSecundarios`), montados na carga e mantidos por `definir()`,
+    que também avança as versões de turmas, disciplinas e atividades
+    (`self.versoes`, ver `Versoes`), e invalida os relatórios afetados em
+    `self.relatorios` (ver `CacheRelatorios`).
+
+    Com `ativar_replicacao()`, cada alteração aplicada (inclusive as que um
+    `desfazer_transacao()` restaura) fica também numa fila, na ordem em que
+    entrou nos dados, para ser repassada a réplicas em outros processos
+    (ver multiprocesso.py), que a reaplicam com `aplicar_replicadas()`.
+    """
+
+    def __init__(self, armazenamento, janela_commit=0.005):
+        self.armazenamento = armazenamento
+        self.janela_commit = janela_commit
+        self.lock = threading.RLock()
+        self.dados = armazenamento.carregar()
+        self._operacoes = []
+        self.indices = IndicesSecundarios(self.dados)
+        self.versoes = Versoes(self.dados)
+        self.relatorios = CacheRelatorios(self.dados)
+        self._replicacao = None
+        self.seq_replicacao = 0
+
+        self._condicao = threading.Condition()
+        self._pedido = 0
+        self._enviado = 0
+        self._duravel = 0
+        self._ultima_falha = None
+        self._ativo = True
+        self._local = threading.local()
+
+        armazenamento.iniciar(self)
+        self._thread_commit = threading.Thread(target=self._laco_commit, daemon=True)
+        self._thread_commit.start()
+
+    def definir(self, caminho, valor):
+        operacao = {"op": "definir", "caminho": list(caminho), "valor": valor}
+        transacao = getattr(self._local, "transacao", None)
+        with self.lock:
+            if transacao is not None:
+                transacao.desfazer.append((operacao["caminho"], *ler_caminho(self.dados, caminho)))
+            self.indices.remover(caminho)
+            self.relatorios.invalidar(caminho)
+            aplicar_operacao(self.dados, operacao)
+            (self._operacoes if transacao is None else transacao.operacoes).append(operacao)
+            self.indices.incluir(caminho)
+            self.relatorios.invalidar(caminho)
+            self.versoes.registrar(caminho)
+            if self._replicacao is not None:
+                self._replicacao.append(operacao)
+                self.seq_replicacao += 1
+
+    @contextmanager
+    def transacao(self):
+        """Agrupa alterações que vão juntas para o disco e podem ser desfeitas.
+
+        A transação é da thread que a abriu: o lock só é usado dentro de cada
+        `definir()`, então transações de turmas diferentes andam em paralelo.
+        As operações ficam com a transação até o fim, quando entram juntas na
+        fila do commit (e um `salvar()` pedido no meio só vale então); assim a
+        thread de commit não grava nada dela pela metade.
+        `desfazer_transacao()` restaura em memória o valor anterior de cada
+        caminho alterado e descarta as operações; com um `ponto_transacao()`,
+        só as feitas depois dele.
+
+        Uma transação aberta dentro de outra (um lote rodando numa
+        requisição) faz parte da de fora.
+        """
+        if getattr(self._local, "transacao", None) is not None:
+            yield
+            return
+        transacao = self._local.transacao = _Transacao()
+        try:
+            yield
+        finally:
+            self._local.transacao = None
+            with self.lock:
+                self._operacoes.extend(transacao.operacoes)
+            if transacao.salvar:
+                self.salvar()
+
+    def ponto_transacao(self):
+        transacao = self._local.transacao
+        return (len(transacao.desfazer), len(transacao.operacoes))
+
+    def desfazer_transacao(self, ponto=(0, 0)):
+        transacao = self._local.transacao
+        inicio_desfazer, inicio_operacoes = ponto
+        with self.lock:
+            del transacao.operacoes[inicio_operacoes:]
+            for caminho, existia, valor in reversed(transacao.desfazer[inicio_desfazer:]):
+                self.indices.remover(caminho)
+                self.relatorios.invalidar(caminho)
+                restaurar_caminho(self.dados, caminho, existia, valor)
+                self.indices.incluir(caminho)
+                self.relatorios.invalidar(caminho)
+                restauracao = {"op": "restaurar", "caminho": caminho, "existia": existia, "valor": valor}
+                # Também vai para o disco: um snapshot completo (journal, json)
+                # tirado no meio da transação pode ter levado o valor desfeito.
+                transacao.operacoes.append(restauracao)
+                if self._replicacao is not None:
+                    self._replicacao.append(restauracao)
+                    self.seq_replicacao += 1
+            del transacao.desfazer[inicio_desfazer:]
+
+    def ativar_replicacao(self):
+        with self.lock:
+            self._replicacao = []
+
+    def retirar_replicacao(self):
+        """Devolve (alterações desde a última chamada, número de sequência da
+        última delas)."""
+        with self.lock:
+            operacoes, self._replicacao = self._replicacao, []
+            return operacoes, self.seq_replicacao
+
+    def aplicar_replicadas(self, operacoes):
+        # Mesmo efeito, na mesma ordem, que `definir()` e `desfazer_transacao()`
+        # tiveram no processo de origem; as versões acompanham.
+        with self.lock:
+            for operacao in operacoes:
+                caminho = operacao["caminho"]
+                self.indices.remover(caminho)
+                self.relatorios.invalidar(caminho)
+                if operacao["op"] == "restaurar":
+                    restaurar_caminho(self.dados, caminho, operacao["existia"], operacao["valor"])
+                    self.indices.incluir(caminho)
+                else:
+                    aplicar_operacao(self.dados, operacao)
+                    self.indices.incluir(caminho)
+                    self.versoes.registrar(caminho)
+                self.relatorios.invalidar(caminho)
+                self.seq_replicacao += 1
+
+    def salvar(self):
+        transacao = getattr(self._local, "transacao", None)
+        if transacao is not None:
+            transacao.salvar = True
+            return
+        with self.lock, self._condicao:
+            self._pedido += 1
+            self._local.pedido = self._pedido
+            self._condicao.notify_all()
+
+    def aguardar_persistencia(self):
+        pedido = getattr(self._local, "pedido", None)
+        if pedido is None:
+            return
+        self._local.pedido = None
+
+        with self._condicao:
+            while self._duravel < pedido:
+                falha = self._ultima_falha
+                if falha is not None and falha[0] < pedido <= falha[1]:
+                    raise RuntimeError(f"Falha ao persistir os dados: {falha[2]}")
+                self._condicao.wait()
+
+    def _laco_commit(self):
+        while True:
+            with self._condicao:
+                while self._ativo and self._pedido == self._enviado:
+                    self._condicao.wait()
+                if not self._ativo and self._pedido == self._enviado:
+                    return
+
+            if self.janela_commit:
+                time.sleep(self.janela_commit)
+
+            if not self._persistir_lote():
+                if not self._ativo:
+                    return
+                time.sleep(0.5)
+
+    def _persistir_lote(self):
+        with self.lock:
+            operacoes, self._operacoes = self._operacoes, []
+            with self._condicao:
+                inicio, fim = self._enviado, self._pedido
+                self._enviado = fim
+            try:
+                preparado = self.armazenamento.preparar(self.dados, operacoes)
+            except Exception as e:
+                return self._registrar_falha(operacoes, inicio, fim, e)
+
+        try:
+            self.armazenamento.persistir(preparado)
+        except Exception as e:
+            with self.lock:
+                return self._registrar_falha(operacoes, inicio, fim, e)
+
+        with self._condicao:
+            self._duravel = fim
+            self._condicao.notify_all()
+        return True
+
+    def _registrar_falha(self, operacoes, inicio, fim, erro):
+        print(f"[ERRO BANCO] Falha ao persistir lote de {len(operacoes)} alterações: {erro}")
+        # As operações voltam para a fila e o lote é tentado de novo.
+        self._operacoes = operacoes + self._operacoes
+        with self._condicao:
+            self._enviado = inicio
+            self._ultima_falha = (inicio, fim, erro)
+            self._condicao.notify_all()
+        return False
+
+    def fechar(self):
+        with self._condicao:
+            self._ativo = False
+            self._condicao.notify_all()
+        self._thread_commit.join()
+
+        with self.lock:
+            operacoes, self._operacoes = self._operacoes, []
+            self.armazenamento.gravar(self.dados, operacoes)
+        self.armazenamento.fechar()
+
+
+class _Transacao:
+    """Estado da transação aberta por uma thread (ver `BancoDados.transacao`)."""
+
+    def __init__(self):
+        self.desfazer = []
+        self.operacoes = []
+        self.salvar = False
@@ -0,0 +1,153 @@
+import os
+import sys
+import time
+import tempfile
+import threading
+from collections import OrderedDict
+
+LIMITE_PADRAO = 8 * 1024 * 1024
+
+
+class CacheRelatorios:
+    """Relatórios de notas e faltas de uma disciplina já serializados.
+
+    Cada entrada é a resposta pronta (bytes, no codec da conexão) de
+    `ver_notas_faltas_turma` para (turma, disciplina, codec). O
+    `BancoDados` chama `invalidar()` com o caminho de cada alteração, antes
+    de aplicá-la (turma antiga de um aluno) e depois (turma nova):
+
+    - nota de um aluno numa disciplina: só o relatório dessa disciplina;
+    - nome, faltas, turma ou o registro inteiro de um aluno, ou o registro
+      da turma: todos os relatórios da turma;
+    - o resto (senha, entregas, atividades, aulas) não aparece no relatório.
+
+    Médias e finais são notas do aluno, então o cálculo das finais também
+    invalida pelo mesmo caminho. As entradas são lidas e guardadas com a
+    trava de leitura da turma e invalidadas com a de escrita, então um
+    relatório nunca é guardado com dados de antes de uma alteração.
+
+    Acima de `limite_bytes` as entradas usadas há mais tempo saem primeiro.
+    `estatisticas()` devolve os contadores de acertos, falhas e descartes.
+    """
+
+    def __init__(self, dados, limite_bytes=LIMITE_PADRAO):
+        self.dados = dados
+        self.limite_bytes = limite_bytes
+        self.acertos = 0
+        self.falhas = 0
+        self.descartes = 0
+        self.invalidacoes = 0
+        self._entradas = OrderedDict()
+        self._por_turma = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def obter(self, chave):
+        if self.limite_bytes == 0:
+            # Cache desligado: não é uma falha, nem entra na taxa de acerto.
+            return None
+        with self._lock:
+            conteudo = self._entradas.get(chave)
+            if conteudo is None:
+                self.falhas += 1
+                return None
+            self._entradas.move_to_end(chave)
+            self.acertos += 1
+            return conteudo
+
+    def guardar(self, chave, conteudo):
+        if len(conteudo) > self.limite_bytes:
+            return
+        with self._lock:
+            if chave in self._entradas:
+                self._remover(chave)
+            self._entradas[chave] = conteudo
+            self._por_turma.setdefault(chave[0], {})[chave] = None
+            self._bytes += len(conteudo)
+            while self._bytes > self.limite_bytes:
+                self._remover(next(iter(self._entradas)))
+                self.descartes += 1
+
+    def invalidar(self, caminho):
+        if not self._entradas:
+            return
+        alvo = self._alvo(caminho)
+        if alvo is None:
+            return
+        turma, disciplina = alvo
+        with self._lock:
+            for chave in list(self._por_turma.get(turma, ())):
+                if disciplina is None or chave[1] == disciplina:
+                    self._remover(chave)
+                    self.invalidacoes += 1
+
+    def _alvo(self, caminho):
+        # (turma, disciplina) afetados; disciplina None = a turma toda.
+        raiz = caminho[0]
+        if raiz == "alunos" and len(caminho) >= 2:
+            aluno = self.dados["alunos"].get(caminho[1])
+            if aluno is None:
+                return None
+            if len(caminho) >= 4 and caminho[2] == "notas":
+                return (aluno["turma"], caminho[3])
+            if len(caminho) == 2 or caminho[2] in ("nome", "faltas", "turma", "notas"):
+                return (aluno["turma"], None)
+        elif raiz == "turmas" and len(caminho) == 2:
+            return (caminho[1], None)
+        return None
+
+    def _remover(self, chave):
+        self._bytes -= len(self._entradas.pop(chave))
+        chaves_turma = self._por_turma.get(chave[0])
+        if chaves_turma is not None:
+            chaves_turma.pop(chave, None)
+            if not chaves_turma:
+                del self._por_turma[chave[0]]
+
+    def estatisticas(self):
+        with self._lock:
+            consultas = self.acertos + self.falhas
+            return {
+                "acertos": self.acertos,
+                "falhas": self.falhas,
+                "taxa_acerto": round(self.acertos / consultas, 4) if consultas else 0.0,
+                "descartes": self.descartes,
+                "invalidacoes": self.invalidacoes,
+                "entradas": len(self._entradas),
+                "bytes": self._bytes,
+                "limite_bytes": self.limite_bytes,
+            }
+
+
+def _benchmark(alunos=40, repeticoes=2000):
+    """ver_notas_faltas_turma com e sem cache, na mesma turma."""
+    os.chdir(tempfile.mkdtemp())
+    os.environ["SERVIDOR_LOG_NIVEL"] = "ERRO"
+    import server
+    server.iniciar_banco()
+    server.processar_requisicao("cadastrar_turma", ["3A"])
+    for i in range(alunos):
+        server.processar_requisicao("cadastrar_aluno", [f"RA{i:03d}", f"ALUNO {i}", "s", "3A"])
+        server.processar_requisicao("lancar_np_grades", ["MAT", "3A", "NP1", {f"RA{i:03d}": i % 11}])
+
+    tempos = {}
+    for nome, limite in (("sem cache", 0), ("com cache", LIMITE_PADRAO)):
+        server.BANCO.relatorios.limite_bytes = limite
+        inicio = time.perf_counter()
+        for _ in range(repeticoes):
+            server.processar_requisicao("ver_notas_faltas_turma", ["MAT", "3A"])
+        tempos[nome] = (time.perf_counter() - inicio) / repeticoes
+
+    print(f"Turma de {alunos} alunos, {repeticoes} consultas")
+    for nome, tempo in tempos.items():
+        print(f"{nome:>10}: {tempo * 1e6:8.1f} µs por consulta")
+    print(server.BANCO.relatorios.estatisticas())
+    server.BANCO.fechar()
+    server.REGISTRO.fechar()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2 or sys.argv[1] != "benchmark":
+        print("Uso: python cache_relatorios.py benchmark")
+        sys.exit(1)
+    _benchmark()
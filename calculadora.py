@@ -0,0 +1,154 @@
+import os
+import sys
+import time
+import array
+import ctypes
+import random
+import struct
+import subprocess
+
+from motor_notas import PESO_ATIVIDADES, PESO_NP1, PESO_NP2
+
+DIRETORIO = os.path.dirname(os.path.abspath(__file__))
+FONTE = os.path.join(DIRETORIO, 'calculator.c')
+# No Windows a DLL já compilada; no Linux o .so gerado por `compilar()`.
+NOMES_BIBLIOTECA = ('calculator.dll',) if os.name == 'nt' else ('calculator.so',)
+
+_double_p = ctypes.POINTER(ctypes.c_double)
+
+
+class Calculadora:
+    """Funções da biblioteca C de notas.
+
+    O servidor só a usa com SERVIDOR_CALCULADORA_C=1: converter as colunas
+    para buffers de double custa mais que a própria conta, e `_comparar()`
+    mostra a conta em Python mais rápida até turmas de centenas de alunos
+    (cerca de metade do tempo com 40); o lote só empata perto de 1000.
+
+    `final()` calcula um aluno por chamada. `finais()` recebe as colunas de
+    NP1, NP2 e médias de atividades da turma inteira e passa as três como
+    buffers contíguos de double para `_calculate_final_grades`, que preenche
+    o buffer de saída numa chamada só: o custo de atravessar o ctypes é pago
+    uma vez por turma, não uma vez por aluno. Bibliotecas compiladas antes
+    dessa função (a calculator.dll antiga) continuam funcionando, aluno por
+    aluno.
+    """
+
+    def __init__(self, biblioteca, nome):
+        self.nome = nome
+        try:
+            self.final = biblioteca._calculate_final_grade
+        except AttributeError:
+            self.final = biblioteca.calculate_final_grade
+        self.final.argtypes = [ctypes.c_double, ctypes.c_double, ctypes.c_double]
+        self.final.restype = ctypes.c_double
+
+        self.lote = getattr(biblioteca, '_calculate_final_grades', None)
+        if self.lote is not None:
+            self.lote.argtypes = [_double_p, _double_p, _double_p, _double_p, ctypes.c_long]
+            self.lote.restype = None
+
+    def finais(self, np1, np2, medias):
+        if self.lote is None:
+            return [float(self.final(n1, n2, m)) for n1, n2, m in zip(np1, np2, medias)]
+        n = len(medias)
+        if n == 0:
+            return []
+        colunas = [_buffer(array.array('d', coluna)) for coluna in (np1, np2, medias)]
+        saida = array.array('d', bytes(8 * n))
+        self.lote(*colunas, _buffer(saida), n)
+        return saida.tolist()
+
+
+def _buffer(valores):
+    # Ponteiro para os dados do array, sem copiar.
+    return (ctypes.c_double * len(valores)).from_buffer(valores)
+
+
+def carregar(diretorio=DIRETORIO):
+    """Devolve a `Calculadora` da primeira biblioteca que carregar, ou None
+    (o servidor usa a conta em Python)."""
+    print(f"[CTYPES] Python arquitetura: {struct.calcsize('P') * 8} bits")
+    for nome in NOMES_BIBLIOTECA:
+        caminho = os.path.join(diretorio, nome)
+        try:
+            calculadora = Calculadora(ctypes.CDLL(caminho), nome)
+        except OSError as oe:
+            print(f"[AVISO CTYPES] Falha ao carregar a biblioteca C '{nome}' (OSError). Detalhe: {oe}")
+            continue
+        except AttributeError:
+            print(f"[AVISO CTYPES] Função esperada não encontrada em '{nome}'. Verifique os símbolos exportados (esperado: _calculate_final_grade ou calculate_final_grade).")
+            continue
+        except Exception as e:
+            print(f"[AVISO CTYPES] Falha ao carregar a biblioteca C '{nome}'. Erro: {e}")
+            continue
+        modo = "em lote" if calculadora.lote is not None else "aluno por aluno"
+        print(f"[CTYPES] Biblioteca C ({nome}) carregada com sucesso; cálculo das notas finais {modo}.")
+        return calculadora
+
+    if os.name != 'nt':
+        print("[AVISO CTYPES] Para usar a biblioteca C, rode 'python calculadora.py compilar'. O código usará a lógica Python.")
+    else:
+        print("[AVISO CTYPES] O código usará a lógica Python.")
+    return None
+
+
+def compilar(compilador=None):
+    """Gera calculator.so a partir de calculator.c."""
+    compilador = compilador or os.getenv("CC", "cc")
+    destino = os.path.join(DIRETORIO, 'calculator.so')
+    comando = [compilador, '-O2', '-shared', '-fPIC', '-ffp-contract=off', '-o', destino, FONTE]
+    print(" ".join(comando))
+    subprocess.run(comando, check=True)
+    return destino
+
+
+def _comparar(tamanhos=(10, 40, 200, 1000), alunos_total=80000):
+    """Confere que a biblioteca em lote, a chamada por aluno e a conta em
+    Python dão exatamente o mesmo resultado, e mede as três em turmas de
+    vários tamanhos."""
+    calculadora = carregar()
+    if calculadora is None:
+        return False
+
+    def python(np1, np2, medias):
+        return [(n1 * PESO_NP1) + (n2 * PESO_NP2) + (m * PESO_ATIVIDADES) for n1, n2, m in zip(np1, np2, medias)]
+
+    def por_aluno(np1, np2, medias):
+        return [float(calculadora.final(n1, n2, m)) for n1, n2, m in zip(np1, np2, medias)]
+
+    caminhos = {"python": python, "C por aluno": por_aluno}
+    if calculadora.lote is not None:
+        caminhos["C em lote"] = calculadora.finais
+    else:
+        print(f"[AVISO] {calculadora.nome} não exporta _calculate_final_grades: recompile a partir de calculator.c.")
+
+    gerador = random.Random(42)
+    nota = lambda: gerador.choice([0.0, 10.0, 7, round(gerador.uniform(0, 10), 2), gerador.uniform(0, 10)])
+    identicos = True
+    print(f"{'alunos':>6} | " + " | ".join(f"{nome:>12}" for nome in caminhos) + "   (µs por turma)")
+    for alunos in tamanhos:
+        turmas = max(1, alunos_total // alunos)
+        colunas = [([nota() for _ in range(alunos)], [nota() for _ in range(alunos)], [nota() for _ in range(alunos)])
+                   for _ in range(turmas)]
+        resultados = {}
+        tempos = {}
+        for nome, calcular in caminhos.items():
+            inicio = time.perf_counter()
+            resultados[nome] = [calcular(*turma) for turma in colunas]
+            tempos[nome] = time.perf_counter() - inicio
+        identicos = identicos and all(resultado == resultados["python"] for resultado in resultados.values())
+        print(f"{alunos:>6} | " + " | ".join(f"{tempos[nome] / turmas * 1e6:12.2f}" for nome in caminhos))
+
+    print(f"Resultados idênticos: {identicos}")
+    return identicos
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2 or sys.argv[1] not in ("compilar", "comparar"):
+        print("Uso: python calculadora.py compilar | comparar")
+        sys.exit(1)
+    if sys.argv[1] == "compilar":
+        compilar()
+    else:
+        sys.exit(0 if _comparar() else 1)
@@ -0,0 +1,32 @@
+/*
+ * Cálculo da nota final, carregado pelo servidor com ctypes.
+ *
+ * Windows (MinGW):  gcc -O2 -shared -ffp-contract=off -o calculator.dll calculator.c
+ * Linux:            python calculadora.py compilar
+ *
+ * -ffp-contract=off impede que o compilador junte multiplicação e soma numa
+ * instrução FMA: o resultado tem de ser idêntico ao da conta em Python.
+ */
+#ifdef _WIN32
+#define EXPORTAR __declspec(dllexport)
+#else
+#define EXPORTAR __attribute__((visibility("default")))
+#endif
+
+#define PESO_NP1 0.35
+#define PESO_NP2 0.35
+#define PESO_ATIVIDADES 0.30
+
+EXPORTAR double _calculate_final_grade(double np1, double np2, double media_atividades)
+{
+    return (np1 * PESO_NP1) + (np2 * PESO_NP2) + (media_atividades * PESO_ATIVIDADES);
+}
+
+/* A turma inteira numa chamada só: saida[i] recebe a final do aluno i. */
+EXPORTAR void _calculate_final_grades(const double *np1, const double *np2, const double *medias,
+                                      double *saida, long n)
+{
+    for (long i = 0; i < n; i++) {
+        saida[i] = (np1[i] * PESO_NP1) + (np2[i] * PESO_NP2) + (medias[i] * PESO_ATIVIDADES);
+    }
+}
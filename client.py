@@ -3,23 +3,46 @@ import json
 import socket
 import webbrowser 
 import time
+import threading
+
+from protocolo import ACAO_NEGOCIACAO, OpcoesConexao, enviar_quadro, receber_quadro
 
 HOST = '127.0.0.1' 
 PORT = 65432       
 
 SESSAO_USUARIO = None
 SESSAO_CONEXAO = None 
+# Opções combinadas com o servidor ao conectar (codec, compressão).
+SESSAO_OPCOES = OpcoesConexao()
+# Codecs pedidos ao servidor, em ordem de preferência: "json" ou "binario"
+# (compacto, com chaves internadas; ver codificacao.py).
+CODECS_PREFERIDOS = ("json",)
+# Quantas vezes repetir uma requisição quando o servidor responde "ocupado".
+MAX_TENTATIVAS_OCUPADO = 5
 
 def connect_to_server():
-    global SESSAO_CONEXAO
+    global SESSAO_CONEXAO, SESSAO_OPCOES
     try:
         if SESSAO_CONEXAO:
              SESSAO_CONEXAO.close()
              SESSAO_CONEXAO = None
              
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        sock.connect((HOST, PORT))
+        for _ in range(MAX_TENTATIVAS_OCUPADO):
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.connect((HOST, PORT))
+            resposta = negociar_conexao(sock)
+            if not resposta.get("ocupado"):
+                break
+            # Servidor no limite de conexões: ele já fechou esta.
+            sock.close()
+            print(f"[AVISO] Servidor ocupado. Nova tentativa em {resposta['tentar_novamente_ms']} ms...")
+            time.sleep(resposta["tentar_novamente_ms"] / 1000)
+        else:
+            print(f"\n[ERRO DE CONEXÃO] Servidor ocupado após {MAX_TENTATIVAS_OCUPADO} tentativas.")
+            return False
+
         SESSAO_CONEXAO = sock
+        SESSAO_OPCOES = OpcoesConexao.da_resposta(resposta)
         return True
     except ConnectionRefusedError:
         print(f"\n[ERRO DE CONEXÃO] Não foi possível conectar ao Servidor em {HOST}:{PORT}.")
@@ -29,7 +52,31 @@ def connect_to_server():
         print(f"\n[ERRO DE CONEXÃO] Ocorreu um erro desconhecido: {e}")
         return False
 
-def send_request(action, params):
+def negociar_conexao(sock):
+    """Oferece codecs e compressão ao servidor e devolve a resposta. Servidores
+    antigos respondem "Ação desconhecida" e a conexão segue como sempre foi."""
+    pedido = {"action": ACAO_NEGOCIACAO, "params": [OpcoesConexao.oferta(codecs=CODECS_PREFERIDOS)]}
+    enviar_quadro(sock, json.dumps(pedido).encode('utf-8'))
+    data = receber_quadro(sock)
+    if data is None:
+        raise ConnectionResetError("Conexão fechada pelo Servidor.")
+    return json.loads(data)
+
+def send_request(action, params, versao_esperada=None, com_versao=False):
+    global SESSAO_CONEXAO
+
+    for _ in range(MAX_TENTATIVAS_OCUPADO):
+        response = enviar_uma_vez(action, params, versao_esperada, com_versao)
+        if not (isinstance(response, dict) and response.get("ocupado")):
+            break
+        if response.get("reconectar"):
+            SESSAO_CONEXAO.close()
+            SESSAO_CONEXAO = None
+        print(f"[AVISO] Servidor ocupado. Nova tentativa em {response['tentar_novamente_ms']} ms...")
+        time.sleep(response["tentar_novamente_ms"] / 1000)
+    return response
+
+def enviar_uma_vez(action, params, versao_esperada, com_versao):
     global SESSAO_CONEXAO
     
     if not SESSAO_CONEXAO:
@@ -38,29 +85,21 @@ def send_request(action, params):
             return {"error": "Conexão falhou após tentativa de reconexão."}
             
     request = {"action": action, "params": params}
+    if versao_esperada is not None:
+        request["versao_esperada"] = versao_esperada
+    if com_versao:
+        request["com_versao"] = True
     
     try:
-        request_data = json.dumps(request, ensure_ascii=False).encode('utf-8')
-        request_size = len(request_data).to_bytes(4, 'big')
-        
-        SESSAO_CONEXAO.sendall(request_size + request_data)
+        codec = SESSAO_OPCOES.codec
+        request_data = codec.codificar(request)
+        enviar_quadro(SESSAO_CONEXAO, request_data, SESSAO_OPCOES)
 
-        tamanho_bytes = SESSAO_CONEXAO.recv(4)
-        if not tamanho_bytes:
+        data = receber_quadro(SESSAO_CONEXAO, SESSAO_OPCOES)
+        if data is None:
             raise ConnectionResetError("Conexão fechada pelo Servidor.")
-            
-        tamanho = int.from_bytes(tamanho_bytes, 'big')
-        
-        data = b''
-        bytes_recv = 0
-        while bytes_recv < tamanho:
-            chunk = SESSAO_CONEXAO.recv(min(tamanho - bytes_recv, 4096))
-            if not chunk:
-                raise ConnectionResetError("Conexão fechada pelo Servidor durante a recepção.")
-            data += chunk
-            bytes_recv += len(chunk)
 
-        return json.loads(data.decode('utf-8'))
+        return codec.decodificar(data)
 
     except ConnectionResetError as e:
         print(f"[ERRO DE COMUNICAÇÃO] O servidor fechou a conexão: {e}")
@@ -70,6 +109,63 @@ def send_request(action, params):
         print(f"[ERRO FATAL] Falha na comunicação: {e}")
         return {"error": f"Erro de comunicação: {e}"}
 
+def send_pipeline(requisicoes):
+    """Envia várias requisições [(action, params), ...] de uma vez, sem esperar
+    cada resposta. O servidor as executa em paralelo e responde fora de ordem,
+    marcando cada resposta com o "id"; a lista devolvida segue a ordem pedida."""
+    global SESSAO_CONEXAO
+
+    if not SESSAO_CONEXAO:
+        print("[AVISO] Conexão perdida. Tentando reconectar...")
+        if not connect_to_server():
+            return [{"error": "Conexão falhou após tentativa de reconexão."} for _ in requisicoes]
+
+    sock = SESSAO_CONEXAO
+    opcoes = SESSAO_OPCOES
+    quadros = [opcoes.codec.codificar({"id": i, "action": action, "params": params})
+               for i, (action, params) in enumerate(requisicoes)]
+
+    def enviar_todos():
+        # Numa thread à parte: com muitas requisições o servidor começa a
+        # responder antes de o cliente terminar de enviar.
+        try:
+            for quadro in quadros:
+                enviar_quadro(sock, quadro, opcoes)
+        except OSError:
+            pass
+
+    envio = threading.Thread(target=enviar_todos)
+    envio.start()
+    respostas = [None] * len(requisicoes)
+    try:
+        for _ in requisicoes:
+            data = receber_quadro(sock, opcoes)
+            if data is None:
+                raise ConnectionResetError("Conexão fechada pelo Servidor.")
+            resposta = opcoes.codec.decodificar(data)
+            if "id" not in resposta:
+                # Erro fora de qualquer requisição; o servidor fecha a conexão.
+                raise ConnectionResetError(resposta.get("error", "Resposta sem id."))
+            respostas[resposta["id"]] = resposta["resposta"]
+    except (ConnectionResetError, OSError) as e:
+        print(f"[ERRO DE COMUNICAÇÃO] O servidor fechou a conexão: {e}")
+        SESSAO_CONEXAO = None
+    finally:
+        envio.join()
+
+    for i, resposta in enumerate(respostas):
+        if resposta is None:
+            respostas[i] = {"error": "Conexão perdida com o Servidor."}
+        elif isinstance(resposta, dict) and resposta.get("ocupado") and SESSAO_CONEXAO:
+            respostas[i] = send_request(*requisicoes[i])
+    return respostas
+
+def send_batch(operacoes, tudo_ou_nada=False):
+    """Executa [(action, params), ...] no servidor numa única requisição e num
+    único commit. Com `tudo_ou_nada`, uma falha desfaz o lote inteiro."""
+    lote = [{"action": action, "params": params} for action, params in operacoes]
+    return send_request("batch", [lote, tudo_ou_nada])
+
 def limpar_tela():
     if os.name == 'nt': 
         os.system('cls')
@@ -91,7 +187,8 @@ def cadastrar_professor():
 def cadastrar_disciplina():
     nome_disc = input("Digite o nome da disciplina: ").upper()
     
-    response_turmas = send_request("get_cadastro_info", ["turmas"])
+    response_turmas, response_profs = send_pipeline([("get_cadastro_info", ["turmas"]),
+                                                     ("get_cadastro_info", ["professores"])])
     turmas = response_turmas if isinstance(response_turmas, list) else []
     if not turmas:
         print("Não há turmas cadastradas!")
@@ -108,7 +205,6 @@ def cadastrar_disciplina():
         else:
             print("Opção inválida! Tente novamente.")
 
-    response_profs = send_request("get_cadastro_info", ["professores"])
     professores_list = response_profs if isinstance(response_profs, list) else []
     if not professores_list:
         print("Não há professores cadastrados!")
@@ -213,7 +309,8 @@ def menu_administrador():
         print("2. Cadastrar Professor")
         print("3. Cadastrar Disciplina")
         print("4. Cadastrar Aluno")
-        print("5. Voltar")
+        print("5. Recalcular Todas as Notas Finais")
+        print("6. Voltar")
         opcao = input("Escolha uma opção: ")
         limpar_tela()
         if opcao == "1":
@@ -225,10 +322,25 @@ def menu_administrador():
         elif opcao == "4":
             cadastrar_aluno()
         elif opcao == "5":
+            recalcular_todas_notas()
+        elif opcao == "6":
             break
         else:
             print("Opção inválida!")
 
+def recalcular_todas_notas():
+    print("Recalculando as notas finais de todas as turmas...")
+    response = send_request("recalcular_todas_notas", [])
+    print(response.get("message", "Erro ao recalcular as notas finais."))
+    if not response.get("success"):
+        return
+
+    for turma, tempo in sorted(response["turmas"].items()):
+        print(f"Turma {turma}: {tempo['disciplinas']} disciplinas, {tempo['alunos']} alunos | cálculo {tempo['calculo_ms']} ms | gravação {tempo['gravacao_ms']} ms")
+    print(f"Total: {response['total_ms']} ms (montagem dos dados: {response['montagem_ms']} ms)")
+    input("\nPressione ENTER para voltar ao menu.")
+    limpar_tela()
+
 def menu_professor(cpf, nome, disciplinas):
     while True:
         print(f"MENU PROFESSOR - {nome}")
@@ -279,8 +391,9 @@ def menu_disciplina_professor(disciplina, turma):
         print("7. Lançar NP1/NP2")
         print("8. Calcular e Atualizar Nota Final do Semestre") 
         print("9. Ver notas e faltas da turma")
+        print("10. Critérios de avaliação")
         
-        print("\n10. Voltar")
+        print("\n11. Voltar")
         
         opcao = input("Escolha uma opção: ")
         limpar_tela()
@@ -305,8 +418,10 @@ def menu_disciplina_professor(disciplina, turma):
             calcular_nota_final_turma(disciplina, turma)
         elif opcao == "9":
             ver_notas_faltas_turma(disciplina, turma)
-            
         elif opcao == "10":
+            criterios_avaliacao(disciplina, turma)
+            
+        elif opcao == "11":
             break
         else:
             print("Opção inválida!")
@@ -385,9 +500,27 @@ def menu_aluno(aluno_data):
         else:
             print("Opção inválida!")
 
+def ler_com_versao(action, params):
+    response = send_request(action, params, com_versao=True)
+    if "resultado" not in response:
+        return response, None
+    return response["resultado"], response["versao"]
+
+def enviar_com_versao(action, params, versao):
+    # Em conflito o que o professor digitou não se perde: ele decide se
+    # envia assim mesmo, sobre a versão atual.
+    while True:
+        response = send_request(action, params, versao_esperada=versao)
+        if not response.get("conflito"):
+            return response
+        print(response["message"])
+        if input("Enviar assim mesmo? (S/N): ").strip().upper() != "S":
+            return {"message": "Nada foi gravado."}
+        versao = response["versao_atual"]
+
 def lista_chamada(turma):
-    response = send_request("get_lista_alunos_turma", [turma])
-    alunos_turma = response if isinstance(response, dict) else {}
+    response, versao = ler_com_versao("get_lista_alunos_turma", [turma])
+    alunos_turma = response if isinstance(response, dict) and "error" not in response else {}
     
     if not alunos_turma:
         print(f"\nNenhum aluno cadastrado na turma {turma}.")
@@ -400,7 +533,7 @@ def lista_chamada(turma):
         resp = input(f"Aluno {info['nome']} presente? (S/N): ").strip().upper()
         presenca_list[ra] = resp == "S"
             
-    response_server = send_request("lista_chamada", [turma, presenca_list])
+    response_server = enviar_com_versao("lista_chamada", [turma, presenca_list], versao)
     print(response_server.get("message", "Erro ao registrar chamada."))
 
 def gerar_topicos_ia(disciplina):
@@ -428,8 +561,8 @@ def enviar_atividade(disciplina, turma):
     print(response.get("message", "Erro ao enviar atividade."))
 
 def lancar_np_grades(disciplina, turma):
-    response = send_request("get_lista_alunos_turma", [turma])
-    alunos = response if isinstance(response, dict) else {}
+    response, versao = ler_com_versao("get_lista_alunos_turma", [turma, disciplina])
+    alunos = response if isinstance(response, dict) and "error" not in response else {}
     
     if not alunos:
         print(f"Nenhum aluno na turma {turma}.")
@@ -474,7 +607,7 @@ def lancar_np_grades(disciplina, turma):
             except ValueError:
                 print("Valor inválido. Digite um número.")
 
-    response_server = send_request("lancar_np_grades", [disciplina, turma, tipo_nota, lancamentos])
+    response_server = enviar_com_versao("lancar_np_grades", [disciplina, turma, tipo_nota, lancamentos], versao)
     limpar_tela()
     print(response_server.get("message", "Erro ao lançar notas."))
 
@@ -564,6 +697,46 @@ def calcular_nota_final_turma(disciplina, turma):
     print(response.get("message", "Erro ao calcular notas finais."))
     print("Verifique o resultado na opção 'Ver notas e faltas da turma'.")
 
+def criterios_avaliacao(disciplina, turma):
+    response = send_request("get_politica_notas", [disciplina, turma])
+    if not response.get("success"):
+        print(response.get("message", "Erro ao buscar os critérios de avaliação."))
+        return
+
+    politica = response["politica"]
+    print(f"\nCritérios de avaliação - {disciplina} ({turma})")
+    print(f"Pesos: NP1 {politica['peso_np1']} | NP2 {politica['peso_np2']} | Atividades {politica['peso_atividades']}")
+    print(f"Descartar a menor nota de atividade: {'Sim' if politica['descartar_menor_atividade'] else 'Não'}")
+    print(f"Máximo de faltas: {politica['faltas_maximas'] if politica['faltas_maximas'] is not None else 'Sem limite'}")
+    print(f"Arredondamento da nota final: {politica['arredondamento']}")
+
+    if input("\nAlterar os critérios? (S/N): ").strip().upper() != "S":
+        limpar_tela()
+        return
+
+    print("Pressione ENTER para manter o valor atual.")
+    try:
+        for campo, rotulo in (("peso_np1", "Peso da NP1"), ("peso_np2", "Peso da NP2"), ("peso_atividades", "Peso das atividades")):
+            valor = input(f"{rotulo} (0 a 1): ").strip()
+            if valor:
+                politica[campo] = float(valor)
+        valor = input("Descartar a menor nota de atividade? (S/N): ").strip().upper()
+        if valor:
+            politica["descartar_menor_atividade"] = valor == "S"
+        valor = input("Máximo de faltas (número, ou '-' para sem limite): ").strip()
+        if valor:
+            politica["faltas_maximas"] = None if valor == "-" else int(valor)
+        valor = input("Arredondamento (centesimo, decimo, meio_ponto): ").strip().lower()
+        if valor:
+            politica["arredondamento"] = valor
+    except ValueError:
+        print("Entrada inválida. Critérios não alterados.")
+        return
+
+    response = send_request("definir_politica_notas", [disciplina, turma, politica])
+    limpar_tela()
+    print(response.get("message", "Erro ao salvar os critérios de avaliação."))
+
 def ver_notas_faltas_turma(disciplina, turma):
     response = send_request("ver_notas_faltas_turma", [disciplina, turma])
     relatorio = response if isinstance(response, list) else []
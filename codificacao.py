@@ -0,0 +1,298 @@
+import os
+import sys
+import json
+import time
+import struct
+import tempfile
+
+
+class ErroDecodificacao(ValueError):
+    pass
+
+
+class CodecJson:
+    """O formato de sempre: JSON em UTF-8."""
+
+    nome = "json"
+
+    def codificar(self, obj):
+        return json.dumps(obj, ensure_ascii=False).encode('utf-8')
+
+    def decodificar(self, data):
+        return json.loads(data)
+
+    def marcar(self, id_requisicao, conteudo):
+        return b'{"id":' + json.dumps(id_requisicao).encode("utf-8") + b',"resposta":' + conteudo + b'}'
+
+
+# Formato binário: cada valor começa com um byte de tipo. Inteiros e
+# tamanhos são varints (LEB128; inteiros em zigzag), floats vão em 4 bytes
+# quando isso não muda o valor e em 8 caso contrário.
+#
+# As chaves dos dicionários são internadas: cada chave é um varint n; n = 0
+# traz a chave por extenso (varint do tamanho + UTF-8) e a acrescenta à
+# tabela da mensagem, n >= 1 repete a chave n - 1 da tabela. A tabela começa
+# com CHAVES_FIXAS, então "success", "NP1" ou "nome" custam um byte mesmo
+# na primeira vez. A tabela vale só dentro de uma mensagem: respostas fora
+# de ordem não dependem umas das outras.
+_NULO, _FALSO, _VERDADEIRO, _INTEIRO, _F32, _F64, _TEXTO, _LISTA, _DICT = range(9)
+
+# Só se acrescenta ao fim: a posição de cada chave faz parte do formato.
+CHAVES_FIXAS = (
+    "success", "message", "error", "id", "resposta", "action", "params",
+    "versao_esperada", "com_versao", "resultado", "versao", "conflito",
+    "versao_atual", "ocupado", "tentar_novamente_ms", "reconectar",
+    "traceback", "action_received", "indice_falha", "resultados",
+    "nome", "ra", "turma", "turmas", "alunos", "professor", "professores",
+    "cpf", "senha", "role", "disciplina", "disciplinas", "disciplinas_turma",
+    "notas", "faltas", "presenca", "atividades", "atividades_enviadas",
+    "link", "respostas", "nota_atual", "enviada", "content", "aulas",
+    "descricao", "np1", "np2", "media_ativ", "final",
+    "NP1", "NP2", "ATIVIDADES_MEDIA", "NOTA_FINAL",
+)
+_INDICE_FIXAS = {chave: i + 1 for i, chave in enumerate(CHAVES_FIXAS)}
+_STRUCT_F32 = struct.Struct('>f')
+_STRUCT_F64 = struct.Struct('>d')
+
+
+def _varint(saida, n):
+    while n > 0x7F:
+        saida.append((n & 0x7F) | 0x80)
+        n >>= 7
+    saida.append(n)
+
+
+def _texto(saida, texto):
+    dados = texto.encode('utf-8')
+    _varint(saida, len(dados))
+    saida += dados
+
+
+class CodecBinario:
+    """Codificação compacta com chaves internadas (ver CHAVES_FIXAS).
+
+    Representa exatamente o que o JSON representa: listas e tuplas viram
+    listas e chaves que não são texto são convertidas como o json.dumps faz.
+    """
+
+    nome = "binario"
+
+    def codificar(self, obj):
+        saida = bytearray()
+        self._valor(obj, saida, {})
+        return bytes(saida)
+
+    def _valor(self, obj, saida, locais):
+        tipo = type(obj)
+        if tipo is str:
+            saida.append(_TEXTO)
+            _texto(saida, obj)
+        elif tipo is dict:
+            saida.append(_DICT)
+            _varint(saida, len(obj))
+            for chave, valor in obj.items():
+                self._chave(chave, saida, locais)
+                self._valor(valor, saida, locais)
+        elif tipo is float:
+            try:
+                curto = _STRUCT_F32.pack(obj)
+            except OverflowError:
+                curto = None
+            if curto is not None and _STRUCT_F32.unpack(curto)[0] == obj:
+                saida.append(_F32)
+                saida += curto
+            else:
+                saida.append(_F64)
+                saida += _STRUCT_F64.pack(obj)
+        elif tipo is bool:
+            saida.append(_VERDADEIRO if obj else _FALSO)
+        elif tipo is int:
+            saida.append(_INTEIRO)
+            _varint(saida, obj * 2 if obj >= 0 else -obj * 2 - 1)
+        elif obj is None:
+            saida.append(_NULO)
+        elif tipo is list or tipo is tuple:
+            saida.append(_LISTA)
+            _varint(saida, len(obj))
+            for item in obj:
+                self._valor(item, saida, locais)
+        else:
+            # Subclasses (IntEnum, OrderedDict...): mesmo resultado do JSON.
+            self._valor(json.loads(json.dumps(obj)), saida, locais)
+
+    def _chave(self, chave, saida, locais):
+        if type(chave) is not str:
+            chave = json.dumps(chave) if not isinstance(chave, str) else str(chave)
+        indice = _INDICE_FIXAS.get(chave) or locais.get(chave)
+        if indice is not None:
+            _varint(saida, indice)
+        else:
+            locais[chave] = len(CHAVES_FIXAS) + len(locais) + 1
+            saida.append(0)
+            _texto(saida, chave)
+
+    def decodificar(self, data):
+        data = bytes(data)
+        try:
+            obj, posicao = self._ler(data, 0, list(CHAVES_FIXAS))
+        except (IndexError, KeyError, struct.error, UnicodeDecodeError) as e:
+            raise ErroDecodificacao(f"Mensagem binária inválida: {e}") from None
+        if posicao != len(data):
+            raise ErroDecodificacao("Mensagem binária com bytes sobrando.")
+        return obj
+
+    def _ler(self, data, posicao, tabela):
+        tipo = data[posicao]
+        posicao += 1
+        if tipo == _TEXTO:
+            tamanho, posicao = _ler_varint(data, posicao)
+            fim = posicao + tamanho
+            if fim > len(data):
+                raise IndexError("texto truncado")
+            return data[posicao:fim].decode('utf-8'), fim
+        if tipo == _DICT:
+            quantidade, posicao = _ler_varint(data, posicao)
+            resultado = {}
+            for _ in range(quantidade):
+                indice, posicao = _ler_varint(data, posicao)
+                if indice:
+                    chave = tabela[indice - 1]
+                else:
+                    tamanho, posicao = _ler_varint(data, posicao)
+                    chave = data[posicao:posicao + tamanho].decode('utf-8')
+                    posicao += tamanho
+                    tabela.append(chave)
+                resultado[chave], posicao = self._ler(data, posicao, tabela)
+            return resultado, posicao
+        if tipo == _F32:
+            return _STRUCT_F32.unpack_from(data, posicao)[0], posicao + 4
+        if tipo == _F64:
+            return _STRUCT_F64.unpack_from(data, posicao)[0], posicao + 8
+        if tipo == _INTEIRO:
+            n, posicao = _ler_varint(data, posicao)
+            return (n >> 1) if not n & 1 else -((n + 1) >> 1), posicao
+        if tipo == _LISTA:
+            quantidade, posicao = _ler_varint(data, posicao)
+            resultado = []
+            for _ in range(quantidade):
+                item, posicao = self._ler(data, posicao, tabela)
+                resultado.append(item)
+            return resultado, posicao
+        if tipo == _VERDADEIRO:
+            return True, posicao
+        if tipo == _FALSO:
+            return False, posicao
+        if tipo == _NULO:
+            return None, posicao
+        raise ErroDecodificacao(f"Tipo binário desconhecido: {tipo}")
+
+    def marcar(self, id_requisicao, conteudo):
+        if isinstance(id_requisicao, (dict, list, tuple)):
+            # Chaves novas no id mudariam a tabela vista pela resposta.
+            return self.codificar({"id": id_requisicao, "resposta": self.decodificar(conteudo)})
+        # "id" e "resposta" são chaves fixas, então a resposta já codificada
+        # pode ser colada como está: a tabela dela começa igual.
+        saida = bytearray((_DICT, 2))
+        _varint(saida, _INDICE_FIXAS["id"])
+        self._valor(id_requisicao, saida, {})
+        _varint(saida, _INDICE_FIXAS["resposta"])
+        return bytes(saida) + conteudo
+
+
+def _ler_varint(data, posicao):
+    resultado = 0
+    deslocamento = 0
+    while True:
+        byte = data[posicao]
+        posicao += 1
+        resultado |= (byte & 0x7F) << deslocamento
+        if not byte & 0x80:
+            return resultado, posicao
+        deslocamento += 7
+
+
+JSON = CodecJson()
+CODECS = {codec.nome: codec for codec in (JSON, CodecBinario())}
+
+
+def _benchmark(repeticoes=200):
+    """Tempo de codificação/decodificação e bytes por ação, com as respostas
+    reais do servidor numa turma de 40 alunos. Confere também que cada
+    resposta volta igual pelos dois codecs."""
+    os.chdir(tempfile.mkdtemp())
+    import builtins
+    imprimir = builtins.print
+    builtins.print = lambda *a, **k: None
+    try:
+        import server
+        server.iniciar_banco()
+        p = server.processar_requisicao
+        p("cadastrar_turma", ["3A"])
+        p("cadastrar_professor", ["111", "PROFESSORA", "x"])
+        p("cadastrar_disciplina", ["MATEMATICA", "3A", "111"])
+        ras = [f"RA{i:04d}" for i in range(40)]
+        for i, ra in enumerate(ras):
+            p("cadastrar_aluno", [ra, f"ALUNO NUMERO {i}", "s", "3A"])
+        for nome in ("ATIV1", "ATIV2", "ATIV3"):
+            p("enviar_atividade", ["MATEMATICA", "3A", nome, f"https://exemplo.com/{nome}"])
+        for i, ra in enumerate(ras):
+            p("enviar_atividade_aluno", [ra, "MATEMATICA", "ATIV1", f"https://entrega.com/{ra}"])
+            p("atribuir_nota_atividade", ["MATEMATICA", "3A", "ATIV1", ra, (i % 21) / 2])
+        p("lancar_np_grades", ["MATEMATICA", "3A", "NP1", {ra: (i * 7 % 101) / 10 for i, ra in enumerate(ras)}])
+        p("lancar_np_grades", ["MATEMATICA", "3A", "NP2", {ra: (i * 3 % 101) / 10 for i, ra in enumerate(ras)}])
+        p("calcular_nota_final_turma", ["MATEMATICA", "3A"])
+        p("registrar_aula", ["MATEMATICA", "3A", "01/03", "Frações"])
+
+        acoes = [
+            ("login_aluno", ["RA0001", "s"]),
+            ("get_aluno_data", ["RA0001"]),
+            ("get_cadastro_info", []),
+            ("get_lista_alunos_turma", ["3A"]),
+            ("get_atividades_disciplina", ["MATEMATICA", "3A"]),
+            ("get_entregas_atividade", ["MATEMATICA", "3A", "ATIV1"]),
+            ("ver_notas_faltas_turma", ["MATEMATICA", "3A"]),
+            ("get_atividades_aluno_turma", ["RA0001"]),
+            ("listar_aulas", ["MATEMATICA", "3A"]),
+            ("lancar_np_grades", ["MATEMATICA", "3A", "NP1", {ra: 5.5 for ra in ras}]),
+            ("batch", [[{"action": "get_lista_alunos_turma", "params": ["3A"]}, {"action": "xx", "params": []}]]),
+            ("nao_existe", []),
+        ]
+        amostras = []
+        for action, params in acoes:
+            amostras.append((action, "requisição", {"action": action, "params": params}))
+            amostras.append((action, "resposta", json.loads(p(action, params))))
+            amostras.append((action, "com versão", json.loads(p(action, params, None, True))))
+        server.BANCO.fechar()
+    finally:
+        builtins.print = imprimir
+
+    binario = CODECS["binario"]
+    print(f"{'ação':<27} {'mensagem':<10} | {'bytes json':>10} {'binário':>8} | {'json cod/dec µs':>16} | {'binário cod/dec µs':>18}")
+    iguais = True
+    totais = {"json": 0, "binario": 0}
+    for action, tipo, obj in amostras:
+        linha = {}
+        for codec in (JSON, binario):
+            dados = codec.codificar(obj)
+            iguais = iguais and codec.decodificar(dados) == obj
+            inicio = time.perf_counter()
+            for _ in range(repeticoes):
+                codec.codificar(obj)
+            meio = time.perf_counter()
+            for _ in range(repeticoes):
+                codec.decodificar(dados)
+            fim = time.perf_counter()
+            linha[codec.nome] = (len(dados), (meio - inicio) / repeticoes * 1e6, (fim - meio) / repeticoes * 1e6)
+            totais[codec.nome] += len(dados)
+        j, b = linha["json"], linha["binario"]
+        print(f"{action:<27} {tipo:<10} | {j[0]:>10} {b[0]:>8} | {j[1]:>7.1f} / {j[2]:>6.1f} | {b[1]:>8.1f} / {b[2]:>7.1f}")
+    print(f"Total: {totais['json']} bytes em JSON, {totais['binario']} em binário "
+          f"({totais['binario'] / totais['json']:.0%}). Ida e volta idêntica: {iguais}")
+    return iguais
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2 or sys.argv[1] != "benchmark":
+        print("Uso: python codificacao.py benchmark")
+        sys.exit(1)
+    sys.exit(0 if _benchmark() else 1)
@@ -0,0 +1,117 @@
+class IndicesSecundarios:
+    """Índices derivados de `dados` para as consultas mais frequentes.
+
+    - turma → RAs dos alunos matriculados;
+    - CPF → chaves de `dados["disciplinas"]` do professor;
+    - (RA, disciplina) → atividades enviadas pelo aluno.
+
+    São montados na carga e mantidos pelo `BancoDados.definir()`: antes de
+    aplicar uma operação que altera um aluno ou uma disciplina, as entradas
+    dele saem dos índices (`remover`); depois de aplicada, são recalculadas a
+    partir do registro novo (`incluir`). Operações mais profundas, como notas,
+    não tocam os índices.
+
+    Nos armazenamentos preguiçosos (fragmentado, binário) o mapa de alunos
+    informa a turma de cada RA sem carregar o registro; as entregas de um
+    aluno ainda não carregado são indexadas no primeiro acesso.
+    """
+
+    def __init__(self, dados):
+        self.dados = dados
+        self._alunos_por_turma = {}
+        self._disciplinas_por_cpf = {}
+        self._entregas = {}
+        self._anterior = None
+
+        alunos = dados["alunos"]
+        turma_de = getattr(alunos, "turma_de", None)
+        if turma_de is None:
+            for ra, aluno in alunos.items():
+                self._indexar_aluno(ra, aluno)
+        else:
+            for ra in alunos:
+                self._alunos_por_turma.setdefault(turma_de(ra), {})[ra] = None
+
+        for chave, info in dados["disciplinas"].items():
+            self._indexar_disciplina(chave, info)
+
+    def alunos_da_turma(self, turma):
+        return self._alunos_por_turma.get(turma, {}).keys()
+
+    def disciplinas_do_professor(self, cpf):
+        return self._disciplinas_por_cpf.get(cpf, {}).keys()
+
+    def atividades_enviadas(self, ra, disciplina):
+        entregas = self._entregas.get(ra)
+        if entregas is None:
+            entregas = self._indexar_entregas(ra, self.dados["alunos"][ra])
+        return entregas.get(disciplina, {}).keys()
+
+    def remover(self, caminho):
+        alvo = self._alvo(caminho)
+        if alvo is None:
+            return
+        secao, chave = alvo
+        if secao == "alunos" and chave in self.dados["alunos"]:
+            # A entrada na turma (e a do professor, abaixo) só sai em
+            # `incluir` se o valor mudar, para preservar a ordem original.
+            self._anterior = self.dados["alunos"][chave]["turma"]
+            self._entregas.pop(chave, None)
+        elif secao == "disciplinas" and chave in self.dados["disciplinas"]:
+            self._anterior = _cpf_professor(self.dados["disciplinas"][chave])
+
+    def incluir(self, caminho):
+        alvo = self._alvo(caminho)
+        if alvo is None:
+            return
+        secao, chave = alvo
+        anterior, self._anterior = self._anterior, None
+        if chave not in self.dados[secao]:
+            # Entidade removida (desfazer de uma transação).
+            if secao == "alunos":
+                self._alunos_por_turma.get(anterior, {}).pop(chave, None)
+            else:
+                self._disciplinas_por_cpf.get(anterior, {}).pop(chave, None)
+            return
+        if secao == "alunos":
+            aluno = self.dados["alunos"][chave]
+            if anterior is not None and anterior != aluno["turma"]:
+                self._alunos_por_turma.get(anterior, {}).pop(chave, None)
+            self._indexar_aluno(chave, aluno)
+        else:
+            info = self.dados["disciplinas"][chave]
+            if anterior is not None and anterior != _cpf_professor(info):
+                self._disciplinas_por_cpf.get(anterior, {}).pop(chave, None)
+            self._indexar_disciplina(chave, info)
+
+    @staticmethod
+    def _alvo(caminho):
+        raiz = caminho[0]
+        if raiz == "alunos" and len(caminho) >= 2:
+            if len(caminho) <= 3 or caminho[2] == "atividades_enviadas":
+                return ("alunos", caminho[1])
+        elif raiz == "disciplinas" and 2 <= len(caminho) <= 3:
+            return ("disciplinas", caminho[1])
+        return None
+
+    def _indexar_aluno(self, ra, aluno):
+        self._alunos_por_turma.setdefault(aluno["turma"], {})[ra] = None
+        self._indexar_entregas(ra, aluno)
+
+    def _indexar_entregas(self, ra, aluno):
+        entregas = {}
+        for nome_atividade, envio in aluno.get("atividades_enviadas", {}).items():
+            entregas.setdefault(envio.get("disciplina"), {})[nome_atividade] = None
+        self._entregas[ra] = entregas
+        return entregas
+
+    def _indexar_disciplina(self, chave, info):
+        cpf = _cpf_professor(info)
+        if cpf is not None:
+            self._disciplinas_por_cpf.setdefault(cpf, {})[chave] = None
+
+
+def _cpf_professor(info):
+    if isinstance(info, dict) and "professor" in info:
+        return info["professor"].get("cpf")
+    return None
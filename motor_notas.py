@@ -0,0 +1,366 @@
+import os
+import sys
+import math
+import time
+import random
+import tempfile
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+PESO_NP1 = 0.35
+PESO_NP2 = 0.35
+PESO_ATIVIDADES = 0.30
+
+# Critérios de avaliação de uma disciplina (dados["disciplinas"][chave]
+# ["politica"]). Sem política, vale esta, que é a conta de sempre.
+POLITICA_PADRAO = {
+    "peso_np1": PESO_NP1,
+    "peso_np2": PESO_NP2,
+    "peso_atividades": PESO_ATIVIDADES,
+    "descartar_menor_atividade": False,
+    # Acima disso a NOTA_FINAL é 0.0 (reprovado por falta); None = sem limite.
+    "faltas_maximas": None,
+    "arredondamento": "centesimo",
+}
+
+ARREDONDAMENTOS = {
+    "centesimo": lambda valor: round(valor, 2),
+    "decimo": lambda valor: round(valor, 1),
+    # Para o meio ponto mais próximo, empates para cima (7.25 -> 7.5).
+    "meio_ponto": lambda valor: math.floor(valor * 2 + 0.5) / 2,
+}
+
+
+class NotasTurma:
+    """Notas de uma disciplina para a turma inteira, em colunas densas.
+
+    `np1` e `np2` têm uma nota por aluno (0.0 sem nota) e `atividades` uma
+    coluna por atividade cadastrada, na ordem do cadastro, com a nota de
+    cada aluno (0.0 sem nota). `faltas` tem as faltas de cada aluno e
+    `alunos` dá a ordem das linhas.
+    """
+
+    def __init__(self, alunos, np1, np2, atividades, faltas):
+        self.alunos = alunos
+        self.np1 = np1
+        self.np2 = np2
+        self.atividades = atividades
+        self.faltas = faltas
+
+    @classmethod
+    def montar(cls, dados, turma, disciplina, alunos):
+        linha = {ra: i for i, ra in enumerate(alunos)}
+        np1 = [0.0] * len(alunos)
+        np2 = [0.0] * len(alunos)
+        faltas = [0] * len(alunos)
+        for i, ra in enumerate(alunos):
+            aluno = dados["alunos"][ra]
+            notas_aluno = aluno["notas"].get(disciplina, {})
+            np1[i] = notas_aluno.get("NP1", 0.0)
+            np2[i] = notas_aluno.get("NP2", 0.0)
+            faltas[i] = aluno.get("faltas", 0)
+
+        atividades = []
+        for info_ativ in dados["turmas"][turma]["disciplinas"][disciplina].get("atividades", {}).values():
+            # Percorre só as notas lançadas, não a turma inteira.
+            coluna = [0.0] * len(alunos)
+            for ra, nota in info_ativ.get("notas", {}).items():
+                i = linha.get(ra)
+                if i is not None and nota is not None:
+                    coluna[i] = nota
+            atividades.append(coluna)
+        return cls(alunos, np1, np2, atividades, faltas)
+
+    @classmethod
+    def do_aluno(cls, dados, turma, disciplina, ra):
+        """Uma linha só, sem percorrer as notas dos outros alunos."""
+        aluno = dados["alunos"][ra]
+        notas_aluno = aluno["notas"].get(disciplina, {})
+        atividades = []
+        for info_ativ in dados["turmas"][turma]["disciplinas"][disciplina].get("atividades", {}).values():
+            nota = info_ativ.get("notas", {}).get(ra)
+            atividades.append([0.0 if nota is None else nota])
+        return cls([ra], [notas_aluno.get("NP1", 0.0)], [notas_aluno.get("NP2", 0.0)], atividades, [aluno.get("faltas", 0)])
+
+
+def _medias(notas, usar_numpy):
+    num_atividades = len(notas.atividades)
+    if np is not None and usar_numpy:
+        soma = np.zeros(len(notas.alunos))
+        for coluna in notas.atividades:
+            soma += np.asarray(coluna, dtype=np.float64)
+        return (soma / num_atividades if num_atividades else soma).tolist()
+
+    soma = [0.0] * len(notas.alunos)
+    for coluna in notas.atividades:
+        soma = [s + nota for s, nota in zip(soma, coluna)]
+    return [s / num_atividades for s in soma] if num_atividades else soma
+
+
+def _medias_sem_menor(notas, usar_numpy):
+    # A menor nota de cada aluno (a primeira, se empatar) entra na soma como
+    # 0.0 e a média é dividida por uma atividade a menos.
+    num_atividades = len(notas.atividades)
+    if num_atividades < 2:
+        return _medias(notas, usar_numpy)
+    if np is not None and usar_numpy:
+        colunas = np.asarray(notas.atividades, dtype=np.float64)
+        menor = colunas.argmin(axis=0)
+        soma = np.zeros(len(notas.alunos))
+        for k, coluna in enumerate(colunas):
+            soma += np.where(menor == k, 0.0, coluna)
+        return (soma / (num_atividades - 1)).tolist()
+
+    atividades = notas.atividades
+    menor = [min(range(num_atividades), key=lambda k: atividades[k][i]) for i in range(len(notas.alunos))]
+    soma = [0.0] * len(notas.alunos)
+    for k, coluna in enumerate(atividades):
+        soma = [s + (0.0 if m == k else nota) for s, nota, m in zip(soma, coluna, menor)]
+    return [s / (num_atividades - 1) for s in soma]
+
+
+def _ponderar(notas, medias, pesos, usar_numpy):
+    peso_np1, peso_np2, peso_atividades = pesos
+    if np is not None and usar_numpy:
+        finais = np.asarray(notas.np1, dtype=np.float64) * peso_np1 + np.asarray(notas.np2, dtype=np.float64) * peso_np2 + np.asarray(medias, dtype=np.float64) * peso_atividades
+        return finais.tolist()
+    return [(n1 * peso_np1) + (n2 * peso_np2) + (m * peso_atividades) for n1, n2, m in zip(notas.np1, notas.np2, medias)]
+
+
+def calcular(notas, usar_numpy=True):
+    """Devolve (médias de atividades, notas finais), sem arredondar.
+
+    Mesmas contas, na mesma ordem, que `calcular_nota_final` faz aluno por
+    aluno: as atividades são somadas uma coluna de cada vez (soma sequencial,
+    nunca em pares como o `numpy.sum`), a soma é dividida pelo número de
+    atividades cadastradas e a final é np1*0.35 + np2*0.35 + média*0.30.
+    Cada operação é feita em double dos dois jeitos, então o resultado é
+    idêntico bit a bit.
+    """
+    medias = _medias(notas, usar_numpy)
+    return medias, _ponderar(notas, medias, (PESO_NP1, PESO_NP2, PESO_ATIVIDADES), usar_numpy)
+
+
+def arredondar(valores):
+    # round() do Python, elemento a elemento: numpy.round arredonda de outro
+    # jeito (multiplica por 100) e pode divergir no último dígito.
+    return [round(valor, 2) for valor in valores]
+
+
+def validar_politica(politica):
+    """Devolve a política completa (campos ausentes com o valor padrão) ou
+    levanta ValueError com a mensagem para o usuário."""
+    if not isinstance(politica, dict):
+        raise ValueError("A política de notas deve ser um objeto.")
+    desconhecidos = set(politica) - set(POLITICA_PADRAO)
+    if desconhecidos:
+        raise ValueError(f"Campos desconhecidos na política de notas: {', '.join(sorted(desconhecidos))}.")
+    completa = {**POLITICA_PADRAO, **politica}
+
+    for campo in ("peso_np1", "peso_np2", "peso_atividades"):
+        peso = completa[campo]
+        if isinstance(peso, bool) or not isinstance(peso, (int, float)) or not 0.0 <= peso <= 1.0:
+            raise ValueError(f"'{campo}' deve ser um número entre 0 e 1.")
+        completa[campo] = float(peso)
+    if abs(completa["peso_np1"] + completa["peso_np2"] + completa["peso_atividades"] - 1.0) > 1e-9:
+        raise ValueError("Os pesos de NP1, NP2 e atividades devem somar 1.")
+    if not isinstance(completa["descartar_menor_atividade"], bool):
+        raise ValueError("'descartar_menor_atividade' deve ser verdadeiro ou falso.")
+    faltas = completa["faltas_maximas"]
+    if faltas is not None and (isinstance(faltas, bool) or not isinstance(faltas, int) or faltas < 0):
+        raise ValueError("'faltas_maximas' deve ser um inteiro não negativo ou nulo.")
+    if completa["arredondamento"] not in ARREDONDAMENTOS:
+        raise ValueError(f"'arredondamento' deve ser um de: {', '.join(ARREDONDAMENTOS)}.")
+    return completa
+
+
+class Avaliador:
+    """Uma política de notas pronta para uso (ver `avaliador()`).
+
+    As escolhas da política (como tirar a média, arredondar, aplicar o
+    limite de faltas) são resolvidas aqui, uma vez; a chamada só executa as
+    contas nas colunas, sem consultar a política aluno por aluno.
+
+    `avaliador(notas, usar_numpy, nativo)` devolve (ATIVIDADES_MEDIA,
+    NOTA_FINAL) arredondadas de cada aluno. `nativo(np1, np2, medias)`, se
+    dado, calcula as finais na biblioteca C, que só conhece os pesos padrão:
+    com outros pesos ele é ignorado; se devolver None, vale a conta em Python.
+    """
+
+    def __init__(self, politica):
+        self.politica = politica
+        self.pesos = (politica["peso_np1"], politica["peso_np2"], politica["peso_atividades"])
+        self.pesos_padrao = self.pesos == (PESO_NP1, PESO_NP2, PESO_ATIVIDADES)
+        self._medias = _medias_sem_menor if politica["descartar_menor_atividade"] else _medias
+        self._arredondar = ARREDONDAMENTOS[politica["arredondamento"]]
+        self._faltas_maximas = politica["faltas_maximas"]
+
+    def __call__(self, notas, usar_numpy=True, nativo=None):
+        medias = self._medias(notas, usar_numpy)
+        finais = None
+        if nativo is not None and self.pesos_padrao:
+            finais = nativo(notas.np1, notas.np2, medias)
+        if finais is None:
+            finais = _ponderar(notas, medias, self.pesos, usar_numpy)
+
+        arredondar_final = self._arredondar
+        limite = self._faltas_maximas
+        if limite is None:
+            finais = [arredondar_final(final) for final in finais]
+        else:
+            finais = [0.0 if faltas > limite else arredondar_final(final) for final, faltas in zip(finais, notas.faltas)]
+        return arredondar(medias), finais
+
+
+_AVALIADORES = {}
+
+
+def avaliador(politica=None):
+    """Avaliador da política (None = padrão), compilado na primeira vez e
+    guardado pelo conteúdo: disciplinas com a mesma política dividem o mesmo."""
+    chave = tuple(sorted({**POLITICA_PADRAO, **(politica or {})}.items()))
+    compilado = _AVALIADORES.get(chave)
+    if compilado is None:
+        compilado = _AVALIADORES[chave] = Avaliador(dict(chave))
+    return compilado
+
+
+def avaliar_turma(turma, disciplinas):
+    """Uma tarefa do recálculo geral (`recalcular_todas_notas` no servidor),
+    executada num processo do pool. `disciplinas` é uma lista de
+    (disciplina, política, NotasTurma); devolve (turma, [(disciplina, alunos,
+    médias, finais)], segundos de cálculo)."""
+    inicio = time.perf_counter()
+    resultados = [(disciplina, notas.alunos, *avaliador(politica)(notas)) for disciplina, politica, notas in disciplinas]
+    return turma, resultados, time.perf_counter() - inicio
+
+
+def _final_por_aluno(ra, disciplina, dados):
+    # A conta que `calcular_nota_final` faz para um aluno, para conferência.
+    turma = dados["alunos"][ra]["turma"]
+    atividades_disc = dados["turmas"][turma]["disciplinas"][disciplina].get("atividades", {})
+    soma_notas_atividades = 0.0
+    for info_ativ in atividades_disc.values():
+        nota = info_ativ.get("notas", {}).get(ra)
+        if nota is not None:
+            soma_notas_atividades += nota
+    media_atividades = soma_notas_atividades / len(atividades_disc) if atividades_disc else 0.0
+    notas_aluno = dados["alunos"][ra]["notas"].get(disciplina, {})
+    np1 = notas_aluno.get("NP1", 0.0)
+    np2 = notas_aluno.get("NP2", 0.0)
+    nota_final = (np1 * PESO_NP1) + (np2 * PESO_NP2) + (media_atividades * PESO_ATIVIDADES)
+    return round(media_atividades, 2), round(nota_final, 2)
+
+
+def _escola_aleatoria(gerador, turmas):
+    dados = {"alunos": {}, "turmas": {}}
+    nota = lambda: gerador.choice([0.0, 10.0, 7, round(gerador.uniform(0, 10), 2), gerador.uniform(0, 10)])
+    for t in range(turmas):
+        turma = f"T{t}"
+        alunos = [f"{turma}RA{i}" for i in range(gerador.randint(1, 60))]
+        atividades = {}
+        for a in range(gerador.randint(0, 10)):
+            atividades[f"ATIV{a}"] = {"notas": {ra: nota() for ra in alunos if gerador.random() < 0.8}}
+        dados["turmas"][turma] = {"disciplinas": {"MAT": {"atividades": atividades}}}
+        for ra in alunos:
+            lancadas = {tipo: nota() for tipo in ("NP1", "NP2") if gerador.random() < 0.9}
+            dados["alunos"][ra] = {"turma": turma, "notas": {"MAT": lancadas}, "faltas": gerador.randint(0, 3)}
+    return dados
+
+
+def _comparar(turmas=300, repeticoes=10):
+    """Confere com turmas aleatórias que os dois caminhos (e o avaliador da
+    política padrão) dão exatamente o resultado da conta aluno por aluno, e
+    mede o tempo de cada um (montagem das colunas a partir dos dados
+    incluída)."""
+    dados = _escola_aleatoria(random.Random(42), turmas)
+    alunos_por_turma = {}
+    for ra, aluno in dados["alunos"].items():
+        alunos_por_turma.setdefault(aluno["turma"], []).append(ra)
+
+    caminhos = [("python", False)] + ([("numpy", True)] if np is not None else [])
+    identicos = True
+    for nome, usar_numpy in caminhos:
+        for turma, alunos in alunos_por_turma.items():
+            medias, finais = calcular(NotasTurma.montar(dados, turma, "MAT", alunos), usar_numpy)
+            obtido = list(zip(arredondar(medias), arredondar(finais)))
+            esperado = [_final_por_aluno(ra, "MAT", dados) for ra in alunos]
+            padrao = list(zip(*avaliador()(NotasTurma.montar(dados, turma, "MAT", alunos), usar_numpy)))
+            if obtido != esperado or padrao != esperado:
+                identicos = False
+                print(f"[DIVERGÊNCIA] {nome}, turma {turma}: {obtido[:3]} != {esperado[:3]}")
+                break
+
+    # Outras políticas: o caminho NumPy tem de dar o mesmo que o Python puro.
+    if np is not None:
+        outra = avaliador({"peso_np1": 0.4, "peso_np2": 0.4, "peso_atividades": 0.2, "descartar_menor_atividade": True,
+                           "faltas_maximas": 0, "arredondamento": "meio_ponto"})
+        for turma, alunos in alunos_por_turma.items():
+            notas = NotasTurma.montar(dados, turma, "MAT", alunos)
+            if outra(notas, True) != outra(notas, False):
+                identicos = False
+                print(f"[DIVERGÊNCIA] política não padrão, turma {turma}")
+                break
+
+    inicio = time.perf_counter()
+    for _ in range(repeticoes):
+        for alunos in alunos_por_turma.values():
+            [_final_por_aluno(ra, "MAT", dados) for ra in alunos]
+    tempos = {"aluno por aluno": time.perf_counter() - inicio}
+    for nome, usar_numpy in caminhos:
+        inicio = time.perf_counter()
+        for _ in range(repeticoes):
+            for turma, alunos in alunos_por_turma.items():
+                medias, finais = calcular(NotasTurma.montar(dados, turma, "MAT", alunos), usar_numpy)
+                arredondar(medias), arredondar(finais)
+        tempos[nome] = time.perf_counter() - inicio
+
+    print(f"{len(dados['alunos'])} alunos em {turmas} turmas")
+    for nome, tempo in tempos.items():
+        print(f"{nome:>16}: {tempo / repeticoes * 1000:8.2f} ms")
+    if np is None:
+        print("NumPy não instalado: só o caminho em Python puro foi conferido.")
+    print(f"Resultados idênticos: {identicos}")
+    return identicos
+
+
+def _conferir_persistencia(modos=("json", "journal", "sqlite", "fragmentado", "binario")):
+    """Define uma política em cada modo de armazenamento, reinicia o banco e
+    confere que ela voltou do disco."""
+    import server
+
+    politica = {"peso_np1": 0.4, "peso_np2": 0.4, "peso_atividades": 0.2, "descartar_menor_atividade": True,
+                "faltas_maximas": 3, "arredondamento": "meio_ponto"}
+    esperado = {**POLITICA_PADRAO, **politica}
+    ok = True
+    for modo in modos:
+        os.chdir(tempfile.mkdtemp())
+        server.MODO_ARMAZENAMENTO = modo
+        server.BANCO = None
+        server.iniciar_banco()
+        server.processar_requisicao("cadastrar_turma", ["3A"])
+        server.processar_requisicao("cadastrar_professor", ["1", "PROF", "x"])
+        server.processar_requisicao("cadastrar_disciplina", ["MAT", "3A", "1"])
+        server.processar_requisicao("definir_politica_notas", ["MAT", "3A", politica])
+        server.BANCO.fechar()
+
+        server.BANCO = None
+        server.iniciar_banco()
+        obtida = server.get_politica_notas_server("MAT", "3A").get("politica")
+        server.BANCO.fechar()
+        server.BANCO = None
+        print(f"{modo:>12}: {'ok' if obtida == esperado else f'política perdida ({obtida})'}")
+        ok = ok and obtida == esperado
+    return ok
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2 or sys.argv[1] not in ("comparar", "persistencia"):
+        print("Uso: python motor_notas.py comparar | persistencia")
+        sys.exit(1)
+    if sys.argv[1] == "comparar":
+        sys.exit(0 if _comparar() else 1)
+    sys.exit(0 if _conferir_persistencia() else 1)
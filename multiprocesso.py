@@ -0,0 +1,285 @@
+import os
+import sys
+import json
+import time
+import socket
+import tempfile
+import threading
+
+from armazenamento import Armazenamento
+from banco_dados import BancoDados
+from codificacao import CODECS, JSON
+from protocolo import enviar_quadro, receber_quadro
+
+# Resposta da loja a uma alteração: 8 bytes com o número de sequência da
+# última alteração já publicada + a resposta do handler, já codificada.
+TAMANHO_SEQ = 8
+
+
+class LojaCentral:
+    """Processo dono dos dados no modo multiprocesso.
+
+    Vários processos de trabalho aceitam conexões na mesma porta e atendem as
+    consultas com uma réplica dos dados em memória (ver `Replica`). As
+    alterações são encaminhadas por um socket Unix para cá, onde rodam com o
+    `BancoDados` de verdade, uma de cada vez por turma como no servidor de um
+    processo só, e são gravadas pelo armazenamento configurado.
+
+    Cada alteração aplicada entra na fila de replicação do banco; depois de
+    cada requisição a fila é publicada para todas as réplicas, junto com o
+    número de sequência da última alteração. A publicação pega a trava global
+    exclusiva, então uma réplica nunca recebe um handler pela metade.
+
+    Mensagens recebidas (JSON):
+    - {"tipo": "assinar"}: a conexão passa a receber o estado completo
+      ({"seq", "dados", "versoes"}) e depois cada lote ({"seq", "operacoes"});
+    - {"tipo": "executar", "action", "params", "versao_esperada",
+      "com_versao", "codec"}: resposta com TAMANHO_SEQ bytes de sequência
+      seguidos da resposta do handler.
+    """
+
+    def __init__(self, caminho, banco, travas, executar, ativo):
+        self.caminho = caminho
+        self.banco = banco
+        self.travas = travas
+        self.executar = executar
+        self.ativo = ativo
+        self._assinantes = []
+        self._lock_publicacao = threading.Lock()
+        self._publicado = banco.seq_replicacao
+
+    def rodar(self, pronta=None):
+        if os.path.exists(self.caminho):
+            os.unlink(self.caminho)
+        servidor = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        servidor.bind(self.caminho)
+        servidor.listen()
+        servidor.settimeout(0.5)
+        if pronta is not None:
+            pronta.set()
+
+        try:
+            while self.ativo():
+                try:
+                    conn, _ = servidor.accept()
+                except socket.timeout:
+                    continue
+                conn.settimeout(None)
+                threading.Thread(target=self._atender, args=(conn,), daemon=True).start()
+        finally:
+            servidor.close()
+            for conn in self._assinantes:
+                conn.close()
+            os.unlink(self.caminho)
+
+    def _atender(self, conn):
+        try:
+            while True:
+                data = receber_quadro(conn)
+                if data is None:
+                    break
+                pedido = json.loads(data)
+                if pedido["tipo"] == "assinar":
+                    self._assinar(conn)
+                    return
+
+                response_data = self.executar(pedido["action"], pedido["params"], pedido.get("versao_esperada"),
+                                              pedido.get("com_versao", False), CODECS[pedido.get("codec", "json")])
+                seq = self.publicar()
+                enviar_quadro(conn, seq.to_bytes(TAMANHO_SEQ, 'big') + response_data)
+        except OSError:
+            pass
+        conn.close()
+
+    def publicar(self):
+        """Envia às réplicas as alterações ainda não publicadas e devolve a
+        sequência da última."""
+        if self.banco.seq_replicacao == self._publicado:
+            return self._publicado
+        with self.travas.escrita(), self._lock_publicacao:
+            self._publicar_pendentes()
+            return self._publicado
+
+    def _publicar_pendentes(self):
+        # Chamado com a trava global exclusiva: os valores ainda não foram
+        # alterados por outro handler quando são serializados.
+        operacoes, seq = self.banco.retirar_replicacao()
+        if not operacoes:
+            return
+        quadro = json.dumps({"seq": seq, "operacoes": operacoes}, ensure_ascii=False, default=dict).encode('utf-8')
+        for conn in list(self._assinantes):
+            try:
+                enviar_quadro(conn, quadro)
+            except OSError:
+                self._assinantes.remove(conn)
+        self._publicado = seq
+
+    def _assinar(self, conn):
+        with self.travas.escrita(), self._lock_publicacao:
+            self._publicar_pendentes()
+            with self.banco.lock:
+                # Mapas preguiçosos (binário, fragmentado) viram dicionários.
+                estado = json.dumps({"seq": self._publicado, "dados": self.banco.dados, "versoes": self.banco.versoes.estado()},
+                                    ensure_ascii=False, default=dict).encode('utf-8')
+            enviar_quadro(conn, estado)
+            self._assinantes.append(conn)
+
+
+class ArmazenamentoReplica(Armazenamento):
+    """Os dados vêm da loja central; a réplica não grava nada."""
+
+    def __init__(self, dados):
+        self.dados = dados
+
+    def carregar(self):
+        return self.dados
+
+    def preparar(self, dados, operacoes):
+        return None
+
+    def persistir(self, preparado):
+        pass
+
+
+class Replica:
+    """Cópia dos dados num processo de trabalho, atualizada pela `LojaCentral`.
+
+    `banco` é um `BancoDados` comum, lido pelos handlers de consulta como no
+    servidor de um processo só. Os lotes publicados pela loja são aplicados
+    com a trava global exclusiva de `travas`, então uma consulta vê cada lote
+    inteiro ou nada dele.
+
+    `encaminhar()` manda uma alteração para a loja (uma conexão por thread) e
+    só devolve a resposta depois que a réplica já aplicou a alteração: o
+    cliente sempre enxerga o que acabou de gravar.
+    """
+
+    def __init__(self, caminho, travas):
+        self.caminho = caminho
+        self.travas = travas
+        self._local = threading.local()
+        self._condicao = threading.Condition()
+        self._desconectada = False
+
+        sock = self._conectar()
+        enviar_quadro(sock, b'{"tipo": "assinar"}')
+        data = receber_quadro(sock)
+        if data is None:
+            raise ConnectionError("A loja central fechou a conexão.")
+        estado = json.loads(data)
+        self.banco = BancoDados(ArmazenamentoReplica(estado["dados"]), 0)
+        self.banco.versoes.restaurar(estado["versoes"])
+        self.banco.seq_replicacao = self.seq = estado["seq"]
+        threading.Thread(target=self._laco, args=(sock,), daemon=True).start()
+
+    def _conectar(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(self.caminho)
+        return sock
+
+    def _laco(self, sock):
+        try:
+            while True:
+                data = receber_quadro(sock)
+                if data is None:
+                    break
+                lote = json.loads(data)
+                with self.travas.escrita():
+                    self.banco.aplicar_replicadas(lote["operacoes"])
+                with self._condicao:
+                    self.seq = lote["seq"]
+                    self._condicao.notify_all()
+        except OSError:
+            pass
+        with self._condicao:
+            self._desconectada = True
+            self._condicao.notify_all()
+
+    def aguardar(self, seq):
+        with self._condicao:
+            while self.seq < seq and not self._desconectada:
+                self._condicao.wait()
+
+    def encaminhar(self, action, params, versao_esperada=None, com_versao=False, codec=JSON):
+        sock = getattr(self._local, "sock", None)
+        if sock is None:
+            sock = self._local.sock = self._conectar()
+        pedido = {"tipo": "executar", "action": action, "params": params, "versao_esperada": versao_esperada,
+                  "com_versao": com_versao, "codec": codec.nome}
+        try:
+            enviar_quadro(sock, json.dumps(pedido, ensure_ascii=False).encode('utf-8'))
+            data = receber_quadro(sock)
+        except OSError:
+            data = None
+        if data is None:
+            self._local.sock = None
+            sock.close()
+            raise ConnectionError("Conexão com a loja central perdida.")
+
+        self.aguardar(int.from_bytes(data[:TAMANHO_SEQ], 'big'))
+        return bytes(data[TAMANHO_SEQ:])
+
+    def fechar(self):
+        sock = getattr(self._local, "sock", None)
+        if sock is not None:
+            sock.close()
+        self.banco.fechar()
+
+
+def _carga(porta, segundos, resultados):
+    sock = socket.create_connection(("127.0.0.1", porta))
+    pedido = json.dumps({"action": "get_lista_alunos_turma", "params": ["3A"]}).encode('utf-8')
+    feitas = 0
+    fim = time.perf_counter() + segundos
+    while time.perf_counter() < fim:
+        enviar_quadro(sock, pedido)
+        json.loads(receber_quadro(sock))
+        feitas += 1
+    sock.close()
+    resultados.put(feitas)
+
+
+def _benchmark(processos=(1, 2, 4), clientes=8, segundos=3.0):
+    """Consultas por segundo com 1, 2, 4... processos de trabalho e uma loja
+    central, com `clientes` processos de carga consultando a mesma turma."""
+    import multiprocessing
+    os.chdir(tempfile.mkdtemp())
+    os.environ["SERVIDOR_LOG_NIVEL"] = "ERRO"
+    import server
+    server.REGISTRO.nivel = 40
+
+    contexto = multiprocessing.get_context("spawn")
+    print(f"{os.cpu_count()} CPUs; {clientes} clientes consultando uma turma de 40 alunos por {segundos:.0f}s")
+    for n in processos:
+        server.NUM_PROCESSOS = n
+        server.SERVER_RUNNING = True
+        server.PORT += 1
+        principal = threading.Thread(target=server.start_server)
+        principal.start()
+        time.sleep(2.0 + n * 0.5)
+
+        sock = socket.create_connection(("127.0.0.1", server.PORT))
+        lote = [{"action": "cadastrar_turma", "params": ["3A"]}]
+        lote += [{"action": "cadastrar_aluno", "params": [f"RA{i:03d}", f"ALUNO {i}", "s", "3A"]} for i in range(40)]
+        enviar_quadro(sock, json.dumps({"action": "batch", "params": [lote]}).encode('utf-8'))
+        receber_quadro(sock)
+        sock.close()
+
+        resultados = contexto.Queue()
+        carga = [contexto.Process(target=_carga, args=(server.PORT, segundos, resultados)) for _ in range(clientes)]
+        for p in carga:
+            p.start()
+        total = sum(resultados.get() for _ in carga)
+        for p in carga:
+            p.join()
+        print(f"{n} processo(s) de trabalho: {total / segundos:8.0f} consultas/s")
+
+        server.SERVER_RUNNING = False
+        principal.join()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] != "benchmark":
+        print("Uso: python multiprocesso.py benchmark [processos...]")
+        sys.exit(1)
+    _benchmark(tuple(int(n) for n in sys.argv[2:]) or (1, 2, 4))
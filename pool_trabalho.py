@@ -0,0 +1,62 @@
+import time
+import queue
+import threading
+from concurrent.futures import Future
+
+
+class PoolTrabalho:
+    """Número fixo de threads executando requisições de uma fila limitada.
+
+    `submeter()` nunca bloqueia: com a fila cheia devolve None e quem chamou
+    responde na hora que o servidor está ocupado. `tentar_novamente_ms()`
+    estima em quanto tempo a fila atual esvazia, a partir do tempo médio de
+    atendimento.
+    """
+
+    def __init__(self, num_workers, max_fila, minimo_espera_ms=50):
+        self.num_workers = num_workers
+        self.minimo_espera_ms = minimo_espera_ms
+        self._fila = queue.Queue(maxsize=max_fila)
+        self._tempo_medio = 0.0
+        self._fechado = False
+        self._threads = [threading.Thread(target=self._laco, daemon=True) for _ in range(num_workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def submeter(self, funcao, *args):
+        if self._fechado:
+            return None
+        futuro = Future()
+        try:
+            self._fila.put_nowait((futuro, funcao, args))
+        except queue.Full:
+            return None
+        return futuro
+
+    def tentar_novamente_ms(self):
+        estimativa = self._fila.qsize() * self._tempo_medio / self.num_workers * 1000
+        return max(self.minimo_espera_ms, int(estimativa))
+
+    def _laco(self):
+        while True:
+            item = self._fila.get()
+            if item is None:
+                return
+            futuro, funcao, args = item
+            if not futuro.set_running_or_notify_cancel():
+                continue
+
+            inicio = time.perf_counter()
+            try:
+                futuro.set_result(funcao(*args))
+            except BaseException as e:
+                futuro.set_exception(e)
+            # Média móvel exponencial do tempo de atendimento.
+            self._tempo_medio += (time.perf_counter() - inicio - self._tempo_medio) * 0.1
+
+    def fechar(self):
+        self._fechado = True
+        for _ in self._threads:
+            self._fila.put(None)
+        for thread in self._threads:
+            thread.join()
@@ -0,0 +1,217 @@
+import sys
+import json
+import time
+import zlib
+import socket
+import threading
+
+from codificacao import CODECS, JSON
+
+# Cada mensagem é "u32 big-endian com o tamanho + conteúdo". O conteúdo é
+# lido direto para um bytearray do tamanho certo com recv_into, sem
+# concatenar pedaços, e o json.loads aceita o bytearray sem cópia extra.
+# O bit mais alto do cabeçalho indica conteúdo comprimido com zlib; ele só
+# é usado depois que cliente e servidor combinam a compressão (ver
+# `OpcoesConexao`), então clientes antigos nunca o recebem, e quem recebe
+# recusa o bit numa conexão que não combinou compressão.
+TAMANHO_CABECALHO = 4
+FLAG_COMPRIMIDO = 0x80000000
+MASCARA_TAMANHO = 0x7FFFFFFF
+# Acima disso o cabeçalho vai num send separado em vez de copiar o conteúdo.
+LIMITE_CONCATENAR = 64 * 1024
+# Maior conteúdo aceito, como chega e depois de descomprimido: o tamanho do
+# cabeçalho vem do outro lado (e o buffer é alocado inteiro antes de ler), e
+# alguns KB de zlib podem virar gigabytes.
+MAX_QUADRO = 256 * 1024 * 1024
+
+# Primeira requisição de um cliente que queira combinar opções da conexão.
+ACAO_NEGOCIACAO = "negociar_conexao"
+LIMITE_COMPRESSAO_PADRAO = 1024
+# Nível 1: quase toda a redução de tamanho em JSON repetitivo, com pouca CPU.
+NIVEL_COMPRESSAO = 1
+
+
+class QuadroRecusado(ValueError):
+    """Quadro maior que `MAX_QUADRO` (como chegou ou descomprimido),
+    comprimido sem compressão combinada, ou com um zlib incompleto."""
+
+
+def ler_exato(sock, tamanho):
+    """Lê exatamente `tamanho` bytes. Devolve None se a conexão fechar antes."""
+    buffer = bytearray(tamanho)
+    visao = memoryview(buffer)
+    lidos = 0
+    while lidos < tamanho:
+        n = sock.recv_into(visao[lidos:])
+        if not n:
+            return None
+        lidos += n
+    return buffer
+
+
+def ler_cabecalho(cabecalho):
+    """Devolve (tamanho, comprimido) de um cabeçalho de 4 bytes. Recusa
+    tamanhos acima de `MAX_QUADRO` antes de qualquer byte do conteúdo."""
+    valor = int.from_bytes(cabecalho, 'big')
+    tamanho = valor & MASCARA_TAMANHO
+    if tamanho > MAX_QUADRO:
+        raise QuadroRecusado(f"Quadro de {tamanho} bytes, acima do limite de {MAX_QUADRO}.")
+    return tamanho, bool(valor & FLAG_COMPRIMIDO)
+
+
+def abrir_conteudo(conteudo, comprimido, opcoes=None):
+    if not comprimido:
+        return conteudo
+    if opcoes is None or opcoes.compressao != "zlib":
+        raise QuadroRecusado("Quadro comprimido sem compressão combinada na conexão.")
+    descompressor = zlib.decompressobj()
+    aberto = descompressor.decompress(conteudo, MAX_QUADRO)
+    if descompressor.unconsumed_tail:
+        raise QuadroRecusado(f"Quadro maior que {MAX_QUADRO} bytes depois de descomprimido.")
+    if not descompressor.eof or descompressor.unused_data:
+        raise QuadroRecusado("Quadro comprimido incompleto ou com bytes além do fim do zlib.")
+    return aberto
+
+
+def receber_quadro(sock, opcoes=None):
+    """Devolve o conteúdo da próxima mensagem, ou None se a conexão fechou.
+
+    Quadros comprimidos só são aceitos com `opcoes` que combinaram a
+    compressão; os demais levantam `QuadroRecusado`.
+    """
+    cabecalho = ler_exato(sock, TAMANHO_CABECALHO)
+    if cabecalho is None:
+        return None
+    tamanho, comprimido = ler_cabecalho(cabecalho)
+    conteudo = ler_exato(sock, tamanho)
+    if conteudo is None:
+        return None
+    return abrir_conteudo(conteudo, comprimido, opcoes)
+
+
+def _preparar(conteudo, opcoes):
+    # Devolve (cabeçalho, conteúdo a enviar).
+    if opcoes is not None and opcoes.comprimir(len(conteudo)):
+        comprimido = zlib.compress(conteudo, NIVEL_COMPRESSAO)
+        if len(comprimido) < len(conteudo):
+            return (len(comprimido) | FLAG_COMPRIMIDO).to_bytes(TAMANHO_CABECALHO, 'big'), comprimido
+    return len(conteudo).to_bytes(TAMANHO_CABECALHO, 'big'), conteudo
+
+
+def montar_quadro(conteudo, opcoes=None):
+    cabecalho, conteudo = _preparar(conteudo, opcoes)
+    return cabecalho + conteudo
+
+
+def enviar_quadro(sock, conteudo, opcoes=None):
+    cabecalho, conteudo = _preparar(conteudo, opcoes)
+    if len(conteudo) <= LIMITE_CONCATENAR:
+        sock.sendall(cabecalho + conteudo)
+    else:
+        sock.sendall(cabecalho)
+        sock.sendall(conteudo)
+
+
+class OpcoesConexao:
+    """O que cliente e servidor combinaram para uma conexão.
+
+    O cliente abre com {"action": "negociar_conexao", "params": [oferta]},
+    oferta = {"compressao": ["zlib"], "limite_compressao": bytes,
+    "codecs": [preferidos...]}; o servidor responde com o que aceitou e, dali
+    em diante, os dois lados usam o codec escolhido (ver `codificacao`) e
+    comprimem as mensagens maiores que o limite. A negociação em si é sempre
+    em JSON. Um servidor antigo responde "Ação desconhecida" e a conexão
+    segue em JSON, sem compressão.
+    """
+
+    def __init__(self, compressao=None, limite_compressao=LIMITE_COMPRESSAO_PADRAO, codec=JSON):
+        self.compressao = compressao
+        self.limite_compressao = limite_compressao
+        self.codec = codec
+
+    def comprimir(self, tamanho):
+        return self.compressao == "zlib" and tamanho > self.limite_compressao
+
+    def negociar(self, oferta):
+        if not isinstance(oferta, dict):
+            oferta = {}
+        if "zlib" in oferta.get("compressao", []):
+            self.compressao = "zlib"
+            limite = oferta.get("limite_compressao")
+            if isinstance(limite, int) and limite >= 0:
+                self.limite_compressao = limite
+        for nome in oferta.get("codecs", []):
+            if nome in CODECS:
+                self.codec = CODECS[nome]
+                break
+        return {"success": True, "compressao": self.compressao, "limite_compressao": self.limite_compressao, "codec": self.codec.nome}
+
+    @classmethod
+    def oferta(cls, limite_compressao=LIMITE_COMPRESSAO_PADRAO, codecs=("json",)):
+        return {"compressao": ["zlib"], "limite_compressao": limite_compressao, "codecs": list(codecs)}
+
+    @classmethod
+    def da_resposta(cls, resposta):
+        if isinstance(resposta, dict) and resposta.get("success"):
+            return cls(resposta.get("compressao"), resposta.get("limite_compressao", LIMITE_COMPRESSAO_PADRAO),
+                       CODECS.get(resposta.get("codec"), JSON))
+        return cls()
+
+
+def marcar_resposta(id_requisicao, conteudo, codec=JSON):
+    """Envolve a resposta de uma requisição com "id" em {"id", "resposta"}.
+
+    Requisições com "id" podem ser enviadas em sequência sem esperar as
+    respostas, que voltam na ordem em que ficam prontas; o "id" diz a qual
+    requisição cada uma pertence. Sem "id" a resposta vai como sempre foi.
+    """
+    if id_requisicao is None:
+        return conteudo
+    return codec.marcar(id_requisicao, conteudo)
+
+
+def _receber_antigo(sock):
+    # Laço usado antes deste módulo, mantido só para o benchmark.
+    tamanho = int.from_bytes(sock.recv(4), 'big')
+    data = b''
+    bytes_recv = 0
+    while bytes_recv < tamanho:
+        chunk = sock.recv(min(tamanho - bytes_recv, 4096))
+        if not chunk:
+            break
+        data += chunk
+        bytes_recv += len(chunk)
+    return data
+
+
+def _benchmark(tamanhos=(1024, 1024 * 1024, 50 * 1024 * 1024)):
+    print(f"{'quadro':>8} | {'laço antigo':>12} | {'recv_into':>12} | ganho")
+    for tamanho in tamanhos:
+        # Conteúdo JSON válido, como as respostas do servidor.
+        conteudo = json.dumps("x" * (tamanho - 2)).encode("utf-8")
+        # O laço antigo é quadrático: quadros grandes rodam uma vez só.
+        repeticoes = 200 if tamanho <= 64 * 1024 else (5 if tamanho <= 8 * 1024 * 1024 else 1)
+        tempos = {}
+        for nome, receber in (("antigo", _receber_antigo), ("novo", receber_quadro)):
+            a, b = socket.socketpair()
+            try:
+                inicio = time.perf_counter()
+                for _ in range(repeticoes):
+                    escritor = threading.Thread(target=enviar_quadro, args=(a, conteudo))
+                    escritor.start()
+                    json.loads(receber(b))
+                    escritor.join()
+                tempos[nome] = (time.perf_counter() - inicio) / repeticoes
+            finally:
+                a.close()
+                b.close()
+
+        rotulo = f"{tamanho // 1024 // 1024} MB" if tamanho >= 1024 * 1024 else f"{tamanho // 1024} KB"
+        print(f"{rotulo:>8} | {tempos['antigo'] * 1000:9.2f} ms | {tempos['novo'] * 1000:9.2f} ms | {tempos['antigo'] / tempos['novo']:.1f}x")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2 or sys.argv[1] != "benchmark":
+        print("Uso: python protocolo.py benchmark")
+        sys.exit(1)
+    _benchmark()
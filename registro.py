@@ -0,0 +1,116 @@
+import sys
+import time
+import queue
+import random
+import threading
+
+NIVEIS = {"DEBUG": 10, "INFO": 20, "AVISO": 30, "ERRO": 40}
+
+
+def ler_amostragem(texto):
+    """'acao=0.1,outra=0.01' -> {"acao": 0.1, "outra": 0.01}."""
+    taxas = {}
+    for item in (texto or "").split(","):
+        if "=" in item:
+            acao, taxa = item.split("=", 1)
+            taxas[acao.strip()] = float(taxa)
+    return taxas
+
+
+class Registro:
+    """Log do servidor gravado por uma thread própria.
+
+    Quem registra só formata a linha e a põe numa fila limitada, com
+    `put_nowait`: um handler nunca espera pelo console ou pelo disco. Com a
+    fila cheia a linha é descartada e contada; o total sai no `fechar()`.
+    A thread de escrita junta o que estiver na fila e grava tudo de uma vez.
+
+    Níveis: DEBUG (conexões abertas/fechadas, cálculos), INFO (uma linha por
+    requisição), AVISO (servidor ocupado, dados inválidos) e ERRO. As linhas
+    de requisição podem ser amostradas por ação: com {"get_lista_alunos_turma":
+    0.1}, só uma em cada dez dessas é registrada. Avisos e erros nunca são
+    amostrados.
+    """
+
+    def __init__(self, nivel="INFO", amostragem=None, arquivo=None, max_fila=10000):
+        self.nivel = NIVEIS[nivel]
+        self.amostragem = amostragem or {}
+        self.arquivo = arquivo
+        self.descartadas = 0
+        self._fila = queue.Queue(maxsize=max_fila)
+        self._thread = threading.Thread(target=self._laco, daemon=True)
+        self._thread.start()
+
+    def ativo(self, nivel):
+        return NIVEIS[nivel] >= self.nivel
+
+    def registrar(self, nivel, tag, mensagem):
+        if NIVEIS[nivel] < self.nivel:
+            return
+        self._enfileirar(f"{_agora()} {nivel:<5} [{tag}] {mensagem}\n")
+
+    def debug(self, tag, mensagem):
+        self.registrar("DEBUG", tag, mensagem)
+
+    def info(self, tag, mensagem):
+        self.registrar("INFO", tag, mensagem)
+
+    def aviso(self, tag, mensagem):
+        self.registrar("AVISO", tag, mensagem)
+
+    def erro(self, tag, mensagem):
+        self.registrar("ERRO", tag, mensagem)
+
+    def requisicao(self, action, duracao, bytes_entrada, bytes_saida, addr):
+        if NIVEIS["INFO"] < self.nivel:
+            return
+        taxa = self.amostragem.get(action, 1.0)
+        if taxa < 1.0 and random.random() >= taxa:
+            return
+        self._enfileirar(f"{_agora()} INFO  [REQUISIÇÃO] {action} {duracao * 1000:.2f}ms "
+                         f"entrada={bytes_entrada}B saida={bytes_saida}B {_endereco(addr)}\n")
+
+    def _enfileirar(self, linha):
+        try:
+            self._fila.put_nowait(linha)
+        except queue.Full:
+            self.descartadas += 1
+
+    def _laco(self):
+        destino = open(self.arquivo, "a", encoding="utf-8") if self.arquivo else None
+        try:
+            while True:
+                linhas = [self._fila.get()]
+                while True:
+                    try:
+                        linhas.append(self._fila.get_nowait())
+                    except queue.Empty:
+                        break
+                fim = None in linhas
+                saida = destino or sys.stdout
+                saida.write("".join(linha for linha in linhas if linha is not None))
+                saida.flush()
+                if fim:
+                    return
+        finally:
+            if destino:
+                destino.close()
+
+    def fechar(self):
+        if not self._thread.is_alive():
+            return
+        if self.descartadas:
+            self._fila.put(f"{_agora()} AVISO [LOG] {self.descartadas} linhas descartadas com a fila cheia.\n")
+        self._fila.put(None)
+        self._thread.join()
+
+
+def _agora():
+    agora = time.time()
+    return time.strftime("%H:%M:%S", time.localtime(agora)) + f".{int(agora % 1 * 1000):03d}"
+
+
+def _endereco(addr):
+    if isinstance(addr, tuple) and len(addr) >= 2:
+        return f"{addr[0]}:{addr[1]}"
+    return str(addr)
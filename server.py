@@ -4,76 +4,118 @@ import hashlib
 import socket
 import threading
 import traceback
+import queue
 import google.genai as genai
-import ctypes  
 import sys
 import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import nullcontext
+
+from armazenamento import ArmazenamentoJSON, ArmazenamentoJournal
+from armazenamento_sqlite import ArmazenamentoSQLite
+from armazenamento_fragmentado import ArmazenamentoFragmentado
+from banco_dados import BancoDados
+from calculadora import carregar as carregar_calculadora
+from motor_notas import POLITICA_PADRAO, NotasTurma, avaliador, avaliar_turma, validar_politica
+from multiprocesso import LojaCentral, Replica
+from pool_trabalho import PoolTrabalho
+from codificacao import JSON, ErroDecodificacao
+from registro import Registro, ler_amostragem
+from protocolo import ACAO_NEGOCIACAO, OpcoesConexao, QuadroRecusado, enviar_quadro, marcar_resposta, receber_quadro
+from servidor_async import ServidorAsync
+from travas import TravasEscola
+from versoes import chave_atividade, chave_chamada, chave_disciplina, chave_notas, chave_turma
 
 HOST = '127.0.0.1'  
 PORT = 65432        
 DATABASE_FILE = "dados.json"
+SQLITE_FILE = "dados.db"
+FRAGMENTOS_DIR = "dados_turmas"
+SNAPSHOT_BINARIO_FILE = "dados.bin"
+# "json" regrava o arquivo inteiro a cada alteração; "journal" anexa cada
+# alteração a dados.json.log e gera snapshots periódicos em segundo plano;
+# "sqlite" grava só as linhas afetadas em dados.db; "fragmentado" mantém um
+# arquivo por turma em dados_turmas/ e regrava só as turmas alteradas;
+# "binario" é o modo journal com snapshot binário mapeado em memória
+# (dados.bin). Os três últimos importam dados.json na primeira execução.
+MODO_ARMAZENAMENTO = os.getenv("SERVIDOR_ARMAZENAMENTO", "json")
+# Alterações que chegam dentro desta janela são gravadas num único lote.
+JANELA_COMMIT = float(os.getenv("SERVIDOR_JANELA_COMMIT_MS", "5")) / 1000
+# "threads" dá a cada conexão uma thread que só lê e escreve no socket;
+# "asyncio" atende todas as conexões num único laço de eventos. Nos dois as
+# requisições rodam num pool fixo de MAX_WORKERS threads, com no máximo
+# MAX_FILA requisições esperando; além disso, e acima de MAX_CONEXOES
+# conexões, o cliente recebe na hora "servidor ocupado".
+MOTOR_SERVIDOR = os.getenv("SERVIDOR_MOTOR", "threads")
+MAX_WORKERS = int(os.getenv("SERVIDOR_MAX_WORKERS", "32"))
+MAX_FILA = int(os.getenv("SERVIDOR_MAX_FILA", "256"))
+MAX_CONEXOES = int(os.getenv("SERVIDOR_MAX_CONEXOES", "1000"))
+# Respostas prontas e ainda não enviadas por conexão; acima disso a conexão
+# para de ler requisições até o cliente ler as respostas.
+MAX_PENDENTES_CONEXAO = int(os.getenv("SERVIDOR_MAX_PENDENTES_CONEXAO", "64"))
+# Acima de 1, sobe esse número de processos de trabalho aceitando na mesma
+# porta (SO_REUSEPORT) e um processo de loja central, dono dos dados, que
+# executa as alterações e as replica para os demais pelo socket Unix
+# SOCKET_LOJA (ver multiprocesso.py). Só em sistemas com SO_REUSEPORT.
+NUM_PROCESSOS = int(os.getenv("SERVIDOR_PROCESSOS", "1"))
+SOCKET_LOJA = os.getenv("SERVIDOR_SOCKET_LOJA", "servidor_loja.sock")
+# Processos que dividem, por turma, o recálculo de todas as notas finais
+# (ação recalcular_todas_notas). Com 1, o cálculo roda no próprio servidor.
+PROCESSOS_NOTAS = int(os.getenv("SERVIDOR_PROCESSOS_NOTAS", str(os.cpu_count() or 1)))
+# Memória para as respostas prontas de ver_notas_faltas_turma (ver
+# cache_relatorios.py); 0 desliga o cache.
+CACHE_RELATORIOS_BYTES = int(os.getenv("SERVIDOR_CACHE_RELATORIOS_KB", "8192")) * 1024
+# Com 1, as notas finais são calculadas pela biblioteca C (calculadora.py);
+# nas turmas de tamanho real a conta em Python é mais rápida.
+USAR_CALCULADORA_C = os.getenv("SERVIDOR_CALCULADORA_C", "0") == "1"
+# Log gravado em segundo plano (ver registro.py). Nível DEBUG, INFO (uma
+# linha por requisição), AVISO ou ERRO; amostragem por ação no formato
+# "get_lista_alunos_turma=0.1,ver_notas_faltas_turma=0.5"; sem arquivo, o
+# log vai para o console.
+LOG_NIVEL = os.getenv("SERVIDOR_LOG_NIVEL", "INFO").upper()
+LOG_AMOSTRAGEM = ler_amostragem(os.getenv("SERVIDOR_LOG_AMOSTRAGEM"))
+LOG_ARQUIVO = os.getenv("SERVIDOR_LOG_ARQUIVO")
 
 SERVER_RUNNING = True
 
-C_LIB_LOADED = False
-C_FUNCTION = None  
-
-DLL_NAME = 'calculator.dll'
-DLL_PATH = os.path.join(os.path.dirname(__file__), DLL_NAME)
-
-try:
-    import struct
-    py_bits = struct.calcsize("P") * 8
-    print(f"[CTYPES] Python arquitetura: {py_bits} bits")
-
-    C_CALCULATOR = ctypes.CDLL(DLL_PATH)
-
-    try:
-        C_FUNCTION = C_CALCULATOR._calculate_final_grade
-        C_FUNCTION.argtypes = [ctypes.c_double, ctypes.c_double, ctypes.c_double]
-        C_FUNCTION.restype = ctypes.c_double
-        C_LIB_LOADED = True
-        print(f"[CTYPES] Biblioteca C ({DLL_NAME}) carregada com sucesso e função _calculate_final_grade vinculada.")
-    except AttributeError:
-        try:
-            C_FUNCTION = C_CALCULATOR.calculate_final_grade
-            C_FUNCTION.argtypes = [ctypes.c_double, ctypes.c_double, ctypes.c_double]
-            C_FUNCTION.restype = ctypes.c_double
-            C_LIB_LOADED = True
-            print(f"[CTYPES] Biblioteca C ({DLL_NAME}) carregada com sucesso e função calculate_final_grade vinculada (sem underscore).")
-        except AttributeError:
-            C_FUNCTION = None
-            C_LIB_LOADED = False
-            print(f"[AVISO CTYPES] Função esperada não encontrada na DLL '{DLL_NAME}'. Verifique os símbolos exportados (esperado: _calculate_final_grade ou calculate_final_grade).")
-
-except OSError as oe:
-    C_LIB_LOADED = False
-    C_FUNCTION = None
-    print(f"[AVISO CTYPES] Falha ao carregar a biblioteca C (OSError). O código usará a lógica Python. Detalhe: {oe}")
-except Exception as e:
-    C_LIB_LOADED = False
-    C_FUNCTION = None
-    print(f"[AVISO CTYPES] Falha ao carregar a biblioteca C. O código usará a lógica Python. Erro: {e}")
-
-
-def carregar_dados():
-    default_data = {"alunos": {}, "professores": {}, "disciplinas": {}, "turmas": {}}
-
-    if os.path.exists(DATABASE_FILE) and os.path.getsize(DATABASE_FILE) > 0:
-        try:
-            with open(DATABASE_FILE, "r", encoding="utf-8") as arquivo:
-                data = json.load(arquivo)
-                return data if data else default_data
-        except json.JSONDecodeError:
-            print("AVISO NO SERVIDOR: Arquivo JSON corrompido. Inicializando com padrão.")
-        except Exception as e:
-            print(f"ERRO NO SERVIDOR ao carregar dados: {e}")
-
-    return default_data
-
-def salvar_dados(dados):
-    with open(DATABASE_FILE, "w", encoding="utf-8") as arquivo:
-        json.dump(dados, arquivo, indent=4, ensure_ascii=False)
+BANCO = None
+# Num processo de trabalho do modo multiprocesso: a réplica da loja central.
+REPLICA = None
+TRAVAS = TravasEscola()
+REGISTRO = Registro(LOG_NIVEL, LOG_AMOSTRAGEM, LOG_ARQUIVO)
+POOL = None
+# Criado no primeiro recálculo geral (ver `pool_notas`).
+POOL_NOTAS = None
+
+CONEXOES_ATIVAS = 0
+LOCK_CONEXOES = threading.Lock()
+
+CALCULADORA = carregar_calculadora() if USAR_CALCULADORA_C else None
+C_LIB_LOADED = CALCULADORA is not None
+C_FUNCTION = CALCULADORA.final if C_LIB_LOADED else None
+
+
+def criar_armazenamento(modo):
+    if modo == "json":
+        return ArmazenamentoJSON(DATABASE_FILE)
+    elif modo == "journal":
+        return ArmazenamentoJournal(DATABASE_FILE)
+    elif modo == "sqlite":
+        return ArmazenamentoSQLite(SQLITE_FILE, DATABASE_FILE)
+    elif modo == "binario":
+        return ArmazenamentoJournal(SNAPSHOT_BINARIO_FILE, formato="binario", arquivo_origem=DATABASE_FILE)
+    elif modo == "fragmentado":
+        return ArmazenamentoFragmentado(FRAGMENTOS_DIR, DATABASE_FILE)
+    raise ValueError(f"Modo de armazenamento desconhecido: '{modo}'")
+
+def iniciar_banco():
+    global BANCO
+    if BANCO is None:
+        BANCO = BancoDados(criar_armazenamento(MODO_ARMAZENAMENTO), JANELA_COMMIT)
+        BANCO.relatorios.limite_bytes = CACHE_RELATORIOS_BYTES
+        print(f"[BANCO] Dados carregados em memória (modo {MODO_ARMAZENAMENTO}).")
+    return BANCO
 
 def hash_senha(senha):
     return hashlib.sha256(senha.encode("utf-8")).hexdigest()
@@ -85,26 +127,26 @@ def limpar_tela():
         os.system('clear')
 
 def cadastrar_turma_server(nome_turma):
-    dados = carregar_dados()
+    dados = BANCO.dados
     nome_turma = nome_turma.upper()
     if nome_turma in dados["turmas"]:
         return {"success": False, "message": "Essa turma já está cadastrada!"}
 
-    dados["turmas"][nome_turma] = {"disciplinas": {}, "alunos": {}, "presenca": {}}
-    salvar_dados(dados)
+    BANCO.definir(["turmas", nome_turma], {"disciplinas": {}, "presenca": {}})
+    BANCO.salvar()
     return {"success": True, "message": f"Turma '{nome_turma}' cadastrada com sucesso!"}
 
 def cadastrar_professor_server(cpf, nome, senha):
-    dados = carregar_dados()
+    dados = BANCO.dados
     if cpf in dados["professores"]:
         return {"success": False, "message": "Professor já cadastrado!"}
 
-    dados["professores"][cpf] = {"nome": nome, "senha": hash_senha(senha)}
-    salvar_dados(dados)
+    BANCO.definir(["professores", cpf], {"nome": nome, "senha": hash_senha(senha)})
+    BANCO.salvar()
     return {"success": True, "message": f"Professor '{nome}' cadastrado com sucesso!"}
 
 def get_cadastro_info(entity):
-    dados = carregar_dados()
+    dados = BANCO.dados
     if entity == "turmas":
         return list(dados["turmas"].keys())
     elif entity == "professores":
@@ -112,7 +154,7 @@ def get_cadastro_info(entity):
     return []
 
 def cadastrar_disciplina_server(nome_disc, turma_escolhida, cpf_prof_escolhido):
-    dados = carregar_dados()
+    dados = BANCO.dados
     nome_disc = nome_disc.upper()
 
     chave_disciplina = f"{nome_disc}-{turma_escolhida}"
@@ -128,24 +170,24 @@ def cadastrar_disciplina_server(nome_disc, turma_escolhida, cpf_prof_escolhido):
 
     info_prof = dados["professores"][cpf_prof_escolhido]
 
-    dados["disciplinas"][chave_disciplina] = {
+    BANCO.definir(["disciplinas", chave_disciplina], {
         "professor": {"cpf": cpf_prof_escolhido, "nome": info_prof["nome"]},
         "turma": turma_escolhida,
         "nome_original": nome_disc,
         "atividades": {},
-    }
+    })
 
-    dados["turmas"][turma_escolhida]["disciplinas"][nome_disc] = {
+    BANCO.definir(["turmas", turma_escolhida, "disciplinas", nome_disc], {
         "professor": {"cpf": cpf_prof_escolhido, "nome": info_prof["nome"]},
         "atividades": {},
         "aulas": {} 
-    }
+    })
 
-    salvar_dados(dados)
+    BANCO.salvar()
     return {"success": True, "message": f"Disciplina '{nome_disc}' cadastrada na turma '{turma_escolhida}' com o professor '{info_prof['nome']}'."}
 
 def cadastrar_aluno_server(ra, nome, senha, turma_escolhida):
-    dados = carregar_dados()
+    dados = BANCO.dados
     ra = ra.upper()
     nome = nome.upper()
 
@@ -163,10 +205,9 @@ def cadastrar_aluno_server(ra, nome, senha, turma_escolhida):
         "atividades_enviadas": {}
     }
 
-    dados["alunos"][ra] = aluno_data
-    dados["turmas"][turma_escolhida]["alunos"][ra] = {k: aluno_data[k] for k in ["nome", "faltas", "notas", "atividades_enviadas"]}
+    BANCO.definir(["alunos", ra], aluno_data)
 
-    salvar_dados(dados)
+    BANCO.salvar()
     return {"success": True, "message": f"Aluno '{nome}' cadastrado na turma '{turma_escolhida}'."}
 
 def login_administrador_server(usuario, senha):
@@ -176,7 +217,7 @@ def login_administrador_server(usuario, senha):
         return {"role": None, "message": "Acesso negado!"}
 
 def login_professor_server(cpf, senha):
-    dados = carregar_dados()
+    dados = BANCO.dados
     if cpf not in dados["professores"]:
         return {"role": None, "message": "CPF não encontrado! Solicite seu cadastro ao Admin."}
     if dados["professores"][cpf]["senha"] != hash_senha(senha):
@@ -184,15 +225,15 @@ def login_professor_server(cpf, senha):
 
     disciplinas_do_prof = {}
 
-    for chave_disc, info in dados["disciplinas"].items():
-        if isinstance(info, dict) and "professor" in info and info["professor"].get("cpf") == cpf:
-            disc_nome = info.get("nome_original", chave_disc.split('-')[0])
-            disciplinas_do_prof[disc_nome] = info["turma"]
+    for chave_disc in BANCO.indices.disciplinas_do_professor(cpf):
+        info = dados["disciplinas"][chave_disc]
+        disc_nome = info.get("nome_original", chave_disc.split('-')[0])
+        disciplinas_do_prof[disc_nome] = info["turma"]
 
     return {"role": "professor", "cpf": cpf, "nome": dados["professores"][cpf]["nome"], "disciplinas": disciplinas_do_prof}
 
 def login_aluno_server(ra, senha):
-    dados = carregar_dados()
+    dados = BANCO.dados
     ra = ra.upper()
 
     if ra not in dados["alunos"]:
@@ -220,7 +261,7 @@ def login_aluno_server(ra, senha):
     }
 
 def get_aluno_data_server(ra):
-    dados = carregar_dados()
+    dados = BANCO.dados
     aluno = dados["alunos"].get(ra.upper())
 
     if not aluno:
@@ -243,20 +284,31 @@ def get_aluno_data_server(ra):
         "notas": notas_formatadas
     }
 
-def lista_chamada_server(turma, presenca_list):
-    dados = carregar_dados()
+def aluno_da_turma(turma, ra):
+    if ra not in BANCO.indices.alunos_da_turma(turma):
+        raise KeyError(ra)
+    return BANCO.dados["alunos"][ra]
+
+def visao_aluno_turma(aluno):
+    return {k: aluno[k] for k in ["nome", "faltas", "notas", "atividades_enviadas"]}
 
+def lista_chamada_server(turma, presenca_list):
     for ra, presente in presenca_list.items():
         if not presente:
-            dados["turmas"][turma]["alunos"][ra]["faltas"] = dados["turmas"][turma]["alunos"][ra].get("faltas", 0) + 1
-            dados["alunos"][ra]["faltas"] = dados["alunos"][ra].get("faltas", 0) + 1
+            BANCO.definir(["alunos", ra, "faltas"], aluno_da_turma(turma, ra).get("faltas", 0) + 1)
+            # Disciplinas com limite de faltas: a final do aluno pode mudar.
+            for disciplina in BANCO.dados["turmas"][turma]["disciplinas"]:
+                if (politica_da_disciplina(disciplina, turma) or {}).get("faltas_maximas") is not None:
+                    calcular_nota_final(ra, disciplina, BANCO.dados)
 
-    salvar_dados(dados)
+    BANCO.salvar()
     return {"success": True, "message": "Chamada registrada!"}
 
-def get_lista_alunos_turma(turma):
-    dados = carregar_dados()
-    return dados["turmas"].get(turma, {}).get("alunos", {})
+def get_lista_alunos_turma(turma, disciplina=None):
+    # A disciplina só escolhe a versão devolvida com "com_versao": a das
+    # notas dela (lançamento de NP) em vez da da chamada.
+    dados = BANCO.dados
+    return {ra: visao_aluno_turma(dados["alunos"][ra]) for ra in BANCO.indices.alunos_da_turma(turma)}
 
 def gerar_topicos_ia_server(disciplina, tema):
     try:
@@ -282,7 +334,7 @@ def gerar_topicos_ia_server(disciplina, tema):
         }
 
 def enviar_atividade_server(disciplina, turma, nome_atividade, link_atividade):
-    dados = carregar_dados()
+    dados = BANCO.dados
 
     num_atividades = len(dados["turmas"][turma]["disciplinas"][disciplina].get("atividades", {}))
     if num_atividades >= 10:
@@ -294,51 +346,49 @@ def enviar_atividade_server(disciplina, turma, nome_atividade, link_atividade):
         "notas": {}
     }
 
-    dados["turmas"][turma]["disciplinas"][disciplina]["atividades"][nome_atividade] = atividade_data
+    BANCO.definir(["turmas", turma, "disciplinas", disciplina, "atividades", nome_atividade], atividade_data)
+    # Uma atividade a mais muda a média de todos os alunos da turma.
+    calcular_notas_finais(disciplina, turma)
 
-    salvar_dados(dados)
+    BANCO.salvar()
     return {"success": True, "message": f"Atividade '{nome_atividade}' enviada."}
 
 def lancar_np_grades_server(disciplina, turma, tipo_nota, lancamentos):
-    dados = carregar_dados()
-
     for ra, nota in lancamentos.items():
         try:
             nota_float = float(nota)
             if 0.0 <= nota_float <= 10.0:
-                if disciplina not in dados["alunos"][ra]["notas"]:
-                    dados["alunos"][ra]["notas"][disciplina] = {}
-                if disciplina not in dados["turmas"][turma]["alunos"][ra]["notas"]:
-                    dados["turmas"][turma]["alunos"][ra]["notas"][disciplina] = {}
+                if disciplina not in aluno_da_turma(turma, ra)["notas"]:
+                    BANCO.definir(["alunos", ra, "notas", disciplina], {})
 
-                dados["alunos"][ra]["notas"][disciplina][tipo_nota] = nota_float
-                dados["turmas"][turma]["alunos"][ra]["notas"][disciplina][tipo_nota] = nota_float
+                BANCO.definir(["alunos", ra, "notas", disciplina, tipo_nota], nota_float)
+                calcular_nota_final(ra, disciplina, BANCO.dados)
         except ValueError:
             pass
 
-    salvar_dados(dados)
+    BANCO.salvar()
     return {"success": True, "message": f"Lançamento de {tipo_nota} concluído!"}
 
 def get_atividades_disciplina(disciplina, turma):
-    dados = carregar_dados()
+    dados = BANCO.dados
     return dados["turmas"][turma]["disciplinas"].get(disciplina, {}).get("atividades", {})
 
 def get_entregas_atividade(disciplina, turma, nome_atividade):
-    dados = carregar_dados()
+    dados = BANCO.dados
 
     atividades = dados["turmas"][turma]["disciplinas"].get(disciplina, {}).get("atividades", {})
     atividade_data = atividades.get(nome_atividade, {})
 
     respostas = atividade_data.get("respostas", {})
     notas = atividade_data.get("notas", {})
-    alunos_turma = dados["turmas"][turma]["alunos"]
+    alunos_turma = BANCO.indices.alunos_da_turma(turma)
 
     entregas = []
     for ra, link in respostas.items():
         if ra in alunos_turma:
             entregas.append({
                 "ra": ra,
-                "nome": alunos_turma[ra]["nome"],
+                "nome": dados["alunos"][ra]["nome"],
                 "link": link,
                 "nota_atual": notas.get(ra, "PENDENTE")
             })
@@ -346,85 +396,170 @@ def get_entregas_atividade(disciplina, turma, nome_atividade):
     return entregas
 
 def atribuir_nota_atividade_server(disciplina, turma, nome_atividade, ra, nota_float):
-    dados = carregar_dados()
+    dados = BANCO.dados
 
-    dados["turmas"][turma]["disciplinas"][disciplina]["atividades"][nome_atividade]["notas"][ra] = nota_float
+    BANCO.definir(["turmas", turma, "disciplinas", disciplina, "atividades", nome_atividade, "notas", ra], nota_float)
+    if ra in BANCO.indices.alunos_da_turma(turma):
+        calcular_nota_final(ra, disciplina, dados)
 
-    salvar_dados(dados)
+    BANCO.salvar()
     return {"success": True, "message": f"Nota {nota_float} salva para o aluno RA {ra}."}
 
-def calcular_nota_final(ra, disciplina, dados):
-    PESO_NP1 = 0.35
-    PESO_NP2 = 0.35
-    PESO_ATIVIDADES = 0.30
+def politica_da_disciplina(disciplina, turma):
+    return BANCO.dados["disciplinas"].get(f"{disciplina}-{turma}", {}).get("politica")
 
+def finais_nativas(np1, np2, medias):
+    try:
+        return CALCULADORA.finais(np1, np2, medias)
+    except Exception as e:
+        REGISTRO.erro("CTYPES", f"Falha na chamada C em tempo de execução. Usando Python. Erro: {e}")
+        return None
+
+def gravar_notas_finais(disciplina, turma, notas, usar_numpy=True):
+    """Grava ATIVIDADES_MEDIA e NOTA_FINAL dos alunos de `notas` pela
+    política da disciplina (ver `motor_notas.Avaliador`). Não chama `salvar()`."""
+    dados = BANCO.dados
+    nativo = finais_nativas if C_LIB_LOADED and C_FUNCTION is not None else None
+    medias, finais = avaliador(politica_da_disciplina(disciplina, turma))(notas, usar_numpy, nativo)
+
+    for ra, media, final in zip(notas.alunos, medias, finais):
+        if disciplina not in dados["alunos"][ra]["notas"]:
+            BANCO.definir(["alunos", ra, "notas", disciplina], {})
+        BANCO.definir(["alunos", ra, "notas", disciplina, "ATIVIDADES_MEDIA"], media)
+        BANCO.definir(["alunos", ra, "notas", disciplina, "NOTA_FINAL"], final)
+
+def calcular_nota_final(ra, disciplina, dados):
     aluno_turma = dados["alunos"][ra]["turma"]
 
     if disciplina not in dados["turmas"].get(aluno_turma, {}).get("disciplinas", {}):
         return
 
-    atividades_disc = dados["turmas"][aluno_turma]["disciplinas"][disciplina].get("atividades", {})
-    num_atividades_cadastradas = len(atividades_disc)
-    soma_notas_atividades = 0.0
+    # Uma linha só: NumPy não compensa.
+    gravar_notas_finais(disciplina, aluno_turma, NotasTurma.do_aluno(dados, aluno_turma, disciplina, ra), usar_numpy=False)
 
-    if num_atividades_cadastradas > 0:
-        for nome_ativ, info_ativ in atividades_disc.items():
-            nota = info_ativ.get("notas", {}).get(ra)
-            if nota is not None:
-                soma_notas_atividades += nota
+def calcular_notas_finais(disciplina, turma):
+    """Atualiza as notas finais da turma inteira de uma vez (ver
+    `motor_notas`), com o mesmo resultado de `calcular_nota_final` aluno por
+    aluno. Não chama `salvar()`."""
+    dados = BANCO.dados
+    if disciplina not in dados["turmas"][turma].get("disciplinas", {}):
+        return
+    alunos_turma = list(BANCO.indices.alunos_da_turma(turma))
+    gravar_notas_finais(disciplina, turma, NotasTurma.montar(dados, turma, disciplina, alunos_turma))
 
-        media_atividades = soma_notas_atividades / num_atividades_cadastradas
-    else:
-        media_atividades = 0.0
+def calcular_nota_final_turma_server(disciplina, turma):
+    dados = BANCO.dados
+    if turma not in dados["turmas"]:
+        raise KeyError(turma)
 
-    notas_aluno = dados["alunos"][ra]["notas"].get(disciplina, {})
-    np1 = notas_aluno.get("NP1", 0.0)
-    np2 = notas_aluno.get("NP2", 0.0)
+    REGISTRO.debug("NOTAS", f"Calculando notas finais de {disciplina} (turma {turma}, {len(BANCO.indices.alunos_da_turma(turma))} alunos).")
 
-    global C_FUNCTION  
-    global C_LIB_LOADED
+    calcular_notas_finais(disciplina, turma)
 
-    if C_LIB_LOADED and C_FUNCTION is not None:
-        try:
-            nota_final = float(C_FUNCTION(np1, np2, media_atividades))
-        except Exception as e:
-            print(f"[ERRO CTYPES] Falha na chamada C em tempo de execução. Usando Python. Erro: {e}")
-            nota_final = (np1 * PESO_NP1) + (np2 * PESO_NP2) + (media_atividades * PESO_ATIVIDADES)
-    else:
-        nota_final = (np1 * PESO_NP1) + (np2 * PESO_NP2) + (media_atividades * PESO_ATIVIDADES)
+    BANCO.salvar()
+    return {"success": True, "message": "Cálculo das notas finais concluído."}
 
-    if disciplina not in dados["alunos"][ra]["notas"]:
-        dados["alunos"][ra]["notas"][disciplina] = {}
 
-    dados["alunos"][ra]["notas"][disciplina]["ATIVIDADES_MEDIA"] = round(media_atividades, 2)
-    dados["alunos"][ra]["notas"][disciplina]["NOTA_FINAL"] = round(nota_final, 2)
+def pool_notas():
+    global POOL_NOTAS
+    if POOL_NOTAS is None:
+        # "spawn", como no modo multiprocesso: o servidor já tem threads
+        # rodando e um fork copiaria travas no meio do uso.
+        POOL_NOTAS = ProcessPoolExecutor(PROCESSOS_NOTAS, mp_context=multiprocessing.get_context("spawn"))
+    return POOL_NOTAS
+
+def fechar_pool_notas():
+    if POOL_NOTAS is not None:
+        POOL_NOTAS.shutdown()
+
+def recalcular_todas_notas_server():
+    """Recalcula as notas finais de todas as disciplinas de `dados["disciplinas"]`.
+
+    As colunas de notas de cada turma são montadas aqui e calculadas pelos
+    processos do pool, uma tarefa por turma (ver `motor_notas.avaliar_turma`).
+    Cada resultado é gravado assim que chega e tudo vai para o disco num
+    único `salvar()`. Roda com a trava global exclusiva.
+    """
+    dados = BANCO.dados
+    inicio = time.perf_counter()
+
+    disciplinas_por_turma = {}
+    for info in dados["disciplinas"].values():
+        turma, disciplina = info["turma"], info["nome_original"]
+        if disciplina in dados["turmas"].get(turma, {}).get("disciplinas", {}):
+            disciplinas_por_turma.setdefault(turma, []).append(disciplina)
+
+    tarefas = []
+    for turma, disciplinas in disciplinas_por_turma.items():
+        alunos_turma = list(BANCO.indices.alunos_da_turma(turma))
+        tarefas.append((turma, [(disciplina, politica_da_disciplina(disciplina, turma), NotasTurma.montar(dados, turma, disciplina, alunos_turma))
+                                for disciplina in disciplinas]))
+    montagem = time.perf_counter() - inicio
+
+    if PROCESSOS_NOTAS > 1 and len(tarefas) > 1:
+        concluidas = (futuro.result() for futuro in as_completed([pool_notas().submit(avaliar_turma, *tarefa) for tarefa in tarefas]))
+    else:
+        concluidas = (avaliar_turma(*tarefa) for tarefa in tarefas)
 
-    if aluno_turma in dados["turmas"] and ra in dados["turmas"][aluno_turma]["alunos"]:
-        if disciplina not in dados["turmas"][aluno_turma]["alunos"][ra]["notas"]:
-            dados["turmas"][aluno_turma]["alunos"][ra]["notas"][disciplina] = {}
+    tempos = {}
+    for feitas, (turma, resultados, segundos) in enumerate(concluidas, 1):
+        inicio_gravacao = time.perf_counter()
+        for disciplina, alunos_turma, medias, finais in resultados:
+            for ra, media, final in zip(alunos_turma, medias, finais):
+                if disciplina not in dados["alunos"][ra]["notas"]:
+                    BANCO.definir(["alunos", ra, "notas", disciplina], {})
+                BANCO.definir(["alunos", ra, "notas", disciplina, "ATIVIDADES_MEDIA"], media)
+                BANCO.definir(["alunos", ra, "notas", disciplina, "NOTA_FINAL"], final)
+        tempos[turma] = {
+            "disciplinas": len(resultados),
+            "alunos": len(BANCO.indices.alunos_da_turma(turma)),
+            "calculo_ms": round(segundos * 1000, 2),
+            "gravacao_ms": round((time.perf_counter() - inicio_gravacao) * 1000, 2),
+        }
+        REGISTRO.info("NOTAS", f"Recálculo geral: {feitas}/{len(tarefas)} turmas ({turma}: {len(resultados)} disciplinas em {segundos * 1000:.2f} ms).")
 
-        dados["turmas"][aluno_turma]["alunos"][ra]["notas"][disciplina]["ATIVIDADES_MEDIA"] = round(media_atividades, 2)
-        dados["turmas"][aluno_turma]["alunos"][ra]["notas"][disciplina]["NOTA_FINAL"] = round(nota_final, 2)
+    BANCO.salvar()
+    num_disciplinas = sum(len(disciplinas) for disciplinas in disciplinas_por_turma.values())
+    return {
+        "success": True,
+        "message": f"Notas finais recalculadas: {num_disciplinas} disciplinas em {len(tarefas)} turmas.",
+        "turmas": tempos,
+        "montagem_ms": round(montagem * 1000, 2),
+        "total_ms": round((time.perf_counter() - inicio) * 1000, 2),
+    }
 
-def calcular_nota_final_turma_server(disciplina, turma):
-    dados = carregar_dados()
-    alunos_turma = dados["turmas"][turma]["alunos"].keys()
+def get_politica_notas_server(disciplina, turma):
+    chave = f"{disciplina}-{turma}"
+    if chave not in BANCO.dados["disciplinas"]:
+        return {"success": False, "message": "Disciplina não encontrada nesta turma."}
+    return {"success": True, "politica": {**POLITICA_PADRAO, **(politica_da_disciplina(disciplina, turma) or {})}}
 
-    print(f"\n--- Calculando Notas Finais para {disciplina} (Turma {turma}) ---")
+def definir_politica_notas_server(disciplina, turma, politica):
+    chave = f"{disciplina}-{turma}"
+    if chave not in BANCO.dados["disciplinas"]:
+        return {"success": False, "message": "Disciplina não encontrada nesta turma."}
+    try:
+        politica = validar_politica(politica)
+    except ValueError as e:
+        return {"success": False, "message": str(e)}
 
-    for ra in alunos_turma:
-        calcular_nota_final(ra, disciplina, dados)
+    BANCO.definir(["disciplinas", chave, "politica"], politica)
+    calcular_notas_finais(disciplina, turma)
 
-    salvar_dados(dados)
-    return {"success": True, "message": "Cálculo das notas finais concluído."}
+    BANCO.salvar()
+    return {"success": True, "message": "Critérios de avaliação salvos e notas finais recalculadas."}
 
+def get_estatisticas_cache_server():
+    return {"success": True, "relatorios": BANCO.relatorios.estatisticas()}
 
 def ver_notas_faltas_turma_server(disciplina, turma):
-    dados = carregar_dados()
-    alunos = dados["turmas"][turma]["alunos"]
+    dados = BANCO.dados
+    if turma not in dados["turmas"]:
+        raise KeyError(turma)
 
     relatorio = []
-    for ra, info in alunos.items():
+    for ra in BANCO.indices.alunos_da_turma(turma):
+        info = dados["alunos"][ra]
         notas = info["notas"].get(disciplina, {})
         relatorio.append({
             "nome": info['nome'],
@@ -439,7 +574,7 @@ def ver_notas_faltas_turma_server(disciplina, turma):
     return relatorio
 
 def get_atividades_aluno_turma(ra):
-    dados = carregar_dados()
+    dados = BANCO.dados
     aluno = dados["alunos"].get(ra.upper())
     if not aluno:
         return {"success": False, "message": "Aluno não encontrado."}
@@ -450,18 +585,19 @@ def get_atividades_aluno_turma(ra):
     atividades_listadas = []
     for disc, info_disc in disciplinas.items():
         if info_disc.get("atividades"):
+            enviadas = BANCO.indices.atividades_enviadas(ra.upper(), disc)
             for nome_atividade, info in info_disc["atividades"].items():
                 atividades_listadas.append({
                     "disciplina": disc,
                     "nome": nome_atividade,
                     "link": info.get('link', 'Link Indisponível'),
-                    "enviada": nome_atividade in aluno["atividades_enviadas"]
+                    "enviada": nome_atividade in enviadas
                 })
 
     return {"success": True, "atividades": atividades_listadas, "turma": turma, "disciplinas_turma": list(disciplinas.keys())}
 
 def enviar_atividade_aluno_server(ra, disc_sel, nome_atividade, resposta_link):
-    dados = carregar_dados()
+    dados = BANCO.dados
     aluno = dados["alunos"].get(ra.upper())
     if not aluno:
         return {"success": False, "message": "Aluno não encontrado."}
@@ -474,33 +610,35 @@ def enviar_atividade_aluno_server(ra, disc_sel, nome_atividade, resposta_link):
     if nome_atividade not in dados["turmas"][turma]["disciplinas"][disc_sel]["atividades"]:
         return {"success": False, "message": "Atividade não encontrada na disciplina."}
 
-    dados["turmas"][turma]["disciplinas"][disc_sel]["atividades"][nome_atividade]["respostas"][ra] = resposta_link
-    dados["alunos"][ra]["atividades_enviadas"][nome_atividade] = {"disciplina": disc_sel, "resposta": resposta_link}
+    BANCO.definir(["turmas", turma, "disciplinas", disc_sel, "atividades", nome_atividade, "respostas", ra], resposta_link)
+    BANCO.definir(["alunos", ra, "atividades_enviadas", nome_atividade], {"disciplina": disc_sel, "resposta": resposta_link})
 
-    salvar_dados(dados)
+    BANCO.salvar()
     return {"success": True, "message": f"Atividade '{nome_atividade}' enviada com sucesso! O professor já pode verificar o link."}
     
 def registrar_aula_server(disciplina, turma, data, descricao):
-    dados = carregar_dados()
+    dados = BANCO.dados
     try:
         if turma not in dados["turmas"] or disciplina not in dados["turmas"][turma]["disciplinas"]:
             return {"success": False, "message": "Turma ou disciplina não encontrada."}
             
-        aulas_ref = dados["turmas"][turma]["disciplinas"][disciplina].setdefault("aulas", {})
+        aulas_ref = dados["turmas"][turma]["disciplinas"][disciplina].get("aulas", {})
         
         if data in aulas_ref:
             return {"success": False, "message": f"Já existe uma aula registrada para a data {data}."}
             
-        aulas_ref[data] = {"descricao": descricao}
+        if "aulas" not in dados["turmas"][turma]["disciplinas"][disciplina]:
+            BANCO.definir(["turmas", turma, "disciplinas", disciplina, "aulas"], {})
+        BANCO.definir(["turmas", turma, "disciplinas", disciplina, "aulas", data], {"descricao": descricao})
         
-        salvar_dados(dados)
+        BANCO.salvar()
         return {"success": True, "message": f"Aula de {disciplina} em {data} registrada com sucesso!"}
         
     except Exception as e:
         return {"success": False, "message": f"Erro ao registrar aula: {e}"}
 
 def listar_aulas_server(disciplina, turma):
-    dados = carregar_dados()
+    dados = BANCO.dados
     try:
         if turma not in dados["turmas"] or disciplina not in dados["turmas"][turma]["disciplinas"]:
             return {"success": False, "message": "Turma ou disciplina não encontrada."}
@@ -516,6 +654,54 @@ def listar_aulas_server(disciplina, turma):
     except Exception as e:
         return {"success": False, "message": f"Erro ao listar aulas: {e}"}
 
+def falhou(result):
+    return isinstance(result, dict) and ("error" in result or result.get("success") is False)
+
+def executar_acao(action, params):
+    """Roda o handler dentro da transação aberta por quem chamou; se ele
+    levantar uma exceção, o que já tinha alterado é desfeito."""
+    ponto = BANCO.ponto_transacao()
+    try:
+        return SERVER_ACTIONS[action](*params)
+    except TypeError as te:
+        BANCO.desfazer_transacao(ponto)
+        return {"error": f"Parâmetros inválidos para a ação '{action}': {te}"}
+    except Exception as e:
+        BANCO.desfazer_transacao(ponto)
+        return {"error": f"Erro ao executar ação '{action}': {e}"}
+
+def executar_lote(operacoes, tudo_ou_nada=False):
+    """Executa várias ações em ordem e grava tudo num único commit.
+
+    Com `tudo_ou_nada`, a primeira ação que falhar (exceção, "error" ou
+    "success": False) desfaz as anteriores e nada é gravado.
+    """
+    resultados = []
+    with BANCO.transacao():
+        for indice, item in enumerate(operacoes):
+            action = item.get("action") if isinstance(item, dict) else None
+            params = item.get("params", []) if isinstance(item, dict) else []
+
+            if action == "batch":
+                result = {"error": "Um lote não pode conter outro lote."}
+            elif action in SERVER_ACTIONS:
+                result = executar_acao(action, params)
+            else:
+                result = {"error": "Ação desconhecida", "action_received": action}
+            resultados.append(result)
+
+            if tudo_ou_nada and falhou(result):
+                BANCO.desfazer_transacao()
+                return {
+                    "success": False,
+                    "message": f"A operação {indice + 1} do lote falhou; nenhuma alteração foi gravada.",
+                    "indice_falha": indice,
+                    "resultados": resultados,
+                }
+
+    BANCO.salvar()
+    return resultados
+
 
 SERVER_ACTIONS = {
     "login_administrador": login_administrador_server,
@@ -537,81 +723,383 @@ SERVER_ACTIONS = {
     "atribuir_nota_atividade": atribuir_nota_atividade_server,
     "calcular_nota_final_turma": calcular_nota_final_turma_server,
     "ver_notas_faltas_turma": ver_notas_faltas_turma_server,
+    "get_politica_notas": get_politica_notas_server,
+    "definir_politica_notas": definir_politica_notas_server,
+    "recalcular_todas_notas": recalcular_todas_notas_server,
+    "get_estatisticas_cache": get_estatisticas_cache_server,
     "get_atividades_aluno_turma": get_atividades_aluno_turma,
     "enviar_atividade_aluno": enviar_atividade_aluno_server,
     "registrar_aula": registrar_aula_server, 
     "listar_aulas": listar_aulas_server,
+    "batch": executar_lote,
 }
 
-def handle_client(conn, addr):
-    print(f"[CONEXÃO] Conectado a {addr}")
+def turma_do_aluno(ra):
+    aluno = BANCO.dados["alunos"].get(ra.upper())
+    return aluno["turma"] if aluno else None
+
+def parametro(posicao):
+    return lambda params: params[posicao]
+
+def turma_do_ra(params):
+    return turma_do_aluno(params[0])
+
+# Trava de cada ação: ("leitura" | "escrita", função que extrai a turma dos
+# parâmetros, ou None para a trava global). Ações fora da tabela não tocam
+# nos dados da escola (a chamada à IA pode levar segundos e não deve
+# bloquear os demais clientes).
+ESCOPO_ACOES = {
+    "login_professor": ("leitura", None),
+    "get_cadastro_info": ("leitura", None),
+    "login_aluno": ("leitura", turma_do_ra),
+    "get_aluno_data": ("leitura", turma_do_ra),
+    "get_atividades_aluno_turma": ("leitura", turma_do_ra),
+    "get_lista_alunos_turma": ("leitura", parametro(0)),
+    "get_atividades_disciplina": ("leitura", parametro(1)),
+    "get_entregas_atividade": ("leitura", parametro(1)),
+    "ver_notas_faltas_turma": ("leitura", parametro(1)),
+    "listar_aulas": ("leitura", parametro(1)),
+    "get_politica_notas": ("leitura", parametro(1)),
+    "cadastrar_turma": ("escrita", None),
+    "cadastrar_professor": ("escrita", None),
+    "cadastrar_disciplina": ("escrita", None),
+    "cadastrar_aluno": ("escrita", None),
+    "enviar_atividade_aluno": ("escrita", turma_do_ra),
+    "lista_chamada": ("escrita", parametro(0)),
+    "enviar_atividade": ("escrita", parametro(1)),
+    "lancar_np_grades": ("escrita", parametro(1)),
+    "atribuir_nota_atividade": ("escrita", parametro(1)),
+    "calcular_nota_final_turma": ("escrita", parametro(1)),
+    "registrar_aula": ("escrita", parametro(1)),
+    "definir_politica_notas": ("escrita", parametro(1)),
+    # Todas as turmas de uma vez.
+    "recalcular_todas_notas": ("escrita", None),
+    # Um lote pode tocar várias turmas e os cadastros globais.
+    "batch": ("escrita", None),
+}
 
-    while True:
-        try:
-            tamanho_bytes = conn.recv(4)
-            if not tamanho_bytes:
-                break
+# Entidade cuja versão cada ação devolve (leituras, com "com_versao") ou
+# confere (alterações, com "versao_esperada"). Cada alteração usa a mesma
+# entidade da leitura que a precede no cliente.
+ENTIDADE_ACOES = {
+    "get_lista_alunos_turma": lambda p: chave_notas(p[0], p[1]) if len(p) > 1 else chave_chamada(p[0]),
+    "get_atividades_aluno_turma": lambda p: chave_turma(turma_do_aluno(p[0])),
+    "get_atividades_disciplina": lambda p: chave_disciplina(p[1], p[0]),
+    "get_entregas_atividade": lambda p: chave_atividade(p[1], p[0], p[2]),
+    "ver_notas_faltas_turma": lambda p: chave_disciplina(p[1], p[0]),
+    "listar_aulas": lambda p: chave_disciplina(p[1], p[0]),
+    "lista_chamada": lambda p: chave_chamada(p[0]),
+    "lancar_np_grades": lambda p: chave_notas(p[1], p[0]),
+    "enviar_atividade_aluno": lambda p: chave_turma(turma_do_aluno(p[0])),
+    "enviar_atividade": lambda p: chave_disciplina(p[1], p[0]),
+    "registrar_aula": lambda p: chave_disciplina(p[1], p[0]),
+    "calcular_nota_final_turma": lambda p: chave_disciplina(p[1], p[0]),
+    "atribuir_nota_atividade": lambda p: chave_atividade(p[1], p[0], p[2]),
+}
 
-            tamanho = int.from_bytes(tamanho_bytes, 'big')
+def entidade_da_acao(action, params):
+    try:
+        return ENTIDADE_ACOES[action](params)
+    except (KeyError, IndexError, TypeError, AttributeError, ValueError):
+        return None
 
-            data = b''
-            bytes_recv = 0
-            while bytes_recv < tamanho:
-                chunk = conn.recv(min(tamanho - bytes_recv, 4096))
-                if not chunk:
-                    break
-                data += chunk
-                bytes_recv += len(chunk)
+def resposta_conflito(versao_atual):
+    return {
+        "success": False,
+        "conflito": True,
+        "versao_atual": versao_atual,
+        "message": "Os dados foram alterados por outro usuário desde a última consulta. Atualize e tente novamente."
+    }
 
-            if not data:
-                break
+def acao_de_escrita(action):
+    escopo = ESCOPO_ACOES.get(action)
+    return escopo is not None and escopo[0] == "escrita"
+
+def trava_da_acao(action, params):
+    escopo = ESCOPO_ACOES.get(action)
+    if escopo is None:
+        return nullcontext()
+
+    modo, extrair_turma = escopo
+    turma = None
+    if extrair_turma is not None:
+        try:
+            turma = extrair_turma(params)
+        except (IndexError, TypeError, AttributeError, KeyError, ValueError):
+            # Parâmetros inválidos: o handler vai recusar, mas sem saber a
+            # turma só a trava global exclusiva é segura.
+            return TRAVAS.escrita()
+        if turma is None:
+            return TRAVAS.leitura()
+
+    if modo == "leitura":
+        return TRAVAS.leitura(turma)
+    return TRAVAS.escrita(turma)
+
+def chave_cache_relatorio(action, params, codec):
+    # Respostas de ver_notas_faltas_turma ficam prontas em BANCO.relatorios.
+    if action != "ver_notas_faltas_turma" or len(params) != 2 or not all(isinstance(p, str) for p in params):
+        return None
+    disciplina, turma = params
+    return (turma, disciplina, codec.nome)
+
+def processar_requisicao(action, params, versao_esperada=None, com_versao=False, codec=JSON):
+    if REPLICA is not None and acao_de_escrita(action):
+        # Modo multiprocesso: a alteração roda na loja central, que também
+        # confere a versão esperada.
+        return REPLICA.encaminhar(action, params, versao_esperada, com_versao, codec)
+
+    entidade = entidade_da_acao(action, params) if versao_esperada is not None or com_versao else None
+    chave_relatorio = None if entidade is not None else chave_cache_relatorio(action, params, codec)
+
+    # Versão desatualizada: responde na hora, sem esperar pelas travas. Se
+    # bater, confere de novo já com a trava, pois outra alteração pode ter
+    # entrado no meio.
+    if entidade is not None and versao_esperada is not None and BANCO.versoes.versao(entidade) != versao_esperada:
+        result = resposta_conflito(BANCO.versoes.versao(entidade))
+        if com_versao:
+            result = {"resultado": result, "versao": result["versao_atual"]}
+        return codec.codificar(result)
+
+    # Alterações rodam numa transação: um handler que falha no meio (um RA
+    # de outra turma no fim da chamada) não deixa metade aplicada.
+    with trava_da_acao(action, params), (BANCO.transacao() if acao_de_escrita(action) else nullcontext()):
+        if chave_relatorio is not None:
+            response_data = BANCO.relatorios.obter(chave_relatorio)
+            if response_data is not None:
+                return response_data
+
+        if entidade is not None and versao_esperada is not None and BANCO.versoes.versao(entidade) != versao_esperada:
+            result = resposta_conflito(BANCO.versoes.versao(entidade))
+        elif action in SERVER_ACTIONS and acao_de_escrita(action):
+            result = executar_acao(action, params)
+        elif action in SERVER_ACTIONS:
+            try:
+                result = SERVER_ACTIONS[action](*params)
+            except TypeError as te:
+                result = {"error": f"Parâmetros inválidos para a ação '{action}': {te}"}
+            except Exception as e:
+                result = {"error": f"Erro ao executar ação '{action}': {e}"}
+        else:
+            result = {"error": "Ação desconhecida", "action_received": action}
 
-            request = json.loads(data.decode('utf-8'))
-            action = request.get('action')
-            params = request.get('params', [])
+        if com_versao:
+            result = {"resultado": result, "versao": BANCO.versoes.versao(entidade) if entidade is not None else None}
 
-            print(f"[REQUISIÇÃO] {addr}: {action} com {len(params)} parâmetros.")
+        response_data = codec.codificar(result)
+        # Só relatórios de verdade: erros (turma inexistente) não ficam.
+        if chave_relatorio is not None and isinstance(result, list):
+            BANCO.relatorios.guardar(chave_relatorio, response_data)
 
-            if action in SERVER_ACTIONS:
+    try:
+        BANCO.aguardar_persistencia()
+    except RuntimeError as e:
+        response_data = codec.codificar({"error": str(e)})
+
+    return response_data
+
+def executar_requisicao(request, addr, codec=JSON, bytes_entrada=0):
+    action = request.get('action')
+    params = request.get('params', [])
+
+    inicio = time.perf_counter()
+    response_data = processar_requisicao(action, params, request.get('versao_esperada'), request.get('com_versao', False), codec)
+    REGISTRO.requisicao(action, time.perf_counter() - inicio, bytes_entrada, len(response_data), addr)
+    return response_data
+
+def resposta_ocupado(tentar_novamente_ms, reconectar=False, codec=JSON):
+    resposta = {
+        "error": f"Servidor ocupado, tente novamente em {tentar_novamente_ms} ms.",
+        "ocupado": True,
+        "tentar_novamente_ms": tentar_novamente_ms,
+    }
+    if reconectar:
+        resposta["reconectar"] = True
+    return codec.codificar(resposta)
+
+def resposta_erro(e, codec=JSON):
+    return codec.codificar({"error": str(e), "traceback": traceback.format_exc()})
+
+def handle_client(conn, addr):
+    global CONEXOES_ATIVAS
+    try:
+        atender_conexao(conn, addr)
+    finally:
+        with LOCK_CONEXOES:
+            CONEXOES_ATIVAS -= 1
+
+def atender_conexao(conn, addr):
+    REGISTRO.debug("CONEXÃO", f"Conectado a {addr}")
+    # Só a thread de escrita da conexão envia: as respostas de requisições
+    # com "id" ficam prontas fora de ordem nos workers do pool, que apenas as
+    # põem na fila. Um cliente que não lê trava a escrita dele, nunca um
+    # worker; com MAX_PENDENTES_CONEXAO respostas esperando, esta thread
+    # para de ler novas requisições até ele voltar a ler.
+    fila_envio = queue.SimpleQueue()
+    pendentes = threading.Semaphore(MAX_PENDENTES_CONEXAO)
+    # JSON sem compressão até o cliente pedir outra coisa com
+    # "negociar_conexao".
+    opcoes = OpcoesConexao()
+
+    def escrever():
+        falhou = False
+        while True:
+            item = fila_envio.get()
+            if item is None:
+                break
+            quadro, opcoes_envio, liberar = item
+            if not falhou:
                 try:
-                    result = SERVER_ACTIONS[action](*params)
-                except TypeError as te:
-                    result = {"error": f"Parâmetros inválidos para a ação '{action}': {te}"}
-                except Exception as e:
-                    result = {"error": f"Erro ao executar ação '{action}': {e}"}
-            else:
-                result = {"error": "Ação desconhecida", "action_received": action}
+                    enviar_quadro(conn, quadro, opcoes_envio)
+                except OSError:
+                    # Cliente foi embora: o resto da fila é descartado.
+                    falhou = True
+            if liberar:
+                pendentes.release()
+        conn.close()
+
+    def responder(id_requisicao, response_data, codec, liberar=False):
+        # As opções valem as de agora: a resposta da negociação sai com as antigas.
+        fila_envio.put((marcar_resposta(id_requisicao, response_data, codec), opcoes, liberar))
+
+    def responder_quando_pronto(id_requisicao, futuro, codec):
+        try:
+            response_data = futuro.result()
+        except Exception as e:
+            response_data = resposta_erro(e, codec)
+        responder(id_requisicao, response_data, codec, liberar=True)
 
-            response_data = json.dumps(result, ensure_ascii=False).encode('utf-8')
-            response_size = len(response_data).to_bytes(4, 'big')
+    escritor = threading.Thread(target=escrever, daemon=True)
+    escritor.start()
+
+    while True:
+        try:
+            data = receber_quadro(conn, opcoes)
+            if not data:
+                break
 
-            conn.sendall(response_size + response_data)
+            codec = opcoes.codec
+            request = codec.decodificar(data)
+            id_requisicao = request.get('id')
+
+            if request.get('action') == ACAO_NEGOCIACAO:
+                # A resposta sai em JSON, com as opções antigas; as novas
+                # valem a partir da próxima mensagem.
+                novas = OpcoesConexao()
+                resposta = novas.negociar((request.get('params') or [None])[0])
+                responder(id_requisicao, JSON.codificar(resposta), JSON)
+                opcoes = novas
+                REGISTRO.debug("NEGOCIAÇÃO", f"{addr}: codec {opcoes.codec.nome}, compressão {opcoes.compressao or 'desligada'}.")
+                continue
+
+            pendentes.acquire()
+            futuro = POOL.submeter(executar_requisicao, request, addr, codec, len(data))
+            if futuro is None:
+                pendentes.release()
+                REGISTRO.aviso("OCUPADO", f"{addr}: fila cheia, '{request.get('action')}' recusada.")
+                responder(id_requisicao, resposta_ocupado(POOL.tentar_novamente_ms(), codec=codec), codec)
+                continue
+
+            if id_requisicao is None:
+                responder(None, futuro.result(), codec, liberar=True)
+            else:
+                futuro.add_done_callback(lambda f, i=id_requisicao, c=codec: responder_quando_pronto(i, f, c))
 
         except ConnectionResetError:
-            print(f"[DESCONEXÃO] Cliente {addr} desconectou abruptamente.")
+            REGISTRO.debug("DESCONEXÃO", f"Cliente {addr} desconectou abruptamente.")
+            break
+        except QuadroRecusado as e:
+            REGISTRO.aviso("RECUSADO", f"{addr}: {e}")
             break
-        except json.JSONDecodeError:
-            print(f"[ERRO] Dados JSON inválidos recebidos de {addr}")
+        except (json.JSONDecodeError, ErroDecodificacao):
+            REGISTRO.aviso("ERRO", f"Dados inválidos recebidos de {addr}")
         except Exception as e:
-            print(f"[ERRO DE SERVIDOR] Ocorreu um erro: {e}")
-            traceback.print_exc()
-            try:
-                error_msg = json.dumps({"error": str(e), "traceback": traceback.format_exc()}, ensure_ascii=False).encode('utf-8')
-                error_size = len(error_msg).to_bytes(4, 'big')
-                conn.sendall(error_size + error_msg)
-            except:
-                pass
+            REGISTRO.erro("ERRO DE SERVIDOR", f"Ocorreu um erro: {e}\n{traceback.format_exc()}")
+            responder(None, resposta_erro(e, opcoes.codec), opcoes.codec)
             break
 
-    print(f"[FECHAMENTO] Conexão com {addr} encerrada.")
-    conn.close()
+    REGISTRO.debug("FECHAMENTO", f"Conexão com {addr} encerrada.")
+    # O escritor envia o que já está na fila e fecha o socket.
+    fila_envio.put(None)
 
 
 def start_server():
+    if NUM_PROCESSOS > 1:
+        iniciar_processos()
+        return
+    iniciar_banco()
+    servir()
+
+def iniciar_processos():
+    if not hasattr(socket, "SO_REUSEPORT") or not hasattr(socket, "AF_UNIX"):
+        raise ValueError("O modo multiprocesso precisa de SO_REUSEPORT e sockets Unix.")
+
+    contexto = multiprocessing.get_context("spawn")
+    parar_trabalhadores = contexto.Event()
+    parar_loja = contexto.Event()
+    loja_pronta = contexto.Event()
+
+    loja = contexto.Process(target=rodar_loja, args=(SOCKET_LOJA, parar_loja, loja_pronta))
+    loja.start()
+    loja_pronta.wait()
+    trabalhadores = [contexto.Process(target=rodar_trabalhador, args=(HOST, PORT, SOCKET_LOJA, parar_trabalhadores))
+                     for _ in range(NUM_PROCESSOS)]
+    for processo in trabalhadores:
+        processo.start()
+    print(f"*** Modo multiprocesso: {NUM_PROCESSOS} processos de trabalho em {HOST}:{PORT}, loja central em '{SOCKET_LOJA}' ***")
+
+    while SERVER_RUNNING:
+        time.sleep(0.5)
+
+    # Primeiro os trabalhadores, que ainda podem encaminhar alterações.
+    parar_trabalhadores.set()
+    for processo in trabalhadores:
+        processo.join()
+    parar_loja.set()
+    loja.join()
+    REGISTRO.fechar()
+
+def rodar_loja(caminho, parar, pronta):
+    iniciar_banco()
+    BANCO.ativar_replicacao()
+    LojaCentral(caminho, BANCO, TRAVAS, processar_requisicao, lambda: not parar.is_set()).rodar(pronta)
+    fechar_pool_notas()
+    BANCO.fechar()
+    REGISTRO.fechar()
+
+def rodar_trabalhador(host, port, caminho_loja, parar):
+    global HOST, PORT, BANCO, REPLICA
+    HOST, PORT = host, port
+    REPLICA = Replica(caminho_loja, TRAVAS)
+    BANCO = REPLICA.banco
+    BANCO.relatorios.limite_bytes = CACHE_RELATORIOS_BYTES
+    threading.Thread(target=aguardar_parada, args=(parar,), daemon=True).start()
+    servir(reuse_port=True)
+
+def aguardar_parada(parar):
     global SERVER_RUNNING
+    parar.wait()
+    SERVER_RUNNING = False
+
+def servir(reuse_port=False):
+    global POOL, CONEXOES_ATIVAS
+    POOL = PoolTrabalho(MAX_WORKERS, MAX_FILA)
+
+    if MOTOR_SERVIDOR == "asyncio":
+        ServidorAsync(HOST, PORT, executar_requisicao, lambda: SERVER_RUNNING, POOL, MAX_CONEXOES, resposta_ocupado, REGISTRO, reuse_port).rodar()
+        POOL.fechar()
+        fechar_pool_notas()
+        BANCO.fechar()
+        REGISTRO.fechar()
+        return
+    elif MOTOR_SERVIDOR != "threads":
+        raise ValueError(f"Motor de servidor desconhecido: '{MOTOR_SERVIDOR}'")
+
     server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
 
     server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
 
     server.bind((HOST, PORT))
     server.listen()
@@ -624,19 +1112,35 @@ def start_server():
             conn, addr = server.accept()
             server.settimeout(None)
 
+            with LOCK_CONEXOES:
+                aceita = CONEXOES_ATIVAS < MAX_CONEXOES
+                if aceita:
+                    CONEXOES_ATIVAS += 1
+            if not aceita:
+                REGISTRO.aviso("RECUSADA", f"{addr}: limite de {MAX_CONEXOES} conexões atingido.")
+                try:
+                    enviar_quadro(conn, resposta_ocupado(POOL.tentar_novamente_ms(), True))
+                finally:
+                    conn.close()
+                continue
+
             thread = threading.Thread(target=handle_client, args=(conn, addr))
             thread.start()
-            print(f"[ATIVO] Total de conexões ativas: {threading.active_count() - 1}")
+            REGISTRO.debug("ATIVO", f"Total de conexões ativas: {CONEXOES_ATIVAS}")
 
         except socket.timeout:
             continue
         except Exception as e:
             if SERVER_RUNNING:
-                print(f"[ERRO DE ACEITE] Ocorreu um erro: {e}")
+                REGISTRO.erro("ERRO DE ACEITE", f"Ocorreu um erro: {e}")
             break
 
     print("*** Encerrando o servidor de sockets... ***")
     server.close()
+    POOL.fechar()
+    fechar_pool_notas()
+    BANCO.fechar()
+    REGISTRO.fechar()
 
 
 if __name__ == "__main__":
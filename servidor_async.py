@@ -0,0 +1,153 @@
+import json
+import asyncio
+import traceback
+
+from codificacao import JSON, ErroDecodificacao
+from protocolo import ACAO_NEGOCIACAO, TAMANHO_CABECALHO, OpcoesConexao, QuadroRecusado, abrir_conteudo, ler_cabecalho, marcar_resposta, montar_quadro
+
+
+class ServidorAsync:
+    """Motor de rede com asyncio: uma corrotina por cliente, sem thread própria.
+
+    Fala o mesmo protocolo do `handle_client` (4 bytes de tamanho, big-endian,
+    seguidos do JSON). Conexões ociosas custam só a corrotina parada em
+    `readexactly`; cada requisição é executada por
+    `executar(request, addr, codec, bytes_entrada)`
+    no `PoolTrabalho`, pois os handlers bloqueiam (travas, espera do commit).
+    Requisições com "id" não esperam umas pelas outras: cada resposta é
+    escrita, marcada com o id, assim que fica pronta.
+    Com a fila do pool cheia, ou acima de `max_conexoes`, o cliente recebe na
+    hora a resposta de `resposta_ocupado(ms, reconectar, codec)`.
+    Conexões, recusas e erros vão para o `registro` (ver registro.py).
+    A negociação da conexão (codec, compressão) é respondida aqui mesmo, sem
+    o pool.
+    """
+
+    def __init__(self, host, port, executar, ativo, pool, max_conexoes, resposta_ocupado, registro, reuse_port=False):
+        self.host = host
+        self.port = port
+        self.executar = executar
+        self.ativo = ativo
+        self.pool = pool
+        self.max_conexoes = max_conexoes
+        self.resposta_ocupado = resposta_ocupado
+        self.registro = registro
+        self.reuse_port = reuse_port
+        self._clientes = {}
+        self._opcoes = {}
+
+    def rodar(self):
+        asyncio.run(self._principal())
+
+    async def _principal(self):
+        servidor = await asyncio.start_server(self._atender, self.host, self.port, reuse_address=True,
+                                              reuse_port=self.reuse_port or None)
+        print(f"*** Servidor Educacional (asyncio) Rodando em {self.host}:{self.port} ***")
+        print(">>> Para encerrar o servidor, pressione ENTER na linha de comando e digite 'q' ou 'quit'.")
+
+        async with servidor:
+            while self.ativo():
+                await asyncio.sleep(0.5)
+
+            print("*** Encerrando o servidor asyncio... ***")
+            servidor.close()
+            # Clientes ociosos seguram o fechamento do servidor; são
+            # desconectados aqui.
+            tarefas = list(self._clientes.values())
+            for writer in list(self._clientes):
+                writer.close()
+            await asyncio.gather(*tarefas, return_exceptions=True)
+
+    async def _atender(self, reader, writer):
+        addr = writer.get_extra_info("peername")
+        if len(self._clientes) >= self.max_conexoes:
+            self.registro.aviso("RECUSADA", f"{addr}: limite de {self.max_conexoes} conexões atingido.")
+            writer.write(montar_quadro(self.resposta_ocupado(self.pool.tentar_novamente_ms(), True)))
+            writer.close()
+            return
+
+        self._clientes[writer] = asyncio.current_task()
+        self.registro.debug("CONEXÃO", f"Conectado a {addr} (conexões ativas: {len(self._clientes)})")
+        pendentes = set()
+        self._opcoes[writer] = OpcoesConexao()
+
+        try:
+            while True:
+                try:
+                    tamanho, comprimido = ler_cabecalho(await reader.readexactly(TAMANHO_CABECALHO))
+                    data = abrir_conteudo(await reader.readexactly(tamanho), comprimido, self._opcoes[writer])
+                except asyncio.IncompleteReadError:
+                    break
+                except QuadroRecusado as e:
+                    self.registro.aviso("RECUSADO", f"{addr}: {e}")
+                    break
+                if not data:
+                    break
+
+                codec = self._opcoes[writer].codec
+                try:
+                    request = codec.decodificar(data)
+                except (json.JSONDecodeError, ErroDecodificacao):
+                    self.registro.aviso("ERRO", f"Dados inválidos recebidos de {addr}")
+                    continue
+                id_requisicao = request.get('id')
+
+                if request.get('action') == ACAO_NEGOCIACAO:
+                    novas = OpcoesConexao()
+                    resposta = novas.negociar((request.get('params') or [None])[0])
+                    self._escrever(writer, marcar_resposta(id_requisicao, JSON.codificar(resposta)))
+                    await writer.drain()
+                    self._opcoes[writer] = novas
+                    self.registro.debug("NEGOCIAÇÃO", f"{addr}: codec {novas.codec.nome}, compressão {novas.compressao or 'desligada'}.")
+                    continue
+
+                futuro = self.pool.submeter(self.executar, request, addr, codec, len(data))
+                if futuro is None:
+                    self.registro.aviso("OCUPADO", f"{addr}: fila cheia, '{request.get('action')}' recusada.")
+                    self._escrever(writer, marcar_resposta(id_requisicao, self.resposta_ocupado(self.pool.tentar_novamente_ms(), False, codec), codec))
+                    await writer.drain()
+                    continue
+
+                if id_requisicao is None:
+                    self._escrever(writer, await asyncio.wrap_future(futuro))
+                    await writer.drain()
+                else:
+                    tarefa = asyncio.create_task(self._responder_quando_pronto(writer, id_requisicao, futuro, codec))
+                    pendentes.add(tarefa)
+                    tarefa.add_done_callback(pendentes.discard)
+
+        except ConnectionResetError:
+            self.registro.debug("DESCONEXÃO", f"Cliente {addr} desconectou abruptamente.")
+        except Exception as e:
+            self.registro.erro("ERRO DE SERVIDOR", f"Ocorreu um erro: {e}\n{traceback.format_exc()}")
+            try:
+                codec = self._opcoes[writer].codec
+                self._escrever(writer, _resposta_erro(e, codec))
+                await writer.drain()
+            except Exception:
+                pass
+        finally:
+            if pendentes:
+                await asyncio.gather(*pendentes, return_exceptions=True)
+            self._clientes.pop(writer, None)
+            self._opcoes.pop(writer, None)
+            self.registro.debug("FECHAMENTO", f"Conexão com {addr} encerrada.")
+            writer.close()
+
+    async def _responder_quando_pronto(self, writer, id_requisicao, futuro, codec):
+        try:
+            response_data = await asyncio.wrap_future(futuro)
+        except Exception as e:
+            response_data = _resposta_erro(e, codec)
+        try:
+            self._escrever(writer, marcar_resposta(id_requisicao, response_data, codec))
+            await writer.drain()
+        except OSError:
+            pass
+
+    def _escrever(self, writer, conteudo):
+        writer.write(montar_quadro(conteudo, self._opcoes.get(writer)))
+
+
+def _resposta_erro(e, codec=JSON):
+    return codec.codificar({"error": str(e), "traceback": traceback.format_exc()})
@@ -0,0 +1,195 @@
+import os
+import sys
+import json
+import mmap
+import struct
+import threading
+from collections.abc import MutableMapping
+
+# Layout do arquivo:
+#   MAGIC | u64 posição do índice | registros | u32 tamanho do índice | índice
+# Cada registro é "u32 tamanho + JSON compacto". O índice (JSON) guarda
+# [offset, tamanho] do registro geral (professores e disciplinas), de cada
+# turma e de cada aluno, na ordem original. A entrada de um aluno leva ainda
+# a turma dele ([offset, tamanho, turma]), para que o índice turma → alunos
+# seja montado sem decodificar os registros.
+MAGIC = b"PIMSNAP1"
+CABECALHO = struct.Struct("<8sQ")
+TAMANHO = struct.Struct("<I")
+
+
+def _json_compacto(valor):
+    return json.dumps(valor, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class SnapshotBinario:
+    """Arquivo de snapshot mapeado em memória; decodifica um registro por vez."""
+
+    def __init__(self, caminho):
+        self.caminho = caminho
+        self._arquivo = open(caminho, "rb")
+        self._mapa = mmap.mmap(self._arquivo.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, pos_indice = CABECALHO.unpack_from(self._mapa, 0)
+        if magic != MAGIC:
+            self.fechar()
+            raise ValueError(f"'{caminho}' não é um snapshot binário válido.")
+
+        (tamanho_indice,) = TAMANHO.unpack_from(self._mapa, pos_indice)
+        inicio = pos_indice + TAMANHO.size
+        self.indice = json.loads(self._mapa[inicio:inicio + tamanho_indice].decode("utf-8"))
+
+    def bruto(self, posicao):
+        offset, tamanho = posicao[0], posicao[1]
+        return self._mapa[offset:offset + tamanho]
+
+    def ler(self, posicao):
+        return json.loads(self.bruto(posicao).decode("utf-8"))
+
+    def montar_dados(self, ao_ler_turma=None):
+        geral = self.ler(self.indice["geral"])
+        return {
+            "alunos": AlunosMapeados(self, self.indice["alunos"]),
+            "professores": geral["professores"],
+            "disciplinas": geral["disciplinas"],
+            "turmas": RegistrosMapeados(self, self.indice["turmas"], ao_ler_turma),
+        }
+
+    def fechar(self):
+        self._mapa.close()
+        self._arquivo.close()
+
+
+class RegistrosMapeados(MutableMapping):
+    """Mapeamento cujos valores ficam no snapshot até o primeiro acesso.
+
+    Depois de decodificado (ou atribuído), o valor passa a viver em `_cache`
+    e é ele que vale dali em diante. Quem lê do snapshot segura `trava`, que
+    a compactação também segura enquanto troca o snapshot (`reanexar()`):
+    um leitor nunca fica com um mapeamento já fechado.
+    """
+
+    def __init__(self, snapshot, posicoes, ao_ler=None):
+        self._snapshot = snapshot
+        self._posicoes = posicoes
+        self._chaves = dict.fromkeys(posicoes)
+        self._cache = {}
+        self._ao_ler = ao_ler
+        self.trava = threading.Lock()
+
+    def __getitem__(self, chave):
+        valor = self._cache.get(chave)
+        if valor is not None:
+            return valor
+        if chave not in self._posicoes:
+            raise KeyError(chave)
+        with self.trava:
+            valor = self._snapshot.ler(self._posicoes[chave])
+        if self._ao_ler is not None:
+            valor = self._ao_ler(valor)
+        return self._cache.setdefault(chave, valor)
+
+    def __setitem__(self, chave, valor):
+        self._cache[chave] = valor
+        self._chaves[chave] = None
+
+    def __delitem__(self, chave):
+        del self._chaves[chave]
+        self._cache.pop(chave, None)
+        self._posicoes.pop(chave, None)
+
+    def __contains__(self, chave):
+        return chave in self._chaves
+
+    def __iter__(self):
+        return iter(list(self._chaves))
+
+    def __len__(self):
+        return len(self._chaves)
+
+    def bruto(self, chave):
+        if chave in self._cache:
+            return _json_compacto(self._cache[chave])
+        with self.trava:
+            return self._snapshot.bruto(self._posicoes[chave])
+
+    def reanexar(self, snapshot, posicoes):
+        # Chamado com `trava` já adquirida.
+        self._snapshot = snapshot
+        self._posicoes = {chave: posicoes[chave] for chave in self._chaves if chave not in self._cache}
+
+
+class AlunosMapeados(RegistrosMapeados):
+    def turma_de(self, ra):
+        if ra in self._cache:
+            return self._cache[ra]["turma"]
+        posicao = self._posicoes[ra]
+        if len(posicao) > 2:
+            return posicao[2]
+        # Snapshot gravado antes de o índice guardar a turma.
+        return self[ra]["turma"]
+
+
+def codificar_snapshot(dados):
+    partes = []
+    tamanho_atual = CABECALHO.size
+    indice = {"turmas": {}, "alunos": {}}
+
+    def registro(bruto):
+        nonlocal tamanho_atual
+        partes.append(TAMANHO.pack(len(bruto)))
+        partes.append(bruto)
+        offset = tamanho_atual + TAMANHO.size
+        tamanho_atual = offset + len(bruto)
+        return [offset, len(bruto)]
+
+    indice["geral"] = registro(_json_compacto({"professores": dados["professores"], "disciplinas": dados["disciplinas"]}))
+    for secao in ("turmas", "alunos"):
+        mapa = dados[secao]
+        for chave in mapa:
+            if isinstance(mapa, RegistrosMapeados):
+                bruto = mapa.bruto(chave)
+            else:
+                bruto = _json_compacto(mapa[chave])
+            indice[secao][chave] = registro(bruto)
+            if secao == "alunos":
+                turma = mapa.turma_de(chave) if isinstance(mapa, AlunosMapeados) else mapa[chave]["turma"]
+                indice[secao][chave].append(turma)
+
+    indice_bruto = _json_compacto(indice)
+    return b"".join([CABECALHO.pack(MAGIC, tamanho_atual), *partes, TAMANHO.pack(len(indice_bruto)), indice_bruto])
+
+
+def materializar(dados):
+    return {secao: {chave: valor for chave, valor in dados[secao].items()} for secao in dados}
+
+
+def json_para_binario(origem, destino):
+    with open(origem, "r", encoding="utf-8") as arquivo:
+        dados = json.load(arquivo)
+    with open(destino, "wb") as arquivo:
+        arquivo.write(codificar_snapshot(dados))
+
+
+def binario_para_json(origem, destino):
+    snapshot = SnapshotBinario(origem)
+    try:
+        dados = materializar(snapshot.montar_dados())
+    finally:
+        snapshot.fechar()
+    with open(destino, "w", encoding="utf-8") as arquivo:
+        json.dump(dados, arquivo, indent=4, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 4 or sys.argv[1] not in ("para-binario", "para-json"):
+        print("Uso: python snapshot_binario.py para-binario dados.json dados.bin")
+        print("     python snapshot_binario.py para-json dados.bin dados.json")
+        sys.exit(1)
+
+    comando, origem, destino = sys.argv[1:]
+    if comando == "para-binario":
+        json_para_binario(origem, destino)
+    else:
+        binario_para_json(origem, destino)
+    print(f"'{origem}' convertido para '{destino}' ({os.path.getsize(destino)} bytes).")
@@ -0,0 +1,153 @@
+import os
+import sys
+import time
+import tempfile
+import threading
+from contextlib import contextmanager
+
+
+class TravaLeituraEscrita:
+    """Vários leitores ao mesmo tempo ou um único escritor.
+
+    Um escritor esperando bloqueia a entrada de novos leitores, para que um
+    fluxo contínuo de consultas não impeça as alterações de andarem.
+    """
+
+    def __init__(self):
+        self._condicao = threading.Condition()
+        self._leitores = 0
+        self._escrevendo = False
+        self._escritores_esperando = 0
+
+    @contextmanager
+    def leitura(self):
+        with self._condicao:
+            while self._escrevendo or self._escritores_esperando:
+                self._condicao.wait()
+            self._leitores += 1
+        try:
+            yield
+        finally:
+            with self._condicao:
+                self._leitores -= 1
+                if not self._leitores:
+                    self._condicao.notify_all()
+
+    @contextmanager
+    def escrita(self):
+        with self._condicao:
+            self._escritores_esperando += 1
+            try:
+                while self._escrevendo or self._leitores:
+                    self._condicao.wait()
+            finally:
+                self._escritores_esperando -= 1
+            self._escrevendo = True
+        try:
+            yield
+        finally:
+            with self._condicao:
+                self._escrevendo = False
+                self._condicao.notify_all()
+
+
+class TravasEscola:
+    """Travas dos handlers: uma global e uma por turma, ambas leitura/escrita.
+
+    - `leitura(turma)`: global compartilhada + turma compartilhada (consultas);
+    - `escrita(turma)`: global compartilhada + turma exclusiva (alterações
+      dentro de uma turma, inclusive nos alunos dela);
+    - `leitura()` / `escrita()` sem turma: só a global, compartilhada ou
+      exclusiva (cadastros que mexem em professores, disciplinas ou na lista
+      de turmas e alunos).
+
+    A global é sempre adquirida antes da turma, então não há ciclo de espera.
+    """
+
+    def __init__(self):
+        self.global_ = TravaLeituraEscrita()
+        self._turmas = {}
+        self._lock = threading.Lock()
+
+    def turma(self, nome):
+        trava = self._turmas.get(nome)
+        if trava is None:
+            with self._lock:
+                trava = self._turmas.setdefault(nome, TravaLeituraEscrita())
+        return trava
+
+    @contextmanager
+    def leitura(self, turma=None):
+        with self.global_.leitura():
+            if turma is None:
+                yield
+            else:
+                with self.turma(turma).leitura():
+                    yield
+
+    @contextmanager
+    def escrita(self, turma=None):
+        if turma is None:
+            with self.global_.escrita():
+                yield
+        else:
+            with self.global_.leitura(), self.turma(turma).escrita():
+                yield
+
+
+def _estresse(threads=16, repeticoes=25):
+    """Dispara lançamentos concorrentes pelo mesmo caminho dos clientes e
+    confere que nenhuma alteração se perdeu."""
+    os.chdir(tempfile.mkdtemp())
+    import server
+
+    server.iniciar_banco()
+    turmas = ["T1", "T2", "T3", "T4"]
+    for turma in turmas:
+        server.processar_requisicao("cadastrar_turma", [turma])
+    server.processar_requisicao("cadastrar_professor", ["1", "PROF", "x"])
+    for turma in turmas:
+        server.processar_requisicao("cadastrar_disciplina", ["MAT", turma, "1"])
+        for i in range(10):
+            server.processar_requisicao("cadastrar_aluno", [f"{turma}R{i}", "ALUNO", "s", turma])
+
+    def trabalhador(indice):
+        turma = turmas[indice % len(turmas)]
+        tipo_nota = f"NP{indice}"
+        alunos = {f"{turma}R{i}": (indice + i) % 11 for i in range(10)}
+        for _ in range(repeticoes):
+            server.processar_requisicao("lancar_np_grades", ["MAT", turma, tipo_nota, alunos])
+            server.processar_requisicao("lista_chamada", [turma, {ra: False for ra in alunos}])
+            server.processar_requisicao("ver_notas_faltas_turma", ["MAT", turma])
+
+    inicio = time.perf_counter()
+    trabalhadores = [threading.Thread(target=trabalhador, args=(i,)) for i in range(threads)]
+    for t in trabalhadores:
+        t.start()
+    for t in trabalhadores:
+        t.join()
+    duracao = time.perf_counter() - inicio
+
+    perdidas = 0
+    dados = server.BANCO.dados
+    for indice in range(threads):
+        turma = turmas[indice % len(turmas)]
+        for i in range(10):
+            aluno = dados["alunos"][f"{turma}R{i}"]
+            if aluno["notas"]["MAT"].get(f"NP{indice}") != float((indice + i) % 11):
+                perdidas += 1
+    faltas_esperadas = {turma: repeticoes * sum(1 for i in range(threads) if turmas[i % len(turmas)] == turma) for turma in turmas}
+    for ra, aluno in dados["alunos"].items():
+        if aluno["faltas"] != faltas_esperadas[aluno["turma"]]:
+            perdidas += 1
+
+    server.BANCO.fechar()
+    print(f"{threads} threads x {repeticoes} rodadas em {duracao:.2f}s; alterações perdidas: {perdidas}")
+    return perdidas == 0
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2 or sys.argv[1] != "estresse":
+        print("Uso: python travas.py estresse")
+        sys.exit(1)
+    sys.exit(0 if _estresse() else 1)
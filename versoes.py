@@ -0,0 +1,121 @@
+import time
+
+CAMPOS_NP = ("NP1", "NP2")
+
+
+def chave_turma(turma):
+    return ("turma", turma)
+
+
+def chave_disciplina(turma, disciplina):
+    return ("disciplina", turma, disciplina)
+
+
+def chave_atividade(turma, disciplina, atividade):
+    return ("atividade", turma, disciplina, atividade)
+
+
+def chave_chamada(turma):
+    return ("chamada", turma)
+
+
+def chave_notas(turma, disciplina):
+    return ("notas", turma, disciplina)
+
+
+def chave_alunos_turma(turma):
+    return ("alunos_turma", turma)
+
+
+class Versoes:
+    """Número de versão de cada turma, disciplina e atividade.
+
+    A versão de uma entidade é o número de sequência da última alteração que
+    a atingiu; uma alteração numa atividade conta também para a disciplina e
+    a turma dela, e uma alteração num aluno conta para a turma dele (e para a
+    disciplina, se for uma nota). Entidades não alteradas desde que o
+    servidor subiu têm a versão inicial.
+
+    A chamada e o lançamento de NP de uma turma têm versões próprias, só do
+    que a tela mostrou ao professor: a chamada muda com as faltas, as notas
+    de uma disciplina com as NPs dela nos alunos da turma, e as duas com
+    quem entra, sai ou muda de nome na turma (`chave_alunos_turma`). Assim
+    uma entrega de atividade ou a chamada não invalidam um lançamento de NP
+    em andamento, nem o contrário.
+
+    As versões vivem só em memória. A sequência começa no relógio (em
+    microssegundos), então as versões de uma execução são sempre maiores que
+    as da anterior e uma versão antiga nunca coincide com uma nova.
+    """
+
+    def __init__(self, dados):
+        self.dados = dados
+        self.inicial = time.time_ns() // 1000
+        self._sequencia = self.inicial
+        self._versoes = {}
+
+    def versao(self, chave):
+        versao = self._versoes.get(chave, self.inicial)
+        if chave[0] in ("chamada", "notas"):
+            versao = max(versao, self._versoes.get(chave_alunos_turma(chave[1]), self.inicial))
+        return versao
+
+    def estado(self):
+        return {"inicial": self.inicial, "sequencia": self._sequencia,
+                "versoes": [[list(chave), versao] for chave, versao in self._versoes.items()]}
+
+    def restaurar(self, estado):
+        # Uma réplica que parte deste estado e registra as mesmas alterações,
+        # na mesma ordem, chega às mesmas versões.
+        self.inicial = estado["inicial"]
+        self._sequencia = estado["sequencia"]
+        self._versoes = {tuple(chave): versao for chave, versao in estado["versoes"]}
+
+    def registrar(self, caminho):
+        # Chamado pelo BancoDados com o lock, depois de aplicar a operação.
+        chaves = self._afetadas(caminho)
+        if not chaves:
+            return
+        self._sequencia += 1
+        for chave in chaves:
+            self._versoes[chave] = self._sequencia
+
+    def _afetadas(self, caminho):
+        raiz = caminho[0]
+        if len(caminho) < 2:
+            return []
+
+        if raiz == "turmas":
+            turma = caminho[1]
+            chaves = [chave_turma(turma)]
+            if len(caminho) >= 4 and caminho[2] == "disciplinas":
+                chaves.append(chave_disciplina(turma, caminho[3]))
+                if len(caminho) >= 6 and caminho[4] == "atividades":
+                    chaves.append(chave_atividade(turma, caminho[3], caminho[5]))
+            return chaves
+
+        if raiz == "alunos":
+            turma = self.dados["alunos"][caminho[1]]["turma"]
+            chaves = [chave_turma(turma)]
+            if len(caminho) == 2 or caminho[2] in ("nome", "turma"):
+                chaves.append(chave_alunos_turma(turma))
+            elif caminho[2] == "faltas":
+                chaves.append(chave_chamada(turma))
+            elif caminho[2] == "notas":
+                if len(caminho) >= 4:
+                    chaves.append(chave_disciplina(turma, caminho[3]))
+                    # Média de atividades e final são recalculadas a cada
+                    # entrega ou atividade nova; o lançamento só mostra as NPs.
+                    if len(caminho) == 4 or caminho[4] in CAMPOS_NP:
+                        chaves.append(chave_notas(turma, caminho[3]))
+                else:
+                    # Todas as notas do aluno de uma vez.
+                    chaves.append(chave_alunos_turma(turma))
+            return chaves
+
+        if raiz == "disciplinas":
+            info = self.dados["disciplinas"][caminho[1]]
+            if isinstance(info, dict) and "turma" in info and "nome_original" in info:
+                return [chave_turma(info["turma"]), chave_disciplina(info["turma"], info["nome_original"])]
+
+        return []